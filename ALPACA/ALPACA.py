@@ -294,6 +294,9 @@ class ALPACAWidget(ScriptedLoadableModuleWidget):
         self.ui.applyLandmarkMultiButton.connect(
             "clicked(bool)", self.onApplyLandmarkMulti
         )
+        self.ui.cancelLandmarkMultiButton.connect(
+            "clicked(bool)", self.onCancelLandmarkMulti
+        )
 
         # Template Selection connections
         self.ui.modelsMultiSelector.connect(
@@ -942,32 +945,60 @@ class ALPACAWidget(ScriptedLoadableModuleWidget):
             self.ui.showManualLMCheckBox.enabled = False
 
     def onApplyLandmarkMulti(self):
+        import threading
+
         logic = ALPACALogic()
         if self.ui.projectionCheckBoxMulti.checked is False:
             projectionFactor = 0
         else:
             projectionFactor = self.ui.projectionFactorSlider.value / 100
-        if not self.ui.replicateAnalysisCheckBox.checked:
-            logic.runLandmarkMultiprocess(
-                self.ui.sourceModelMultiSelector.currentPath,
-                self.ui.sourceFiducialMultiSelector.currentPath,
-                self.ui.targetModelMultiSelector.currentPath,
-                self.ui.landmarkOutputSelector.currentPath,
-                self.ui.scalingMultiCheckBox.checked,
-                projectionFactor,
-                self.ui.JSONFileFormatSelector.checked,
-                self.parameterDictionary,
-            )
-        else:
-            for i in range(0, self.ui.replicationNumberSpinBox.value):
-                print("ALPACA replication run ", i)
-                dateTimeStamp = datetime.now().strftime("%Y-%m-%d_%H_%M_%S")
-                datedOutputFolder = os.path.join(
-                    self.ui.landmarkOutputSelector.currentPath, dateTimeStamp
+        workers = self.ui.multiWorkerSpinBox.value or None
+        self.multiCancelEvent = threading.Event()
+
+        def updateProgress(pairsDone, pairNumber):
+            self.ui.multiProgressBar.maximum = pairNumber
+            self.ui.multiProgressBar.value = pairsDone
+            slicer.app.processEvents()
+
+        self.ui.applyLandmarkMultiButton.enabled = False
+        self.ui.cancelLandmarkMultiButton.enabled = True
+        self.ui.multiProgressBar.value = 0
+        try:
+            if not self.ui.replicateAnalysisCheckBox.checked:
+                failures = logic.runLandmarkMultiprocess(
+                    self.ui.sourceModelMultiSelector.currentPath,
+                    self.ui.sourceFiducialMultiSelector.currentPath,
+                    self.ui.targetModelMultiSelector.currentPath,
+                    self.ui.landmarkOutputSelector.currentPath,
+                    self.ui.scalingMultiCheckBox.checked,
+                    projectionFactor,
+                    self.ui.JSONFileFormatSelector.checked,
+                    self.parameterDictionary,
+                    workers=workers,
+                    cancelEvent=self.multiCancelEvent,
+                    progressCallback=updateProgress,
                 )
-                try:
-                    os.makedirs(datedOutputFolder)
-                    logic.runLandmarkMultiprocess(
+                if failures:
+                    print(f"{failures} pairs could not be aligned")
+            else:
+                failures = 0
+                for i in range(0, self.ui.replicationNumberSpinBox.value):
+                    if self.multiCancelEvent.is_set():
+                        break
+                    print("ALPACA replication run ", i)
+                    dateTimeStamp = datetime.now().strftime("%Y-%m-%d_%H_%M_%S")
+                    datedOutputFolder = os.path.join(
+                        self.ui.landmarkOutputSelector.currentPath, dateTimeStamp
+                    )
+                    try:
+                        os.makedirs(datedOutputFolder)
+                    except OSError:
+                        logging.debug(
+                            "Result directory failed: Could not access output folder"
+                        )
+                        print("Error creating result directory")
+                        continue
+                    failures += logic.runLandmarkMultiprocess(
                         self.ui.sourceModelMultiSelector.currentPath,
                         self.ui.sourceFiducialMultiSelector.currentPath,
                         self.ui.targetModelMultiSelector.currentPath,
@@ -976,12 +1007,22 @@ class ALPACAWidget(ScriptedLoadableModuleWidget):
                         projectionFactor,
                         self.ui.JSONFileFormatSelector.checked,
                         self.parameterDictionary,
+                        workers=workers,
+                        cancelEvent=self.multiCancelEvent,
+                        progressCallback=updateProgress,
                     )
-                except:
-                    logging.debug(
-                        "Result directory failed: Could not access output folder"
-                    )
-                    print("Error creating result directory")
+                if failures:
+                    print(f"{failures} pairs could not be aligned over all replicates")
+        finally:
+            self.ui.cancelLandmarkMultiButton.enabled = False
+            self.onSelectMultiProcess()
+        if self.multiCancelEvent.is_set():
+            print("ALPACA batch run cancelled")
+
+    def onCancelLandmarkMulti(self):
+        if hasattr(self, "multiCancelEvent"):
+            self.multiCancelEvent.set()
+        self.ui.cancelLandmarkMultiButton.enabled = False
 
     ###Connecting function for kmeans templates selection
     def onSelectKmeans(self):
@@ -1480,95 +1521,170 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
         projectionFactor,
         useJSONFormat,
         parameters,
+        workers=None,
+        memoryLimit=None,
+        cancelEvent=None,
+        progressCallback=None,
     ):
-        # extensionModel = ".ply"
+        """
+        Transfers the landmarks of the source model, or of every template model in the
+        sourceModelPath folder, to the models in targetModelDirectory. The (target, template)
+        pairs are aligned by alpaca_lib.runPairs in workers processes (None for the CPU count)
+        capped by memoryLimit bytes; cancelEvent and progressCallback(pairsDone, pairNumber)
+        are passed on to it. With templates, the estimate of every template and their median
+        are written for each target, and targets whose median file exists are skipped.
+        Returns the number of pairs that failed.
+        """
+        import ALPACALib.alpaca_lib as alpaca_lib
+
         if useJSONFormat:
             extensionLM = ".mrk.json"
         else:
             extensionLM = ".fcsv"
+        modelExtensions = (".ply", ".obj", ".vtk")
+        multiTemplate = os.path.isdir(sourceModelPath)
         sourceModelList = []
         sourceLMList = []
         TargetModelList = []
-        if os.path.isdir(sourceModelPath):
+        if multiTemplate:
             specimenOutput = os.path.join(outputDirectory, "individualEstimates")
             medianOutput = os.path.join(outputDirectory, "medianEstimates")
             os.makedirs(specimenOutput, exist_ok=True)
             os.makedirs(medianOutput, exist_ok=True)
             for file in os.listdir(sourceModelPath):
-                if file.endswith((".ply", ".obj", ".vtk")):
-                    sourceFilePath = os.path.join(sourceModelPath, file)
-                    sourceModelList.append(sourceFilePath)
+                if file.endswith(modelExtensions):
+                    sourceModelList.append(os.path.join(sourceModelPath, file))
         else:
             sourceModelList.append(sourceModelPath)
         if os.path.isdir(sourceLandmarkPath):
             for file in os.listdir(sourceLandmarkPath):
                 if file.endswith((".json", ".fcsv")):
-                    sourceFilePath = os.path.join(sourceLandmarkPath, file)
-                    sourceLMList.append(sourceFilePath)
+                    sourceLMList.append(os.path.join(sourceLandmarkPath, file))
         else:
             sourceLMList.append(sourceLandmarkPath)
-        # Iterate through target models
+
+        # Template landmarks are read once, in scene coordinates, and sent to workers
+        templates = []
+        for sourceFilePath in sourceModelList:
+            if multiTemplate:
+                baseName = os.path.splitext(os.path.basename(sourceFilePath))[0]
+                sourceLandmarkFile = None
+                for lmFile in sourceLMList:
+                    if baseName in lmFile:
+                        sourceLandmarkFile = lmFile
+                if sourceLandmarkFile is None:
+                    print(
+                        "::::Could not find the file corresponding to ", sourceFilePath
+                    )
+                    continue
+            else:
+                baseName = None
+                sourceLandmarkFile = sourceLandmarkPath
+            sourceLMNode = slicer.util.loadMarkups(sourceLandmarkFile)
+            sourceLMNode.GetDisplayNode().SetVisibility(False)
+            templates.append(
+                (
+                    sourceFilePath,
+                    baseName,
+                    slicer.util.arrayFromMarkupsControlPoints(sourceLMNode),
+                    sourceLMNode,
+                )
+            )
+
+        # the workers share the feature cache, so every model is subsampled once per setting
+        featureCacheSize = self.getFeatureCacheSize()
+        featureCacheFolder = self.getFeatureCacheFolder() if featureCacheSize else None
+        tasks = []
+        taskOutputs = []
+        targetEstimates = {}
         for targetFileName in os.listdir(targetModelDirectory):
-            if targetFileName.endswith((".ply", ".obj", ".vtk")):
-                targetFilePath = os.path.join(targetModelDirectory, targetFileName)
-                TargetModelList.append(targetFilePath)
-                rootName = os.path.splitext(targetFileName)[0]
-                landmarkList = []
-                if os.path.isdir(sourceModelPath):
-                    outputMedianPath = os.path.join(
-                        medianOutput, f"{rootName}_median" + extensionLM
+            if not targetFileName.endswith(modelExtensions):
+                continue
+            targetFilePath = os.path.join(targetModelDirectory, targetFileName)
+            TargetModelList.append(targetFilePath)
+            rootName = os.path.splitext(targetFileName)[0]
+            if multiTemplate:
+                outputMedianPath = os.path.join(
+                    medianOutput, f"{rootName}_median" + extensionLM
+                )
+                if os.path.exists(outputMedianPath):
+                    continue
+                targetEstimates[outputMedianPath] = [len(templates), []]
+            else:
+                outputMedianPath = None
+            for sourceFilePath, baseName, sourceLandmarks, sourceLMNode in templates:
+                if multiTemplate:
+                    outputFilePath = os.path.join(
+                        specimenOutput, f"{rootName}_{baseName}" + extensionLM
                     )
-                    if not os.path.exists(outputMedianPath):
-                        for file in sourceModelList:
-                            sourceFilePath = os.path.join(sourceModelPath, file)
-                            (baseName, ext) = os.path.splitext(os.path.basename(file))
-                            sourceLandmarkFile = None
-                            for lmFile in sourceLMList:
-                                if baseName in lmFile:
-                                    sourceLandmarkFile = os.path.join(
-                                        sourceLandmarkPath, lmFile
-                                    )
-                            if sourceLandmarkFile is None:
-                                print(
-                                    "::::Could not find the file corresponding to ",
-                                    file,
-                                )
-                                next
-                            outputFilePath = os.path.join(
-                                specimenOutput, f"{rootName}_{baseName}" + extensionLM
-                            )
-                            array = self.pairwiseAlignment(
-                                sourceFilePath,
-                                sourceLandmarkFile,
-                                targetFilePath,
-                                outputFilePath,
-                                scalingOption,
-                                projectionFactor,
-                                parameters,
-                            )
-                            landmarkList.append(array)
-                        medianLandmark = np.median(landmarkList, axis=0)
-                        outputMedianNode = self.exportPointCloud(
-                            medianLandmark, "Median Predicted Landmarks"
-                        )
-                        slicer.util.saveNode(outputMedianNode, outputMedianPath)
-                        slicer.mrmlScene.RemoveNode(outputMedianNode)
-                elif os.path.isfile(sourceModelPath):
-                    rootName = os.path.splitext(targetFileName)[0]
+                else:
                     outputFilePath = os.path.join(
                         outputDirectory, rootName + extensionLM
                     )
-                    array = self.pairwiseAlignment(
-                        sourceModelPath,
-                        sourceLandmarkPath,
-                        targetFilePath,
-                        outputFilePath,
-                        scalingOption,
-                        projectionFactor,
-                        parameters,
-                    )
-                else:
-                    print("::::Could not find the file or directory in question")
+                tasks.append(
+                    {
+                        "sourceModelPath": sourceFilePath,
+                        "sourceLandmarks": sourceLandmarks,
+                        "targetModelPath": targetFilePath,
+                        "scalingOption": scalingOption,
+                        "projectionFactor": projectionFactor,
+                        "parameters": parameters,
+                        "featureCacheFolder": featureCacheFolder,
+                        "featureCacheSize": featureCacheSize,
+                    }
+                )
+                taskOutputs.append((outputFilePath, outputMedianPath, sourceLMNode))
+
+        failures = []
+        if projectionFactor == 0:
+            outputNodeName = "Initial Predicted Landmarks"
+        else:
+            outputNodeName = "Refined Predicted Landmarks"
+
+        def savePair(taskIndex, result):
+            outputFilePath, outputMedianPath, sourceLMNode = taskOutputs[taskIndex]
+            if result["error"] is not None:
+                print(
+                    "::::Aligning",
+                    tasks[taskIndex]["sourceModelPath"],
+                    "to",
+                    tasks[taskIndex]["targetModelPath"],
+                    "failed:",
+                    result["error"],
+                )
+                failures.append(taskIndex)
+            else:
+                outputNode = self.exportPointCloud(result["landmarks"], outputNodeName)
+                self.propagateLandmarkTypes(sourceLMNode, outputNode)
+                slicer.util.saveNode(outputNode, outputFilePath)
+                slicer.mrmlScene.RemoveNode(outputNode)
+            if outputMedianPath is None:
+                return
+            # the median is written once every template of the target has finished
+            estimates = targetEstimates[outputMedianPath]
+            estimates[0] -= 1
+            if result["error"] is None:
+                estimates[1].append(result["landmarks"])
+            if estimates[0] == 0 and estimates[1]:
+                medianLandmark = np.median(estimates[1], axis=0)
+                outputMedianNode = self.exportPointCloud(
+                    medianLandmark, "Median Predicted Landmarks"
+                )
+                slicer.util.saveNode(outputMedianNode, outputMedianPath)
+                slicer.mrmlScene.RemoveNode(outputMedianNode)
+
+        try:
+            alpaca_lib.runPairs(
+                tasks,
+                workers=workers,
+                memoryLimit=memoryLimit,
+                cancelEvent=cancelEvent,
+                progressCallback=progressCallback,
+                resultCallback=savePair,
+            )
+        finally:
+            for template in templates:
+                slicer.mrmlScene.RemoveNode(template[3])
         extras = {
             "Source": sourceModelList,
             "SourceLandmarks": sourceLMList,
@@ -1579,6 +1695,7 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
         extras.update(parameters)
         parameterFile = os.path.join(outputDirectory, "advancedParameters.txt")
         json.dump(extras, open(parameterFile, "w"), indent=2)
+        return len(failures)
 
     def pairwiseAlignment(
         self,
@@ -1717,45 +1834,11 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
         return warpedModelNode
 
     def runCPDRegistration(self, sourceLM, sourceSLM, targetSLM, parameters):
-        sourceArrayCombined = np.append(sourceSLM, sourceLM, axis=0)
-        targetArray = np.asarray(targetSLM)
-
-        cloudSize = np.max(targetArray, 0) - np.min(targetArray, 0)
-
-        targetArray = targetArray * 25 / cloudSize
-        sourceArrayCombined = sourceArrayCombined * 25 / cloudSize
-
-        if parameters["Acceleration"] == 0:
-            registrationOutput = self.cpd_registration(
-                targetArray,
-                sourceArrayCombined,
-                parameters["CPDIterations"],
-                parameters["CPDTolerance"],
-                parameters["alpha"],
-                parameters["beta"],
-            )
-            deformed_array, _ = registrationOutput.register()
-        else:
-            targetPath = os.path.join(slicer.app.cachePath, "target.txt")
-            sourcePath = os.path.join(slicer.app.cachePath, "source.txt")
-            np.savetxt(targetPath, targetArray, delimiter=",")
-            np.savetxt(sourcePath, sourceArrayCombined, delimiter=",")
-            path = os.path.join(parameters["BCPDFolder"], "bcpd")
-            cmd = f'"{path}" -x "{targetPath}" -y "{sourcePath}" -l{parameters["alpha"]} -b{parameters["beta"]} -g0.1 -K140 -J500 -c1e-6 -p -d7 -e0.3 -f0.3 -ux -N1'
-            cp = subprocess.run(
-                cmd, shell=True, check=True, text=True, capture_output=True
-            )
-            deformed_array = np.loadtxt("output_y.txt")
-            for fl in glob.glob("output*.txt"):
-                os.remove(fl)
-            os.remove(targetPath)
-            os.remove(sourcePath)
-        # Capture output landmarks from source pointcloud
-        fiducial_prediction = deformed_array[-len(sourceLM) :]
-
-        fiducialCloud = fiducial_prediction
-        fiducialCloud = fiducialCloud * cloudSize / 25
-        return fiducialCloud
+        import ALPACALib.alpaca_lib as alpaca_lib
+
+        return alpaca_lib.runCPDRegistration(
+            sourceLM, sourceSLM, targetSLM, parameters, slicer.app.cachePath
+        )
 
     def RAS2LPSTransform(self, modelNode):
         matrix = vtk.vtkMatrix4x4()
@@ -1852,79 +1935,29 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
         return modelNode
 
     def find_knn_cpu(self, feat0, feat1, knn=1, return_distance=False):
-        from scipy.spatial import cKDTree
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        feat1tree = cKDTree(feat1)
-        dists, nn_inds = feat1tree.query(feat0, k=knn)
-        if return_distance:
-            return nn_inds, dists
-        else:
-            return nn_inds
+        return alpaca_lib.findNearestNeighbors(feat0, feat1, knn, return_distance)
 
     def find_correspondences(self, feats0, feats1, mutual_filter=True):
         """
         Using the FPFH features find noisy corresspondes.
         These corresspondes will be used inside the RANSAC.
         """
-        nns01, dists1 = self.find_knn_cpu(feats0, feats1, knn=1, return_distance=True)
-        corres01_idx0 = np.arange(len(nns01))
-        corres01_idx1 = nns01
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        if not mutual_filter:
-            return corres01_idx0, corres01_idx1
-
-        nns10, dists2 = self.find_knn_cpu(feats1, feats0, knn=1, return_distance=True)
-        corres10_idx1 = np.arange(len(nns10))
-        corres10_idx0 = nns10
-
-        mutual_filter = corres10_idx0[corres01_idx1] == corres01_idx0
-        corres_idx0 = corres01_idx0[mutual_filter]
-        corres_idx1 = corres01_idx1[mutual_filter]
-
-        return corres_idx0, corres_idx1
+        return alpaca_lib.findCorrespondences(feats0, feats1, mutual_filter)
 
     # Returns the fitness of alignment of two pointSets
     def get_fitness(
         self, movingMeshPoints, fixedMeshPoints, distanceThrehold, transform=None
     ):
-        import itk
-
-        movingPointSet = itk.Mesh.F3.New()
-        movingPointSet.SetPoints(
-            itk.vector_container_from_array(
-                movingMeshPoints.flatten().astype("float32")
-            )
-        )
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        fixedPointSet = itk.Mesh.F3.New()
-        fixedPointSet.SetPoints(
-            itk.vector_container_from_array(fixedMeshPoints.flatten().astype("float32"))
+        return alpaca_lib.getFitness(
+            movingMeshPoints, fixedMeshPoints, distanceThrehold, transform
         )
 
-        if transform is not None:
-            movingPointSet = itk.transform_mesh_filter(
-                movingPointSet, transform=transform
-            )
-
-        PointType = itk.Point[itk.F, 3]
-        PointsContainerType = itk.VectorContainer[itk.IT, PointType]
-        pointsLocator = itk.PointsLocator[PointsContainerType].New()
-        pointsLocator.SetPoints(fixedPointSet.GetPoints())
-        pointsLocator.Initialize()
-
-        fitness = 0
-        inlier_rmse = 0
-        for i in range(movingPointSet.GetNumberOfPoints()):
-            closestPoint = pointsLocator.FindClosestPoint(movingPointSet.GetPoint(i))
-            distance = (
-                fixedPointSet.GetPoint(closestPoint) - movingPointSet.GetPoint(i)
-            ).GetNorm()
-            if distance < distanceThrehold:
-                fitness = fitness + 1
-                inlier_rmse = inlier_rmse + distance
-
-        return fitness / movingPointSet.GetNumberOfPoints(), inlier_rmse / fitness
-
     # RANSAC using package
     def ransac_using_package(
         self,
@@ -1939,123 +1972,19 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
         check_edge_length,
         correspondence_distance,
     ):
-        import itk
-
-        def GenerateData(data, agreeData):
-            """
-            In current implementation the agreedata contains two corresponding
-            points from moving and fixed mesh. However, after the subsampling step the
-            number of points need not be equal in those meshes. So we randomly sample
-            the points from larger mesh.
-            """
-            data.reserve(movingMeshFeaturePoints.shape[0])
-            for i in range(movingMeshFeaturePoints.shape[0]):
-                point1 = movingMeshFeaturePoints[i]
-                point2 = fixedMeshFeaturePoints[i]
-                input_data = [
-                    point1[0],
-                    point1[1],
-                    point1[2],
-                    point2[0],
-                    point2[1],
-                    point2[2],
-                ]
-                input_data = [float(x) for x in input_data]
-                data.push_back(input_data)
-
-            count_min = int(
-                np.min([movingMeshPoints.shape[0], fixedMeshPoints.shape[0]])
-            )
-
-            mesh1_points = copy.deepcopy(movingMeshPoints)
-            mesh2_points = copy.deepcopy(fixedMeshPoints)
-
-            np.random.seed(0)
-            np.random.shuffle(mesh1_points)
-            np.random.seed(0)
-            np.random.shuffle(mesh2_points)
-
-            agreeData.reserve(count_min)
-            for i in range(count_min):
-                point1 = mesh1_points[i]
-                point2 = mesh2_points[i]
-                input_data = [
-                    point1[0],
-                    point1[1],
-                    point1[2],
-                    point2[0],
-                    point2[1],
-                    point2[2],
-                ]
-                input_data = [float(x) for x in input_data]
-                agreeData.push_back(input_data)
-            return
-
-        data = itk.vector[itk.Point[itk.D, 6]]()
-        agreeData = itk.vector[itk.Point[itk.D, 6]]()
-        GenerateData(data, agreeData)
-
-        transformParameters = itk.vector.D()
-        bestTransformParameters = itk.vector.D()
-
-        itk.MultiThreaderBase.SetGlobalDefaultThreader(
-            itk.MultiThreaderBase.ThreaderTypeFromString("POOL")
-        )
-        maximumDistance = inlier_value
-        if not scalingOption:
-            print("Rigid Reg, no scaling")
-            TransformType = itk.VersorRigid3DTransform[itk.D]
-            RegistrationEstimatorType = itk.Ransac.LandmarkRegistrationEstimator[
-                6, TransformType
-            ]
-        else:
-            print("NonRigid Reg, with scaling")
-            TransformType = itk.Similarity3DTransform[itk.D]
-            RegistrationEstimatorType = itk.Ransac.LandmarkRegistrationEstimator[
-                6, TransformType
-            ]
-        registrationEstimator = RegistrationEstimatorType.New()
-        registrationEstimator.SetMinimalForEstimate(number_of_ransac_points)
-        registrationEstimator.SetAgreeData(agreeData)
-        registrationEstimator.SetDelta(maximumDistance)
-        registrationEstimator.LeastSquaresEstimate(data, transformParameters)
-
-        maxThreadCount = int(
-            itk.MultiThreaderBase.New().GetMaximumNumberOfThreads() / 2
-        )
-
-        desiredProbabilityForNoOutliers = 0.99
-        RANSACType = itk.RANSAC[itk.Point[itk.D, 6], itk.D, TransformType]
-        ransacEstimator = RANSACType.New()
-        ransacEstimator.SetData(data)
-        ransacEstimator.SetAgreeData(agreeData)
-        ransacEstimator.SetCheckCorresspondenceDistance(check_edge_length)
-        if correspondence_distance > 0:
-            ransacEstimator.SetCheckCorrespondenceEdgeLength(correspondence_distance)
-        ransacEstimator.SetMaxIteration(int(number_of_iterations / maxThreadCount))
-        ransacEstimator.SetNumberOfThreads(maxThreadCount)
-        ransacEstimator.SetParametersEstimator(registrationEstimator)
-
-        percentageOfDataUsed = ransacEstimator.Compute(
-            transformParameters, desiredProbabilityForNoOutliers
-        )
-
-        transform = TransformType.New()
-        p = transform.GetParameters()
-        f = transform.GetFixedParameters()
-        for i in range(p.GetSize()):
-            p.SetElement(i, transformParameters[i])
-        counter = 0
-        totalParameters = p.GetSize() + f.GetSize()
-        for i in range(p.GetSize(), totalParameters):
-            f.SetElement(counter, transformParameters[i])
-            counter = counter + 1
-        transform.SetParameters(p)
-        transform.SetFixedParameters(f)
-        return (
-            itk.dict_from_transform(transform),
-            percentageOfDataUsed[0],
-            percentageOfDataUsed[1],
+        import ALPACALib.alpaca_lib as alpaca_lib
+
+        return alpaca_lib.ransacRegistration(
+            movingMeshPoints,
+            fixedMeshPoints,
+            movingMeshFeaturePoints,
+            fixedMeshFeaturePoints,
+            number_of_iterations,
+            number_of_ransac_points,
+            inlier_value,
+            scalingOption,
+            check_edge_length,
+            correspondence_distance,
         )
 
     def get_euclidean_distance(
@@ -2085,132 +2014,41 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
     def get_correspondence_and_fitness(
         self, fixedPoints, movingPoints, distanceThreshold, transform=None
     ):
-        import itk
-
-        movingPointSet = itk.Mesh.F3.New()
-        movingPointSet.SetPoints(
-            itk.vector_container_from_array(movingPoints.flatten().astype("float32"))
-        )
-
-        fixedPointSet = itk.Mesh.F3.New()
-        fixedPointSet.SetPoints(
-            itk.vector_container_from_array(fixedPoints.flatten().astype("float32"))
-        )
+        """
+        Returns the inlier fixed and moving points, the inlier count, the inlier RMSE and the
+        (inliers x 2) array of fixed and moving point indices.
+        """
+        import ALPACALib.alpaca_lib as alpaca_lib
 
         if transform is not None:
-            movingPointSet = itk.transform_mesh_filter(
-                movingPointSet, transform=transform
-            )
-
-        PointType = itk.Point[itk.F, 3]
-        PointsContainerType = itk.VectorContainer[itk.IT, PointType]
-        pointsLocator = itk.PointsLocator[PointsContainerType].New()
-        pointsLocator.SetPoints(fixedPointSet.GetPoints())
-        pointsLocator.Initialize()
-
-        fixed_array = itk.VectorContainer[itk.IT, itk.Point[itk.D, 3]].New()
-        moving_array = itk.VectorContainer[itk.IT, itk.Point[itk.D, 3]].New()
-        index_array = []
-
-        fitness = 0
-        inlier_rmse = 0
-        count = 0
-        for i in range(movingPointSet.GetNumberOfPoints()):
-            closestPoint = pointsLocator.FindClosestPoint(movingPointSet.GetPoint(i))
-            distance = (
-                fixedPointSet.GetPoint(closestPoint) - movingPointSet.GetPoint(i)
-            ).GetNorm()
-            if distance < distanceThreshold:
-                fitness = fitness + 1
-                inlier_rmse = inlier_rmse + distance
-                fixed_point = fixedPointSet.GetPoint(closestPoint)
-                moving_point = movingPointSet.GetPoint(i)
-                index_array.append([closestPoint, i])
-                fixed_array.InsertElement(count, fixed_point)
-                moving_array.InsertElement(count, moving_point)
-                count = count + 1
-
+            movingPoints = alpaca_lib.transformPoints(movingPoints, transform)
+        _, inlierRMSE, correspondences = alpaca_lib.FitnessEvaluator(
+            fixedPoints
+        ).evaluate(movingPoints, distanceThreshold)
         return (
-            fixed_array,
-            moving_array,
-            fitness,
-            inlier_rmse / fitness,
-            np.array(index_array),
+            np.asarray(fixedPoints)[correspondences[:, 0]],
+            np.asarray(movingPoints)[correspondences[:, 1]],
+            len(correspondences),
+            inlierRMSE,
+            correspondences,
         )
 
     def final_iteration_icp(
         self, fixedPoints, movingPoints, distanceThreshold, normalSearchRadius
     ):
-        import itk
-        fixedPointsNormal = self.extract_pca_normal_scikit(
-            fixedPoints, normalSearchRadius
-        )
-        movingPointsNormal = self.extract_pca_normal_scikit(
-            movingPoints, normalSearchRadius
-        )
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        _, (T, R, t) = self.point_to_plane_icp(
-            movingPoints,
-            fixedPoints,
-            movingPointsNormal,
-            fixedPointsNormal,
-            distanceThreshold,
+        return alpaca_lib.finalIterationICP(
+            fixedPoints, movingPoints, distanceThreshold, normalSearchRadius
         )
 
-        transform = itk.Rigid3DTransform.D.New()
-        transform.SetMatrix(itk.matrix_from_array(R), 0.000001)
-        transform.SetTranslation([t[0], t[1], t[2]])
-        return movingPoints, transform
-
     def euler_matrix(self, ai, aj, ak):
-        """Return homogeneous rotation matrix from Euler angles and axis sequence.
+        """Return homogeneous rotation matrix from Euler angles.
         ai, aj, ak : Euler's roll, pitch and yaw angles
-        axes : One of 24 axis sequences as string or encoded tuple
-        >>> R = euler_matrix(1, 2, 3, 'syxz')
-        >>> numpy.allclose(numpy.sum(R[0]), -1.34786452)
-        True
-        >>> R = euler_matrix(1, 2, 3, (0, 1, 0, 1))
         """
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        firstaxis, parity, repetition, frame = (0, 0, 0, 0)
-        _NEXT_AXIS = [1, 2, 0, 1]
-
-        i = firstaxis
-        j = _NEXT_AXIS[i + parity]
-        k = _NEXT_AXIS[i - parity + 1]
-
-        if frame:
-            ai, ak = ak, ai
-        if parity:
-            ai, aj, ak = -ai, -aj, -ak
-
-        si, sj, sk = math.sin(ai), math.sin(aj), math.sin(ak)
-        ci, cj, ck = math.cos(ai), math.cos(aj), math.cos(ak)
-        cc, cs = ci * ck, ci * sk
-        sc, ss = si * ck, si * sk
-
-        M = np.identity(4)
-        if repetition:
-            M[i, i] = cj
-            M[i, j] = sj * si
-            M[i, k] = sj * ci
-            M[j, i] = sj * sk
-            M[j, j] = -cj * ss + cc
-            M[j, k] = -cj * cs - sc
-            M[k, i] = -sj * ck
-            M[k, j] = cj * sc + cs
-            M[k, k] = cj * cc - ss
-        else:
-            M[i, i] = cj * ck
-            M[i, j] = sj * sc - cs
-            M[i, k] = sj * cc + ss
-            M[j, i] = cj * sk
-            M[j, j] = sj * ss + cc
-            M[j, k] = sj * cs - sc
-            M[k, i] = -sj
-            M[k, j] = cj * si
-            M[k, k] = cj * ci
-        return M
+        return alpaca_lib.eulerMatrix(ai, aj, ak)
 
     def best_fit_transform_point2plane(self, A, B, normals):
         """
@@ -2224,45 +2062,9 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
             R: mxm rotation matrix
             t: mx1 translation vector
         """
-        assert A.shape == B.shape
-        assert A.shape == normals.shape
-
-        H = []
-        b = []
-        for i in range(A.shape[0]):
-            dx = B[i, 0]
-            dy = B[i, 1]
-            dz = B[i, 2]
-            nx = normals[i, 0]
-            ny = normals[i, 1]
-            nz = normals[i, 2]
-            sx = A[i, 0]
-            sy = A[i, 1]
-            sz = A[i, 2]
-
-            _a1 = (nz * sy) - (ny * sz)
-            _a2 = (nx * sz) - (nz * sx)
-            _a3 = (ny * sx) - (nx * sy)
-
-            _a = np.array([_a1, _a2, _a3, nx, ny, nz])
-            _b = (nx * dx) + (ny * dy) + (nz * dz) - (nx * sx) - (ny * sy) - (nz * sz)
-
-            H.append(_a)
-            b.append(_b)
-
-        H = np.array(H)
-        b = np.array(b)
-
-        tr = np.dot(np.linalg.pinv(H), b)
-        T = self.euler_matrix(tr[0], tr[1], tr[2])
-        T[0, 3] = tr[3]
-        T[1, 3] = tr[4]
-        T[2, 3] = tr[5]
-
-        R = T[:3, :3]
-        t = T[:3, 3]
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        return T, R, t
+        return alpaca_lib.bestFitTransformPointToPlane(A, B, normals)
 
     def best_fit_transform_point2point(self, A, B):
         """
@@ -2317,12 +2119,9 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
             distances: Euclidean distances of the nearest neighbor
             indices: dst indices of the nearest neighbor
         """
-            # assert src.shape == dst.shape
-        from sklearn.neighbors import NearestNeighbors
-        neigh = NearestNeighbors(n_neighbors=1, algorithm="kd_tree")
-        neigh.fit(dst)
-        distances, indices = neigh.kneighbors(src, return_distance=True)
-        return distances.ravel(), indices.ravel()
+        import ALPACALib.alpaca_lib as alpaca_lib
+
+        return alpaca_lib.nearestNeighbor(src, dst)
 
     def point_to_plane_icp(
         self,
@@ -2346,80 +2145,17 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
                 T: final homogeneous transformation that maps A on to B
                 MeanError: list, report each iteration's distance mean error
         """
-        A = src_pts
-        A_normals = src_pt_normals
-        B = dst_pts
-        B_normals = dst_pt_normals
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        # get number of dimensions
-        m = A.shape[1]
-
-        # make points homogeneous, copy them to maintain the originals
-        src = np.ones((m + 1, A.shape[0]))
-        dst = np.ones((m + 1, B.shape[0]))
-        src[:m, :] = np.copy(A.T)
-        dst[:m, :] = np.copy(B.T)
-
-        prev_error = 0
-        MeanError = []
-
-        finalT = np.identity(4)
-
-        for i in range(max_iterations):
-            # find the nearest neighbors between the current source and destination points
-            distances, indices = self.nearest_neighbor(src[:m, :].T, dst[:m, :].T)
-
-            # match each point of source-set to closest point of destination-set,
-            matched_src_pts = src[:m, :].T.copy()
-            matched_dst_pts = dst[:m, indices].T
-
-            # compute angle between 2 matched vertexs' normals
-            matched_src_pt_normals = A_normals.copy()
-            matched_dst_pt_normals = B_normals[indices, :]
-            angles = np.zeros(matched_src_pt_normals.shape[0])
-            for k in range(matched_src_pt_normals.shape[0]):
-                v1 = matched_src_pt_normals[k, :]
-                v2 = matched_dst_pt_normals[k, :]
-                cos_angle = v1.dot(v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
-                angles[k] = np.arccos(cos_angle) / np.pi * 180
-
-            # and reject the bad corresponding
-            # dist_threshold = np.inf
-            dist_bool_flag = distances < dist_threshold
-            angle_threshold = 20
-            angle_bool_flag = angles < angle_threshold
-            reject_part_flag = dist_bool_flag  # * angle_bool_flag
-
-            # get matched vertices and dst_vertexes' normals
-            matched_src_pts = matched_src_pts[reject_part_flag, :]
-            matched_dst_pts = matched_dst_pts[reject_part_flag, :]
-            matched_dst_pt_normals = matched_dst_pt_normals[reject_part_flag, :]
-
-            # compute the transformation between the current source and nearest destination points
-            T, _, _ = self.best_fit_transform_point2plane(
-                matched_src_pts, matched_dst_pts, matched_dst_pt_normals
-            )
-
-            finalT = np.dot(T, finalT)
-
-            # update the current source
-            src = np.dot(T, src)
-
-            # print iteration
-            # print('\ricp iteration: %d/%d ...' % (i+1, max_iterations), end='', flush=True)
-
-            # check error
-            mean_error = np.mean(distances[reject_part_flag])
-            MeanError.append(mean_error)
-            if tolerance is not None:
-                if np.abs(prev_error - mean_error) < tolerance:
-                    break
-            prev_error = mean_error
-        print("Refinement took ", i, " iterations")
-        # calculate final transformation
-        # T, R, t = self.best_fit_transform_point2point(A, src[:m, :].T)
-        # return MeanError, (T, R, t)
-        return MeanError, (finalT, finalT[:3, :3], finalT[:, 3])
+        return alpaca_lib.pointToPlaneICP(
+            src_pts,
+            dst_pts,
+            src_pt_normals,
+            dst_pt_normals,
+            dist_threshold,
+            max_iterations,
+            tolerance,
+        )
 
     def get_numpy_points_from_vtk(self, vtk_polydata):
         """
@@ -2440,18 +2176,9 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
         return vtk_polydata
 
     def transform_numpy_points(self, points_np, transform):
-        import itk
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        mesh = itk.Mesh[itk.F, 3].New()
-        mesh.SetPoints(
-            itk.vector_container_from_array(points_np.flatten().astype("float32"))
-        )
-        transformed_mesh = itk.transform_mesh_filter(mesh, transform=transform)
-        points_tranformed = itk.array_from_vector_container(
-            transformed_mesh.GetPoints()
-        )
-        points_tranformed = np.reshape(points_tranformed, [-1, 3])
-        return points_tranformed
+        return alpaca_lib.transformPoints(points_np, transform)
 
     def estimateTransform(
         self,
@@ -2463,171 +2190,17 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
         scalingOption,
         parameters,
     ):
-        import itk
-
-        similarityFlag = False
-        # Establish correspondences by nearest neighbour search in feature space
-        corrs_A, corrs_B = self.find_correspondences(
-            targetFeatures, sourceFeatures, mutual_filter=True
-        )
-
-        targetPoints = targetPoints.T
-        sourcePoints = sourcePoints.T
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        fixed_corr = targetPoints[:, corrs_A]  # np array of size 3 by num_corrs
-        moving_corr = sourcePoints[:, corrs_B]  # np array of size 3 by num_corrs
-
-        num_corrs = fixed_corr.shape[1]
-        print(f"FPFH generates {num_corrs} putative correspondences.")
-
-        targetPoints = targetPoints.T
-        sourcePoints = sourcePoints.T
-
-        # Check corner case when both meshes are same
-        if np.allclose(fixed_corr, moving_corr):
-            print("Same meshes therefore returning Identity Transform")
-            transform = itk.VersorRigid3DTransform[itk.D].New()
-            transform.SetIdentity()
-            return [transform, transform]
-
-        import time
-
-        bransac = time.time()
-
-        maxAttempts = 1
-        attempt = 0
-        best_fitness = -1
-        best_rmse = np.inf
-        while attempt < maxAttempts:
-            # Perform Initial alignment using Ransac parallel iterations with no scaling
-            transform_matrix, fitness, rmse = self.ransac_using_package(
-                movingMeshPoints=sourcePoints,
-                fixedMeshPoints=targetPoints,
-                movingMeshFeaturePoints=moving_corr.T,
-                fixedMeshFeaturePoints=fixed_corr.T,
-                number_of_iterations=parameters["maxRANSAC"],
-                number_of_ransac_points=3,
-                inlier_value=float(parameters["distanceThreshold"]) * voxelSize,
-                scalingOption=False,
-                check_edge_length=True,
-                correspondence_distance=0.9,
-            )
-
-            transform = itk.transform_from_dict(transform_matrix)
-            fitness_forward, rmse_forward = self.get_fitness(
-                sourcePoints,
-                targetPoints,
-                float(parameters["distanceThreshold"]) * voxelSize,
-                transform,
-            )
-
-            mean_fitness = fitness_forward
-            mean_rmse = rmse_forward
-            print(
-                "Non-Scaling Attempt = ",
-                attempt,
-                " Fitness = ",
-                mean_fitness,
-                " RMSE is ",
-                mean_rmse,
-            )
-
-            if mean_fitness > 0.99:
-                # Only compare RMSE if mean_fitness is greater than 0.99
-                if mean_rmse < best_rmse:
-                    best_fitness = mean_fitness
-                    best_rmse = mean_rmse
-                    best_transform = transform_matrix
-            else:
-                if mean_fitness > best_fitness:
-                    best_fitness = mean_fitness
-                    best_rmse = mean_rmse
-                    best_transform = transform_matrix
-
-            # Rigid Transform is un-fit for this use-case so perform scaling based RANSAC
-            # if mean_fitness < 0.9:
-            #  break
-            attempt = attempt + 1
-
-        print("Best Fitness without Scaling ", best_fitness, " RMSE is ", best_rmse)
-
-        if scalingOption:
-            maxAttempts = 10
-            attempt = 0
-
-            correspondence_distance = 0.9
-            ransac_points = 3
-            ransac_iterations = int(parameters["maxRANSAC"])
-
-            while mean_fitness < 0.99 and attempt < maxAttempts:
-                transform_matrix, fitness, rmse = self.ransac_using_package(
-                    movingMeshPoints=sourcePoints,
-                    fixedMeshPoints=targetPoints,
-                    movingMeshFeaturePoints=moving_corr.T,
-                    fixedMeshFeaturePoints=fixed_corr.T,
-                    number_of_iterations=ransac_iterations,
-                    number_of_ransac_points=ransac_points,
-                    inlier_value=float(parameters["distanceThreshold"]) * voxelSize,
-                    scalingOption=True,
-                    check_edge_length=False,
-                    correspondence_distance=correspondence_distance,
-                )
-
-                transform = itk.transform_from_dict(transform_matrix)
-                fitness_forward, rmse_forward = self.get_fitness(
-                    sourcePoints,
-                    targetPoints,
-                    float(parameters["distanceThreshold"]) * voxelSize,
-                    transform,
-                )
-
-                mean_fitness = fitness_forward
-                mean_rmse = rmse_forward
-                print(
-                    "Scaling Attempt = ",
-                    attempt,
-                    " Fitness = ",
-                    mean_fitness,
-                    " RMSE = ",
-                    mean_rmse,
-                )
-
-                if (mean_fitness > best_fitness) or (
-                    mean_fitness == best_fitness and mean_rmse < best_rmse
-                ):
-                    best_fitness = mean_fitness
-                    best_rmse = mean_rmse
-                    best_transform = transform_matrix
-                    similarityFlag = True
-                attempt = attempt + 1
-
-        aransac = time.time()
-        print("RANSAC Duraction ", aransac - bransac)
-        print("Best Fitness after scaling ", best_fitness)
-
-        first_transform = itk.transform_from_dict(best_transform)
-        sourcePoints = self.transform_numpy_points(sourcePoints, first_transform)
-
-        print("-----------------------------------------------------------")
-        print(parameters)
-        print("Starting Rigid Refinement")
-        distanceThreshold = parameters["ICPDistanceThreshold"] * voxelSize
-        inlier, rmse = self.get_fitness(sourcePoints, targetPoints, distanceThreshold)
-        print("Before Inlier = ", inlier, " RMSE = ", rmse)
-        _, second_transform = self.final_iteration_icp(
-            targetPoints,
+        return alpaca_lib.estimateTransform(
             sourcePoints,
-            distanceThreshold,
-            float(parameters["normalSearchRadius"] * voxelSize),
-        )
-
-        final_mesh_points = self.transform_numpy_points(sourcePoints, second_transform)
-        inlier, rmse = self.get_fitness(
-            final_mesh_points, targetPoints, distanceThreshold
+            targetPoints,
+            sourceFeatures,
+            targetFeatures,
+            voxelSize,
+            scalingOption,
+            parameters,
         )
-        print("After Inlier = ", inlier, " RMSE = ", rmse)
-        first_transform.Compose(second_transform)
-        return first_transform, similarityFlag
 
     def set_numpy_points_in_vtk(self, vtk_polydata, points_as_numpy):
         """
@@ -2672,103 +2245,34 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
         Return sub-sampled points as numpy array.
         The radius might need to be tuned as per the requirements.
         """
-        import vtk
-        from vtk.util import numpy_support
-
-        f = vtk.vtkPoissonDiskSampler()
-        f.SetInputData(inputMesh)
-        f.SetRadius(radius)
-        f.Update()
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        sampled_points = f.GetOutput()
-        return sampled_points
+        return alpaca_lib.subsamplePointsPoisson(inputMesh, radius)
 
     def subsample_points_voxelgrid_polydata(self, inputMesh, radius):
-        subsample = vtk.vtkVoxelGrid()
-        subsample.SetInputData(inputMesh)
-        subsample.SetConfigurationStyleToLeafSize()
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        subsample.SetLeafSize(radius, radius, radius)
-        subsample.Update()
-        points = subsample.GetOutput()
-        return points
+        return alpaca_lib.subsamplePointsVoxelGrid(inputMesh, radius)
 
     def extract_pca_normal_scikit(self, inputPoints, searchRadius):
-        from sklearn.neighbors import KDTree
-        from sklearn.decomposition import PCA
-
-        data = inputPoints
-        tree = KDTree(data, metric="minkowski")  # minkowki is p2 (euclidean)
-
-        # Get indices and distances:
-        ind, dist = tree.query_radius(data, r=searchRadius, return_distance=True)
-
-        def PCA_unit_vector(array, pca=PCA(n_components=3)):
-            pca.fit(array)
-            eigenvalues = pca.explained_variance_
-            return pca.components_[np.argmin(eigenvalues)]
-
-        def calc_angle_with_xy(vectors):
-            l = np.sum(vectors[:, :2] ** 2, axis=1) ** 0.5
-            return np.arctan2(vectors[:, 2], l)
-
-        normals2 = []
-        for i in range(data.shape[0]):
-            if len(ind[i]) < 3:
-                normal_vector = np.identity(3)
-            else:
-                normal_vector = data[ind[i]]
-            normals2.append(PCA_unit_vector(normal_vector))
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        n = np.array(normals2)
-        n[calc_angle_with_xy(n) < 0] *= -1
-        return n
+        return alpaca_lib.extractPCANormalsInRadius(inputPoints, searchRadius)
 
     def extract_pca_normal(self, mesh, normalNeighbourCount):
-        import vtk
-        from vtk.util import numpy_support
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        normals = vtk.vtkPCANormalEstimation()
-        normals.SetSampleSize(normalNeighbourCount)
-        # normals.SetFlipNormals(True)
-        normals.SetNormalOrientationToPoint()
-        # normals.SetNormalOrientationToGraphTraversal()
-        normals.SetInputData(mesh)
-        normals.Update()
-        out1 = normals.GetOutput()
-        normal_array = numpy_support.vtk_to_numpy(out1.GetPointData().GetNormals())
-        point_array = numpy_support.vtk_to_numpy(mesh.GetPoints().GetData())
-        return point_array, normal_array
+        return alpaca_lib.extractPCANormals(mesh, normalNeighbourCount)
 
     def get_fpfh_feature(self, points_np, normals_np, radius, neighbors):
-        import itk
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        pointset = itk.PointSet[itk.F, 3].New()
-        pointset.SetPoints(
-            itk.vector_container_from_array(points_np.flatten().astype("float32"))
-        )
-
-        normalset = itk.PointSet[itk.F, 3].New()
-        normalset.SetPoints(
-            itk.vector_container_from_array(normals_np.flatten().astype("float32"))
-        )
-        fpfh = itk.Fpfh.PointFeature.MF3MF3.New()
-        fpfh.ComputeFPFHFeature(pointset, normalset, float(radius), int(neighbors))
-        result = fpfh.GetFpfhFeature()
-
-        fpfh_feats = itk.array_from_vector_container(result)
-        fpfh_feats = np.reshape(fpfh_feats, [33, pointset.GetNumberOfPoints()]).T
-        return fpfh_feats
+        return alpaca_lib.getFPFHFeatures(points_np, normals_np, radius, neighbors)
 
     def getBoxLengths(self, inputMesh):
-        import vtk
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        box_filter = vtk.vtkBoundingBox()
-        box_filter.SetBounds(inputMesh.GetBounds())
-        diagonalLength = box_filter.GetDiagonalLength()
-        fixedLengths = [0.0, 0.0, 0.0]
-        box_filter.GetLengths(fixedLengths)
-        return fixedLengths, diagonalLength
+        return alpaca_lib.getBoxLengths(inputMesh)
 
     def runSubsample(
         self,
@@ -2778,85 +2282,40 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
         parameters,
         usePoissonSubsample=False,
     ):
-        print("parameters are ", parameters)
-        print(":: Loading point clouds and downsampling")
-
-        sourceModelMesh = sourceModel.GetMesh()
-        targetModelMesh = targetModel.GetMesh()
-
-        # Scale the mesh and the landmark points
-        fixedBoxLengths, fixedlength = self.getBoxLengths(targetModelMesh)
-        movingBoxLengths, movinglength = self.getBoxLengths(sourceModelMesh)
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        # Sub-Sample the points for rigid refinement and deformable registration
-        point_density = parameters["pointDensity"]
-
-        # Voxel size is the diagonal length of cuboid in the voxelGrid
-        voxel_size = np.sqrt(np.sum(np.square(np.array(fixedBoxLengths)))) / (
-            55 * point_density
+        # the source mesh is scaled in place
+        return alpaca_lib.subsamplePair(
+            sourceModel.GetMesh(),
+            targetModel.GetMesh(),
+            scalingOption,
+            parameters,
+            usePoissonSubsample,
+            cache=self.getFeatureCache(),
         )
 
-        print("Scale length are  ", fixedlength, movinglength)
-        print("Voxel Size is ", voxel_size)
-
-        scalingFactor = fixedlength / movinglength
-        if scalingOption is False:
-            scalingFactor = 1
-        print("Scaling factor is ", scalingFactor)
-
-        sourceFullMesh_vtk = self.scale_vtk_point_coordinates(sourceModelMesh, scalingFactor)
-        targetFullMesh_vtk = targetModelMesh
-
-        if usePoissonSubsample:
-            print("Using Poisson Point Subsampling Method")
-            sourceMesh_vtk = self.subsample_points_poisson(
-                sourceFullMesh_vtk, radius=voxel_size
-            )
-            targetMesh_vtk = self.subsample_points_poisson(
-                targetFullMesh_vtk, radius=voxel_size
-            )
-        else:
-            sourceMesh_vtk = self.subsample_points_voxelgrid_polydata(
-                sourceFullMesh_vtk, radius=voxel_size
-            )
-            targetMesh_vtk = self.subsample_points_voxelgrid_polydata(
-                targetFullMesh_vtk, radius=voxel_size
-            )
+    def getFeatureCache(self):
+        """
+        Cache of subsampled points and FPFH features in the Slicer cache folder, or None if its
+        size is set to 0 in the "ALPACA/FeatureCacheSize" setting (in MB).
+        """
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        movingMeshPoints, movingMeshPointNormals = self.extract_pca_normal(
-            sourceMesh_vtk, 30
-        )
-        fixedMeshPoints, fixedMeshPointNormals = self.extract_pca_normal(
-            targetMesh_vtk, 30
-        )
+        maximumBytes = self.getFeatureCacheSize()
+        if maximumBytes == 0:
+            return None
+        return alpaca_lib.FeatureCache(self.getFeatureCacheFolder(), maximumBytes)
 
-        print("------------------------------------------------------------")
-        print("movingMeshPoints.shape ", movingMeshPoints.shape)
-        print("movingMeshPointNormals.shape ", movingMeshPointNormals.shape)
-        print("fixedMeshPoints.shape ", fixedMeshPoints.shape)
-        print("fixedMeshPointNormals.shape ", fixedMeshPointNormals.shape)
-        print("------------------------------------------------------------")
+    def getFeatureCacheFolder(self):
+        return os.path.join(slicer.app.cachePath, "ALPACA", "features")
 
-        fpfh_radius = parameters["FPFHSearchRadius"] * voxel_size
-        fpfh_neighbors = parameters["FPFHNeighbors"]
-        # New FPFH Code
-        pcS = np.expand_dims(fixedMeshPoints, -1)
-        normal_np_pcl = fixedMeshPointNormals
-        target_fpfh = self.get_fpfh_feature(
-            pcS, normal_np_pcl, fpfh_radius, fpfh_neighbors
-        )
-        # print(f"target_fpfh {target_fpfh.shape}: {target_fpfh}")
+    def getFeatureCacheSize(self):
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        pcS = np.expand_dims(movingMeshPoints, -1)
-        normal_np_pcl = movingMeshPointNormals
-        source_fpfh = self.get_fpfh_feature(
-            pcS, normal_np_pcl, fpfh_radius, fpfh_neighbors
-        )
-        # print(f"source_fpfh {source_fpfh.shape}: {source_fpfh}")
-
-        target_down = fixedMeshPoints
-        source_down = movingMeshPoints
-        return source_down, target_down, source_fpfh, target_fpfh, voxel_size, scalingFactor
+        settings = qt.QSettings()
+        if settings.contains("ALPACA/FeatureCacheSize"):
+            return int(float(settings.value("ALPACA/FeatureCacheSize")) * 2**20)
+        return alpaca_lib.DEFAULT_FEATURE_CACHE_SIZE
 
     def loadAndScaleFiducials(self, fiducial, scalingFactor, scene=False):
         if not scene:
@@ -2891,17 +2350,22 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
             pointLabel = sourceNode.GetNthControlPointLabel(i)
             targetNode.SetNthControlPointLabel(i, pointLabel)
 
-    def distanceMatrix(self, a):
+    def distanceMatrix(self, a, condensed=False, dtype=np.float64, memoryBudget=None, outputPath=None):
         """
         Computes the euclidean distance matrix for n points in a 3D space
-        Returns a nXn matrix
+        Returns a nXn matrix, or the n*(n-1)/2 condensed distances if condensed is set.
+        With outputPath the condensed distances are written to that .npy file through a memory map.
         """
-        id, jd = a.shape
-        fnx = lambda q: q - np.reshape(q, (id, 1))
-        dx = fnx(a[:, 0])
-        dy = fnx(a[:, 1])
-        dz = fnx(a[:, 2])
-        return (dx ** 2.0 + dy ** 2.0 + dz ** 2.0) ** 0.5
+        import Support.distance_lib as distance_lib
+
+        if memoryBudget is None:
+            memoryBudget = distance_lib.DEFAULT_MEMORY_BUDGET
+        distances = distance_lib.pairwiseDistances(
+            a, dtype, memoryBudget, outputPath=outputPath
+        )
+        if condensed or outputPath is not None:
+            return distances
+        return distance_lib.squareDistanceMatrix(distances)
 
     def cpd_registration(
         self,
@@ -2912,20 +2376,16 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
         alpha_parameter,
         beta_parameter,
     ):
-        from cpdalp import DeformableRegistration
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        output = DeformableRegistration(
-            **{
-                "X": targetArray,
-                "Y": sourceArray,
-                "max_iterations": CPDIterations,
-                "tolerance": CPDTolerance,
-                "low_rank": True,
-            },
-            alpha=alpha_parameter,
-            beta=beta_parameter,
+        return alpaca_lib.cpdRegistration(
+            targetArray,
+            sourceArray,
+            CPDIterations,
+            CPDTolerance,
+            alpha_parameter,
+            beta_parameter,
         )
-        return output
 
     def getFiducialPoints(self, fiducialNode):
         points = vtk.vtkPoints()
@@ -2959,78 +2419,11 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
     def projectPointsPolydata(
         self, sourcePolydata, targetPolydata, originalPoints, rayLength
     ):
-        import vtk
+        import ALPACALib.alpaca_lib as alpaca_lib
 
-        print("original points: ", originalPoints.GetNumberOfPoints())
-        # set up polydata for projected points to return
-        projectedPointData = vtk.vtkPolyData()
-        projectedPoints = vtk.vtkPoints()
-        projectedPointData.SetPoints(projectedPoints)
-
-        # set up locater for intersection with normal vector rays
-        obbTree = vtk.vtkOBBTree()
-        obbTree.SetDataSet(targetPolydata)
-        obbTree.BuildLocator()
-
-        # set up point locator for finding surface normals and closest point
-        pointLocator = vtk.vtkPointLocator()
-        pointLocator.SetDataSet(sourcePolydata)
-        pointLocator.BuildLocator()
-
-        targetPointLocator = vtk.vtkPointLocator()
-        targetPointLocator.SetDataSet(targetPolydata)
-        targetPointLocator.BuildLocator()
-
-        # get surface normal from each landmark point
-        rayDirection = [0, 0, 0]
-        normalArray = sourcePolydata.GetPointData().GetArray("Normals")
-        if not normalArray:
-            print("no normal array, calculating....")
-            normalFilter = vtk.vtkPolyDataNormals()
-            normalFilter.ComputePointNormalsOn()
-            normalFilter.SetInputData(sourcePolydata)
-            normalFilter.Update()
-            normalArray = normalFilter.GetOutput().GetPointData().GetArray("Normals")
-            if not normalArray:
-                print("Error: no normal array")
-                return projectedPointData
-        for index in range(originalPoints.GetNumberOfPoints()):
-            originalPoint = originalPoints.GetPoint(index)
-            # get ray direction from closest normal
-            closestPointId = pointLocator.FindClosestPoint(originalPoint)
-            rayDirection = normalArray.GetTuple(closestPointId)
-            rayEndPoint = [0, 0, 0]
-            for dim in range(len(rayEndPoint)):
-                rayEndPoint[dim] = originalPoint[dim] + rayDirection[dim] * rayLength
-            intersectionIds = vtk.vtkIdList()
-            intersectionPoints = vtk.vtkPoints()
-            obbTree.IntersectWithLine(
-                originalPoint, rayEndPoint, intersectionPoints, intersectionIds
-            )
-            # if there are intersections, update the point to most external one.
-            if intersectionPoints.GetNumberOfPoints() > 0:
-                exteriorPoint = intersectionPoints.GetPoint(
-                    intersectionPoints.GetNumberOfPoints() - 1
-                )
-                projectedPoints.InsertNextPoint(exteriorPoint)
-            # if there are no intersections, reverse the normal vector
-            else:
-                for dim in range(len(rayEndPoint)):
-                    rayEndPoint[dim] = (
-                        originalPoint[dim] + rayDirection[dim] * -rayLength
-                    )
-                obbTree.IntersectWithLine(
-                    originalPoint, rayEndPoint, intersectionPoints, intersectionIds
-                )
-                if intersectionPoints.GetNumberOfPoints() > 0:
-                    exteriorPoint = intersectionPoints.GetPoint(0)
-                    projectedPoints.InsertNextPoint(exteriorPoint)
-                # if none in reverse direction, use closest mesh point
-                else:
-                    closestPointId = targetPointLocator.FindClosestPoint(originalPoint)
-                    rayOrigin = targetPolydata.GetPoint(closestPointId)
-                    projectedPoints.InsertNextPoint(rayOrigin)
-        return projectedPointData
+        return alpaca_lib.projectPointsPolydata(
+            sourcePolydata, targetPolydata, originalPoints, rayLength
+        )
 
     def takeScreenshot(self, name, description, type=-1):
         # show the message even if not taking a screen shot
@@ -3644,6 +3037,10 @@ class ALPACATest(ScriptedLoadableModuleTest):
         """Run as few or as many tests as needed here."""
         self.setUp()
         self.test_ALPACA1()
+        self.setUp()
+        self.test_RunPairsWorkerExit()
+        self.setUp()
+        self.test_PointToPlaneICPNormalOrientation()
 
     def test_ALPACA1(self):
         """Ideally you should have several levels of tests.  At the lowest level
@@ -3675,3 +3072,84 @@ class ALPACATest(ScriptedLoadableModuleTest):
         self.assertEqual(outputScalarRange[1], inputScalarRange[1])
 
         self.delayDisplay("Test passed")
+
+    def test_RunPairsWorkerExit(self):
+        """A pair that ends its worker process should be recorded as failed by
+        alpaca_lib.runPairs without losing the other pairs."""
+        import ALPACALib.alpaca_lib as alpaca_lib
+        import ALPACALib.testing_lib as testing_lib
+
+        self.delayDisplay("Starting the worker exit test")
+        # any existing files do for the memory estimate of workerNumber; the memory
+        # limit keeps the pairs in worker processes, a single worker would run them in
+        # this one
+        filePath = os.path.abspath(testing_lib.__file__)
+        tasks = [
+            {
+                "sourceModelPath": filePath,
+                "targetModelPath": filePath,
+                "parameters": {"pointDensity": 1.0},
+                "landmarks": np.full((3, 3), float(index)),
+                "exitWorker": index == 1,
+                "seconds": 0.5,
+            }
+            for index in range(4)
+        ]
+        finished = []
+        results = alpaca_lib.runPairs(
+            tasks,
+            workers=2,
+            memoryLimit=2**50,
+            pairFunction=testing_lib.exitingPairFunction,
+            resultCallback=lambda taskIndex, result: finished.append(taskIndex),
+        )
+        self.assertEqual(sorted(finished), [0, 1, 2, 3])
+        self.assertIsNone(results[1]["landmarks"])
+        self.assertIn("BrokenProcessPool", results[1]["error"])
+        for index in (0, 2, 3):
+            self.assertIsNone(results[index]["error"])
+            np.testing.assert_array_equal(
+                results[index]["landmarks"], tasks[index]["landmarks"]
+            )
+        self.delayDisplay("Worker exit test passed")
+
+    def test_PointToPlaneICPNormalOrientation(self):
+        """The angle filter of alpaca_lib.PointToPlaneICP should not depend on the signs
+        of the normals, which PCA normal estimation leaves arbitrary."""
+        import ALPACALib.alpaca_lib as alpaca_lib
+        import ALPACALib.benchmark_lib as benchmark_lib
+
+        self.delayDisplay("Starting the ICP normal orientation test")
+        rng = np.random.default_rng(0)
+        fixedPoints, fixedNormals = benchmark_lib.makeSyntheticSurface(5000, rng)
+        movingPoints, movingNormals = benchmark_lib.makeSyntheticSurface(5000, rng)
+        theta = np.radians(5.0)
+        rotation = np.array(
+            [
+                [np.cos(theta), -np.sin(theta), 0],
+                [np.sin(theta), np.cos(theta), 0],
+                [0, 0, 1],
+            ]
+        )
+        translation = np.array([0.5, -0.3, 0.4])
+        movingPoints = np.dot(movingPoints, rotation.T) + translation
+        movingNormals = np.dot(movingNormals, rotation.T)
+        _, (_, orientedR, orientedT) = alpaca_lib.PointToPlaneICP(
+            fixedPoints, fixedNormals
+        ).register(movingPoints, movingNormals, 3.0, angleThreshold=30)
+        # flip the normals of a random half of both clouds
+        mixedFixedNormals = fixedNormals * rng.choice(
+            [-1.0, 1.0], size=(len(fixedNormals), 1)
+        )
+        mixedMovingNormals = movingNormals * rng.choice(
+            [-1.0, 1.0], size=(len(movingNormals), 1)
+        )
+        _, (_, R, t) = alpaca_lib.PointToPlaneICP(
+            fixedPoints, mixedFixedNormals
+        ).register(movingPoints, mixedMovingNormals, 3.0, angleThreshold=30)
+        np.testing.assert_allclose(R, orientedR, atol=1e-9)
+        np.testing.assert_allclose(t, orientedT, atol=1e-9)
+        # the registration undoes the displacement
+        np.testing.assert_allclose(np.dot(R, rotation), np.eye(3), atol=1e-3)
+        self.assertLess(np.linalg.norm(np.dot(R, translation) + t[:3]), 0.01)
+        self.delayDisplay("ICP normal orientation test passed")
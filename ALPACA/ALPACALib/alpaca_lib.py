@@ -0,0 +1,1264 @@
+"""
+Scene-free ALPACA point cloud registration and the MALPACA process pool.
+
+The registration chain of ALPACALogic (subsampling, PCA normals, FPFH features, RANSAC, point-to-plane
+ICP, CPD, TPS warp and projection) works on numpy arrays and vtkPolyData, so it also runs in worker
+processes that have no Slicer scene. ALPACALogic calls these functions for its registration steps.
+
+runPairs aligns (target, template) pairs in a process pool. Each worker reads the two models from
+disk, runs alignPair with the template landmarks it was sent and returns the predicted landmarks as
+a numpy array; the calling process only writes the results. The number of concurrent workers is
+capped by an estimate of the memory each pair needs.
+
+Coordinates are RAS, as in the Slicer scene: readModel converts models stored in LPS the way Slicer
+loads them.
+"""
+import os
+import copy
+import math
+import time
+
+import numpy as np
+import vtk
+import vtk.util.numpy_support as vtk_np
+
+MODEL_EXTENSIONS = ('.ply', '.obj', '.vtk', '.vtp', '.stl')
+
+# Bytes at the start of a model file searched for the coordinate system written by Slicer
+MODEL_HEADER_SIZE = 4096
+
+LPS_TO_RAS = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+# Rough peak memory of one pair: a worker with ITK, VTK and cpdalp loaded and the FPFH workspace,
+# bytes per byte of model file (meshes, copies, normals, locators), subsampled points per model at
+# pointDensity 1, and bytes per squared subsampled point in the CPD
+WORKER_MEMORY = 2**30
+MODEL_MEMORY_FACTOR = 8
+SUBSAMPLED_POINTS_PER_DENSITY = 4000
+CPD_BYTES_PER_POINT_PAIR = 48
+
+# Fraction of the available memory the workers may use when no limit is given
+MEMORY_FRACTION = 0.75
+
+# Neighbours of the PCA normals the FPFH features are computed with
+NORMAL_NEIGHBOUR_COUNT = 30
+
+FEATURE_CACHE_VERSION = 1
+DEFAULT_FEATURE_CACHE_SIZE = 2 * 2**30
+
+
+# Models
+def modelCoordinateSystem(filePath):
+    """
+    'RAS' or 'LPS', as written by Slicer in the header of the model file ("SPACE=RAS"). Files without
+    it are read as LPS, the Slicer default.
+    """
+    with open(filePath, 'rb') as modelFile:
+        header = modelFile.read(MODEL_HEADER_SIZE)
+    return 'RAS' if b'SPACE=RAS' in header else 'LPS'
+
+
+def transformPolyData(polyData, matrix):
+    """
+    Returns a copy of polyData transformed by the 4x4 matrix (numpy array or vtkMatrix4x4); normals are
+    transformed with the points.
+    """
+    transform = vtk.vtkTransform()
+    if isinstance(matrix, vtk.vtkMatrix4x4):
+        transform.SetMatrix(matrix)
+    else:
+        transform.SetMatrix(np.ravel(matrix).tolist())
+    transformFilter = vtk.vtkTransformPolyDataFilter()
+    transformFilter.SetTransform(transform)
+    transformFilter.SetInputData(polyData)
+    transformFilter.Update()
+    return transformFilter.GetOutput()
+
+
+def readModel(filePath):
+    """
+    Reads a .ply, .obj, .vtk, .vtp or .stl model into a vtkPolyData in RAS coordinates.
+    """
+    readers = {
+        '.ply': vtk.vtkPLYReader,
+        '.obj': vtk.vtkOBJReader,
+        '.vtk': vtk.vtkPolyDataReader,
+        '.vtp': vtk.vtkXMLPolyDataReader,
+        '.stl': vtk.vtkSTLReader,
+    }
+    extension = os.path.splitext(filePath)[1].lower()
+    if extension not in readers:
+        raise ValueError(f"Unknown model file extension '{extension}'")
+    reader = readers[extension]()
+    reader.SetFileName(filePath)
+    reader.Update()
+    polyData = reader.GetOutput()
+    if polyData.GetNumberOfPoints() == 0:
+        raise ValueError(f"Could not read a model from {filePath}")
+    if modelCoordinateSystem(filePath) == 'LPS':
+        polyData = transformPolyData(polyData, LPS_TO_RAS)
+    return polyData
+
+
+def pointsToVTK(points):
+    vtkPoints = vtk.vtkPoints()
+    vtkPoints.SetData(vtk_np.numpy_to_vtk(np.ascontiguousarray(points, dtype=float), deep=True))
+    return vtkPoints
+
+
+def getBoxLengths(polyData):
+    boxFilter = vtk.vtkBoundingBox()
+    boxFilter.SetBounds(polyData.GetBounds())
+    diagonalLength = boxFilter.GetDiagonalLength()
+    lengths = [0.0, 0.0, 0.0]
+    boxFilter.GetLengths(lengths)
+    return lengths, diagonalLength
+
+
+def scalePolyData(polyData, scalingFactor):
+    """
+    Scales the point coordinates of polyData in place.
+    """
+    points = vtk_np.vtk_to_numpy(polyData.GetPoints().GetData()) * scalingFactor
+    polyData.GetPoints().SetData(vtk_np.numpy_to_vtk(points, deep=True, array_type=vtk.VTK_FLOAT))
+    return polyData
+
+
+# Subsampling and features
+def subsamplePointsPoisson(polyData, radius):
+    sampler = vtk.vtkPoissonDiskSampler()
+    sampler.SetInputData(polyData)
+    sampler.SetRadius(radius)
+    sampler.Update()
+    return sampler.GetOutput()
+
+
+def subsamplePointsVoxelGrid(polyData, radius):
+    subsample = vtk.vtkVoxelGrid()
+    subsample.SetInputData(polyData)
+    subsample.SetConfigurationStyleToLeafSize()
+    subsample.SetLeafSize(radius, radius, radius)
+    subsample.Update()
+    return subsample.GetOutput()
+
+
+def neighbourhoodMoments(points, neighbourCount, searchRadius, workers=-1):
+    """
+    Neighbour count, sum of offsets and sum of offset outer products of the neighbourhood of every
+    point (the point included), and the (edges x 2) neighbour pairs. The neighbourhoods are the
+    neighbourCount nearest points within searchRadius, or with neighbourCount None all points within
+    searchRadius, gathered with one KD-tree query.
+    """
+    from scipy.spatial import cKDTree
+
+    pointNumber = len(points)
+    tree = cKDTree(points)
+    if neighbourCount is None:
+        pairs = tree.query_pairs(searchRadius, output_type='ndarray')
+        offsets = points[pairs[:, 1]] - points[pairs[:, 0]]
+
+        def pairSums(weights):
+            return np.bincount(pairs[:, 0], weights, pointNumber) + np.bincount(pairs[:, 1], weights, pointNumber)
+
+        # every pair is in both neighbourhoods, with opposite offsets and the same outer product
+        counts = 1 + pairSums(None).astype(int)
+        offsetSums = np.stack([np.bincount(pairs[:, 0], offsets[:, i], pointNumber)
+                               - np.bincount(pairs[:, 1], offsets[:, i], pointNumber) for i in range(3)], axis=1)
+        productSums = np.empty((pointNumber, 3, 3))
+        for i in range(3):
+            for j in range(i, 3):
+                productSums[:, i, j] = productSums[:, j, i] = pairSums(offsets[:, i] * offsets[:, j])
+        return counts, offsetSums, productSums, pairs
+    distances, indices = tree.query(points, k=min(neighbourCount, pointNumber), distance_upper_bound=searchRadius,
+                                    workers=workers)
+    distances, indices = distances.reshape(pointNumber, -1), indices.reshape(pointNumber, -1)
+    found = distances < np.inf
+    # missing neighbours get the index pointNumber; they are masked out of the sums
+    offsets = points[np.minimum(indices, pointNumber - 1)] - points[:, np.newaxis, :]
+    offsets[~found] = 0
+    owners = np.broadcast_to(np.arange(pointNumber)[:, np.newaxis], indices.shape)
+    pairs = np.column_stack((owners[found], indices[found]))
+    return (found.sum(axis=1), offsets.sum(axis=1), np.einsum('nki,nkj->nij', offsets, offsets),
+            pairs[pairs[:, 0] != pairs[:, 1]])
+
+
+def orientNormalsOverGraph(points, normals, pairs):
+    """
+    Flips the normals into one consistent orientation per connected patch, propagated along the
+    minimum spanning tree of the neighbour pairs weighted by normal disagreement (Hoppe et al. 1992).
+    The point of every patch farthest from the centroid keeps its normal pointing away from it, so
+    closed surfaces get outward normals.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import minimum_spanning_tree, connected_components, breadth_first_order
+
+    pointNumber = len(points)
+    agreement = np.abs(np.einsum('ij,ij->i', normals[pairs[:, 0]], normals[pairs[:, 1]]))
+    # zero weights are missing edges for csgraph, so the weights are kept positive
+    graph = coo_matrix((1.0 + 1e-9 - agreement, (pairs[:, 0], pairs[:, 1])), shape=(pointNumber, pointNumber)).tocsr()
+    # k-nearest neighbour pairs are not symmetric, and mutual ones are listed twice
+    spanningTree = minimum_spanning_tree(graph.maximum(graph.T)).tocoo()
+    patchNumber, patches = connected_components(spanningTree, directed=False)
+    offsets = points - points.mean(axis=0)
+    distances = np.einsum('ij,ij->i', offsets, offsets)
+    byPatch = np.lexsort((distances, patches))
+    roots = byPatch[np.searchsorted(patches[byPatch], np.arange(patchNumber), side='right') - 1]
+    # one traversal from an extra vertex, pointNumber, linked to the root of every patch
+    rows = np.concatenate((spanningTree.row, np.full(patchNumber, pointNumber)))
+    columns = np.concatenate((spanningTree.col, roots))
+    traversalGraph = coo_matrix((np.ones(len(rows)), (rows, columns)), shape=(pointNumber + 1, pointNumber + 1))
+    _, parents = breadth_first_order(traversalGraph.tocsr(), pointNumber, directed=False)
+    parents = parents[:pointNumber]
+    # flips relative to the parent, then to the patch root by pointer jumping
+    isRoot = parents == pointNumber
+    parents[isRoot] = np.flatnonzero(isRoot)
+    flips = np.einsum('ij,ij->i', normals, normals[parents]) < 0
+    flips[isRoot] = np.einsum('ij,ij->i', normals[isRoot], offsets[isRoot]) < 0
+    while not np.array_equal(parents, parents[parents]):
+        flips = np.where(parents == parents[parents], flips, flips ^ flips[parents])
+        parents = parents[parents]
+    flips = np.where(isRoot, flips, flips ^ flips[parents])
+    normals[flips] *= -1
+    return normals
+
+
+def estimateNormals(points, neighbourCount=NORMAL_NEIGHBOUR_COUNT, searchRadius=np.inf, orientation="z",
+                    orientationPoint=(0.0, 0.0, 0.0), workers=-1):
+    """
+    Unit normals of the (points x 3) array: the smallest eigenvector of the covariance of every point's
+    neighbourhood, the neighbourCount nearest points within searchRadius or, with neighbourCount None,
+    all points within searchRadius. The covariances are stacked and solved with one batched eigh; points
+    with fewer than 3 neighbours get (1, 1, 1) / sqrt(3).
+    orientation: "z" flips the normals to positive z, "point" points them towards orientationPoint
+    (as vtkPCANormalEstimation), "graph" orients them consistently over the neighbour graph, outward
+    on closed surfaces (orientNormalsOverGraph), None leaves the eigenvector signs.
+    """
+    points = np.asarray(points, dtype=float)
+    counts, offsetSums, productSums, pairs = neighbourhoodMoments(points, neighbourCount, searchRadius, workers)
+    means = offsetSums / counts[:, np.newaxis]
+    covariances = productSums / counts[:, np.newaxis, np.newaxis] - np.einsum('ni,nj->nij', means, means)
+    _, eigenvectors = np.linalg.eigh(covariances)
+    normals = np.ascontiguousarray(eigenvectors[:, :, 0])
+    normals[counts < 3] = 1 / np.sqrt(3)
+    if orientation == "z":
+        normals[normals[:, 2] < 0] *= -1
+    elif orientation == "point":
+        normals[np.einsum('ij,ij->i', normals, points - orientationPoint) > 0] *= -1
+    elif orientation == "graph":
+        normals = orientNormalsOverGraph(points, normals, pairs)
+    elif orientation is not None:
+        raise ValueError(f"Unknown normal orientation '{orientation}'")
+    return normals
+
+
+def extractPCANormals(polyData, normalNeighbourCount):
+    """
+    Points of polyData and their normals from vtkPCANormalEstimation over normalNeighbourCount neighbours.
+    """
+    normals = vtk.vtkPCANormalEstimation()
+    normals.SetSampleSize(normalNeighbourCount)
+    normals.SetNormalOrientationToPoint()
+    normals.SetInputData(polyData)
+    normals.Update()
+    normalArray = vtk_np.vtk_to_numpy(normals.GetOutput().GetPointData().GetNormals())
+    pointArray = vtk_np.vtk_to_numpy(polyData.GetPoints().GetData())
+    return pointArray, normalArray
+
+
+def extractPCANormalsInRadius(points, searchRadius):
+    """
+    Normals of the (points x 3) array from the PCA of the neighbours within searchRadius, oriented
+    towards positive z.
+    """
+    return estimateNormals(points, None, searchRadius, orientation="z")
+
+
+def estimatePolyDataNormals(polyData, neighbourCount=NORMAL_NEIGHBOUR_COUNT):
+    """
+    "Normals" vtk array of the points of polyData, estimated from their neighbourhoods and oriented
+    over the neighbour graph, for point clouds that vtkPolyDataNormals cannot handle.
+    """
+    normals = estimateNormals(vtk_np.vtk_to_numpy(polyData.GetPoints().GetData()), neighbourCount,
+                              orientation="graph")
+    normalArray = vtk_np.numpy_to_vtk(normals, deep=True)
+    normalArray.SetName("Normals")
+    return normalArray
+
+
+def getFPFHFeatures(points, normals, radius, neighbors):
+    """
+    (points x 33) FPFH features of the points with the given normals, from ITK.
+    """
+    import itk
+
+    pointSet = itk.PointSet[itk.F, 3].New()
+    pointSet.SetPoints(itk.vector_container_from_array(np.ravel(points).astype("float32")))
+    normalSet = itk.PointSet[itk.F, 3].New()
+    normalSet.SetPoints(itk.vector_container_from_array(np.ravel(normals).astype("float32")))
+    fpfh = itk.Fpfh.PointFeature.MF3MF3.New()
+    fpfh.ComputeFPFHFeature(pointSet, normalSet, float(radius), int(neighbors))
+    features = itk.array_from_vector_container(fpfh.GetFpfhFeature())
+    return np.reshape(features, [33, pointSet.GetNumberOfPoints()]).T
+
+
+def meshContentHash(polyData):
+    """
+    Hash of the point coordinates of polyData, which are all the subsampled points and features depend on.
+    """
+    import hashlib
+
+    points = np.ascontiguousarray(vtk_np.vtk_to_numpy(polyData.GetPoints().GetData()))
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{points.dtype.str}{points.shape}".encode())
+    digest.update(points.data)
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """
+    On-disk cache of the subsampled points and FPFH features of meshes, for subsamplePair.
+    Entries are keyed by the content hash of the mesh and every setting the features depend on: the
+    subsampling method, the voxel size and FPFH radius in the units of the mesh (which follow the point
+    density, the target size and the scaling) and the normal and FPFH neighbour counts. Every entry is
+    an uncompressed .npz file of the float32 arrays. When the entries exceed maximumBytes the least
+    recently used ones are removed. Processes can share the folder: entries are written atomically.
+    """
+
+    def __init__(self, cacheFolder, maximumBytes=DEFAULT_FEATURE_CACHE_SIZE):
+        self.cacheFolder = cacheFolder
+        self.maximumBytes = maximumBytes
+        os.makedirs(cacheFolder, exist_ok=True)
+        self.resetStatistics()
+
+    def resetStatistics(self):
+        self.hits = 0
+        self.misses = 0
+        self.bytesRead = 0
+        self.bytesWritten = 0
+        self.evicted = 0
+
+    def statistics(self):
+        return {"hits": self.hits, "misses": self.misses, "bytesRead": self.bytesRead,
+                "bytesWritten": self.bytesWritten, "evicted": self.evicted}
+
+    def key(self, contentHash, settings):
+        import json
+        import hashlib
+
+        # floats are rounded so that sizes derived along different paths give the same key
+        settings = {name: f"{value:.10g}" if isinstance(value, float) else value for name, value in settings.items()}
+        description = json.dumps([FEATURE_CACHE_VERSION, contentHash, settings], sort_keys=True)
+        return hashlib.blake2b(description.encode(), digest_size=20).hexdigest()
+
+    def entryPath(self, key):
+        return os.path.join(self.cacheFolder, key + ".npz")
+
+    def load(self, key):
+        """
+        Returns the cached (points, features) of key, or None.
+        """
+        entryPath = self.entryPath(key)
+        try:
+            with np.load(entryPath, allow_pickle=False) as entry:
+                points, features = entry['points'], entry['features']
+            # the modification time orders the entries for eviction
+            os.utime(entryPath)
+            self.bytesRead += os.path.getsize(entryPath)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return points, features
+
+    def store(self, key, points, features):
+        entryPath = self.entryPath(key)
+        temporaryPath = f"{entryPath}.{os.getpid()}.tmp"
+        with open(temporaryPath, 'wb') as entryFile:
+            np.savez(entryFile, points=points, features=features)
+        os.replace(temporaryPath, entryPath)
+        self.bytesWritten += os.path.getsize(entryPath)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is within maximumBytes.
+        """
+        entries = []
+        for entry in os.scandir(self.cacheFolder):
+            if entry.name.endswith(".npz"):
+                try:
+                    entryStat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((entryStat.st_mtime_ns, entryStat.st_size, entry.path))
+        totalBytes = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if totalBytes <= self.maximumBytes:
+                break
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except OSError:
+                pass
+            totalBytes -= size
+
+    def clear(self):
+        for entry in os.scandir(self.cacheFolder):
+            if entry.name.endswith(".npz"):
+                os.remove(entry.path)
+
+
+def meshFeatures(polyData, voxelSize, fpfhRadius, fpfhNeighbors, usePoissonSubsample=False, cache=None):
+    """
+    Subsampled points of polyData and their FPFH features, read from the FeatureCache cache if it has them.
+    """
+    if cache is not None:
+        key = cache.key(meshContentHash(polyData), {
+            'subsample': 'poisson' if usePoissonSubsample else 'voxelGrid',
+            'voxelSize': float(voxelSize),
+            'normalNeighbours': NORMAL_NEIGHBOUR_COUNT,
+            'fpfhRadius': float(fpfhRadius),
+            'fpfhNeighbors': int(fpfhNeighbors),
+        })
+        cached = cache.load(key)
+        if cached is not None:
+            return cached
+    if usePoissonSubsample:
+        subsample = subsamplePointsPoisson(polyData, voxelSize)
+    else:
+        subsample = subsamplePointsVoxelGrid(polyData, voxelSize)
+    points, normals = extractPCANormals(subsample, NORMAL_NEIGHBOUR_COUNT)
+    features = getFPFHFeatures(points, normals, fpfhRadius, fpfhNeighbors)
+    if cache is not None:
+        cache.store(key, points, features)
+    return points, features
+
+
+def subsamplePair(sourcePolyData, targetPolyData, scalingOption, parameters, usePoissonSubsample=False, cache=None):
+    """
+    Subsamples the source and target models and computes the FPFH features of the subsampled points.
+    The voxel size follows the target bounding box and parameters["pointDensity"]; with scalingOption
+    the source is scaled in place to the size of the target. cache is an optional FeatureCache.
+    Returns the source and target points, their features, the voxel size and the scaling factor.
+    """
+    print("parameters are ", parameters)
+    print(":: Loading point clouds and downsampling")
+    fixedBoxLengths, fixedLength = getBoxLengths(targetPolyData)
+    movingBoxLengths, movingLength = getBoxLengths(sourcePolyData)
+
+    # Voxel size is the diagonal length of cuboid in the voxelGrid
+    voxelSize = np.sqrt(np.sum(np.square(np.array(fixedBoxLengths)))) / (55 * parameters["pointDensity"])
+    print("Scale length are  ", fixedLength, movingLength)
+    print("Voxel Size is ", voxelSize)
+
+    scalingFactor = fixedLength / movingLength
+    if scalingOption is False:
+        scalingFactor = 1
+    print("Scaling factor is ", scalingFactor)
+    if usePoissonSubsample:
+        print("Using Poisson Point Subsampling Method")
+
+    fpfhRadius = parameters["FPFHSearchRadius"] * voxelSize
+    fpfhNeighbors = parameters["FPFHNeighbors"]
+    targetPoints, targetFeatures = meshFeatures(targetPolyData, voxelSize, fpfhRadius, fpfhNeighbors,
+                                                usePoissonSubsample, cache)
+    # the source is subsampled before scaling, with the sizes in its own units, so its features are the
+    # same for every target and scaling (FPFH features do not change with scale)
+    sourcePoints, sourceFeatures = meshFeatures(sourcePolyData, voxelSize / scalingFactor,
+        fpfhRadius / scalingFactor, fpfhNeighbors, usePoissonSubsample, cache)
+    sourcePoints = (sourcePoints * scalingFactor).astype(np.float32)
+    scalePolyData(sourcePolyData, scalingFactor)
+    print("------------------------------------------------------------")
+    print("movingMeshPoints.shape ", sourcePoints.shape)
+    print("fixedMeshPoints.shape ", targetPoints.shape)
+    print("------------------------------------------------------------")
+    return sourcePoints, targetPoints, sourceFeatures, targetFeatures, voxelSize, scalingFactor
+
+
+# Rigid registration
+def findNearestNeighbors(features0, features1, knn=1, returnDistance=False):
+    from scipy.spatial import cKDTree
+
+    distances, indices = cKDTree(features1).query(features0, k=knn)
+    if returnDistance:
+        return indices, distances
+    return indices
+
+
+def findCorrespondences(features0, features1, mutualFilter=True):
+    """
+    Putative correspondences between two point clouds from the nearest neighbours in feature space,
+    optionally only the mutual ones. Returns the indices into the first and the second cloud.
+    """
+    nearest01 = findNearestNeighbors(features0, features1)
+    indices0 = np.arange(len(nearest01))
+    if not mutualFilter:
+        return indices0, nearest01
+    nearest10 = findNearestNeighbors(features1, features0)
+    mutual = nearest10[nearest01] == indices0
+    return indices0[mutual], nearest01[mutual]
+
+
+def transformPoints(points, transform):
+    """
+    Applies an ITK transform to a (points x 3) array.
+    """
+    import itk
+
+    mesh = itk.Mesh[itk.F, 3].New()
+    mesh.SetPoints(itk.vector_container_from_array(np.ravel(points).astype("float32")))
+    transformedMesh = itk.transform_mesh_filter(mesh, transform=transform)
+    return np.reshape(itk.array_from_vector_container(transformedMesh.GetPoints()), [-1, 3])
+
+
+class FitnessEvaluator:
+    """
+    Fitness of alignments onto one fixed point cloud. The KD-tree of the fixed points is built once,
+    and the nearest neighbour queries of an evaluation are answered in one call, split over workers
+    threads (-1 for all CPUs).
+    """
+
+    def __init__(self, fixedPoints, workers=-1):
+        from scipy.spatial import cKDTree
+
+        self.fixedPoints = np.asarray(fixedPoints)
+        self.tree = cKDTree(self.fixedPoints)
+        self.workers = workers
+
+    def evaluate(self, movingPoints, distanceThreshold, transform=None):
+        """
+        Returns, for the moving points after the optional ITK transform, the inlier ratio (the fraction
+        of points whose closest fixed point is nearer than distanceThreshold), the inlier RMSE as ALPACA
+        reports it (the mean inlier distance, inf without inliers) and the (inliers x 2) correspondence
+        set of fixed and moving point indices.
+        """
+        if transform is not None:
+            movingPoints = transformPoints(movingPoints, transform)
+        distances, indices = self.tree.query(movingPoints, k=1, distance_upper_bound=distanceThreshold,
+                                             workers=self.workers)
+        inliers = np.flatnonzero(distances < distanceThreshold)
+        inlierRMSE = float(distances[inliers].mean()) if len(inliers) else np.inf
+        return len(inliers) / len(movingPoints), inlierRMSE, np.column_stack((indices[inliers], inliers))
+
+
+def getFitness(movingPoints, fixedPoints, distanceThreshold, transform=None):
+    """
+    Inlier ratio and inlier RMSE of the moving points against the fixed points, see FitnessEvaluator.
+    """
+    return FitnessEvaluator(fixedPoints).evaluate(movingPoints, distanceThreshold, transform)[:2]
+
+
+def ransacRegistration(movingPoints, fixedPoints, movingFeaturePoints, fixedFeaturePoints, iterationNumber,
+                       ransacPointNumber, inlierValue, scalingOption, checkEdgeLength, correspondenceDistance):
+    """
+    RANSAC estimate of the rigid (or, with scalingOption, similarity) transform mapping the moving
+    feature points onto the corresponding fixed feature points. The agreement is measured on the
+    shuffled moving and fixed points. Returns the transform as an ITK transform dictionary, and the
+    fraction of data used and its fitness reported by ITK.
+    """
+    import itk
+
+    data = itk.vector[itk.Point[itk.D, 6]]()
+    data.reserve(movingFeaturePoints.shape[0])
+    for movingPoint, fixedPoint in zip(movingFeaturePoints, fixedFeaturePoints):
+        data.push_back([float(x) for x in (*movingPoint, *fixedPoint)])
+
+    # the subsampled clouds need not have the same size, so agreement pairs are drawn from shuffled copies
+    countMin = int(min(movingPoints.shape[0], fixedPoints.shape[0]))
+    movingShuffled = copy.deepcopy(movingPoints)
+    fixedShuffled = copy.deepcopy(fixedPoints)
+    np.random.seed(0)
+    np.random.shuffle(movingShuffled)
+    np.random.seed(0)
+    np.random.shuffle(fixedShuffled)
+    agreeData = itk.vector[itk.Point[itk.D, 6]]()
+    agreeData.reserve(countMin)
+    for i in range(countMin):
+        agreeData.push_back([float(x) for x in (*movingShuffled[i], *fixedShuffled[i])])
+
+    transformParameters = itk.vector.D()
+    itk.MultiThreaderBase.SetGlobalDefaultThreader(itk.MultiThreaderBase.ThreaderTypeFromString("POOL"))
+    if not scalingOption:
+        print("Rigid Reg, no scaling")
+        TransformType = itk.VersorRigid3DTransform[itk.D]
+    else:
+        print("NonRigid Reg, with scaling")
+        TransformType = itk.Similarity3DTransform[itk.D]
+    RegistrationEstimatorType = itk.Ransac.LandmarkRegistrationEstimator[6, TransformType]
+    registrationEstimator = RegistrationEstimatorType.New()
+    registrationEstimator.SetMinimalForEstimate(ransacPointNumber)
+    registrationEstimator.SetAgreeData(agreeData)
+    registrationEstimator.SetDelta(inlierValue)
+    registrationEstimator.LeastSquaresEstimate(data, transformParameters)
+
+    maxThreadCount = max(1, int(itk.MultiThreaderBase.New().GetMaximumNumberOfThreads() / 2))
+    desiredProbabilityForNoOutliers = 0.99
+    RANSACType = itk.RANSAC[itk.Point[itk.D, 6], itk.D, TransformType]
+    ransacEstimator = RANSACType.New()
+    ransacEstimator.SetData(data)
+    ransacEstimator.SetAgreeData(agreeData)
+    ransacEstimator.SetCheckCorresspondenceDistance(checkEdgeLength)
+    if correspondenceDistance > 0:
+        ransacEstimator.SetCheckCorrespondenceEdgeLength(correspondenceDistance)
+    ransacEstimator.SetMaxIteration(int(iterationNumber / maxThreadCount))
+    ransacEstimator.SetNumberOfThreads(maxThreadCount)
+    ransacEstimator.SetParametersEstimator(registrationEstimator)
+    percentageOfDataUsed = ransacEstimator.Compute(transformParameters, desiredProbabilityForNoOutliers)
+
+    transform = TransformType.New()
+    p = transform.GetParameters()
+    f = transform.GetFixedParameters()
+    for i in range(p.GetSize()):
+        p.SetElement(i, transformParameters[i])
+    for i in range(f.GetSize()):
+        f.SetElement(i, transformParameters[p.GetSize() + i])
+    transform.SetParameters(p)
+    transform.SetFixedParameters(f)
+    return itk.dict_from_transform(transform), percentageOfDataUsed[0], percentageOfDataUsed[1]
+
+
+def eulerMatrix(ai, aj, ak):
+    """
+    Homogeneous rotation matrix from the static xyz Euler angles ai, aj, ak.
+    """
+    si, sj, sk = math.sin(ai), math.sin(aj), math.sin(ak)
+    ci, cj, ck = math.cos(ai), math.cos(aj), math.cos(ak)
+    cc, cs = ci * ck, ci * sk
+    sc, ss = si * ck, si * sk
+    M = np.identity(4)
+    M[0, 0] = cj * ck
+    M[0, 1] = sj * sc - cs
+    M[0, 2] = sj * cc + ss
+    M[1, 0] = cj * sk
+    M[1, 1] = sj * ss + cc
+    M[1, 2] = sj * cs - sc
+    M[2, 0] = -sj
+    M[2, 1] = cj * si
+    M[2, 2] = cj * ci
+    return M
+
+
+def bestFitTransformPointToPlane(A, B, normals, weights=None):
+    """
+    Linearized point-to-plane least squares transform mapping the (N x 3) points A onto the
+    corresponding points B with normals (reference:
+    https://www.comp.nus.edu.sg/~lowkl/publications/lowk_point-to-plane_icp_techrep.pdf), optionally
+    with per-correspondence weights. Only the 6x6 normal equations are formed, and their minimum norm
+    solution is the pseudo-inverse solution of the full system.
+    Returns the 4x4 homogeneous transform, its rotation and its translation.
+    """
+    assert A.shape == B.shape
+    assert A.shape == normals.shape
+    H = np.column_stack((np.cross(A, normals), normals))
+    b = np.einsum('ij,ij->i', normals, B - A)
+    if weights is None:
+        HtH = np.einsum('ni,nj->ij', H, H, optimize=True)
+        Htb = np.einsum('ni,n->i', H, b, optimize=True)
+    else:
+        HtH = np.einsum('ni,n,nj->ij', H, weights, H, optimize=True)
+        Htb = np.einsum('ni,n,n->i', H, weights, b, optimize=True)
+    tr = np.linalg.lstsq(HtH, Htb, rcond=None)[0]
+    T = eulerMatrix(tr[0], tr[1], tr[2])
+    T[:3, 3] = tr[3:]
+    return T, T[:3, :3], T[:3, 3]
+
+
+def nearestNeighbor(source, destination):
+    """
+    Distances and indices of the nearest destination point of every source point.
+    """
+    from sklearn.neighbors import NearestNeighbors
+
+    neighbors = NearestNeighbors(n_neighbors=1, algorithm="kd_tree")
+    neighbors.fit(destination)
+    distances, indices = neighbors.kneighbors(source, return_distance=True)
+    return distances.ravel(), indices.ravel()
+
+
+class PointToPlaneICP:
+    """
+    Point-to-plane ICP onto one fixed point cloud with normals. The KD-tree of the fixed points is
+    built once and serves every iteration of every registration; the nearest neighbour queries are
+    split over workers threads (-1 for all CPUs).
+    """
+
+    # tuning constants of the robust weights, in units of the robust residual deviation
+    WEIGHT_SCALES = {"huber": 1.345, "tukey": 4.685}
+
+    def __init__(self, fixedPoints, fixedNormals, workers=-1):
+        from scipy.spatial import cKDTree
+
+        self.fixedPoints = np.asarray(fixedPoints, dtype=float)
+        self.fixedNormals = np.asarray(fixedNormals, dtype=float)
+        self.tree = cKDTree(self.fixedPoints)
+        self.workers = workers
+
+    def weights(self, residuals, weighting, weightScale=None):
+        """
+        Robust weights of the point-to-plane residuals: None for plain least squares, "huber" or "tukey".
+        weightScale is the tuning constant in distance units; by default it is the tabulated constant
+        times the median absolute residual scaled to a gaussian deviation.
+        """
+        if weighting is None:
+            return None
+        if weighting not in self.WEIGHT_SCALES:
+            raise ValueError(f"Unknown ICP weighting '{weighting}'")
+        absoluteResiduals = np.abs(residuals)
+        if weightScale is None:
+            weightScale = self.WEIGHT_SCALES[weighting] * 1.4826 * np.median(absoluteResiduals)
+        if weightScale <= 0:
+            return np.ones_like(residuals)
+        if weighting == "huber":
+            return np.minimum(1.0, weightScale / np.maximum(absoluteResiduals, 1e-300))
+        return np.clip(1 - (absoluteResiduals / weightScale) ** 2, 0, None) ** 2
+
+    def nearestNeighbors(self, points, distanceThreshold):
+        """
+        Index of the nearest fixed point of every point, searched up to twice distanceThreshold (-1 if
+        there is none), and the distance the point can move before that answer may change: half the gap
+        to the second nearest fixed point.
+        """
+        searchRadius = 2 * distanceThreshold
+        distances, indices = self.tree.query(points, k=2, distance_upper_bound=searchRadius, workers=self.workers)
+        found = distances[:, 0] < np.inf
+        # a point with no fixed point within the search radius stays out of range until it moved by distanceThreshold
+        margins = np.full(len(distances), float(distanceThreshold))
+        margins[found] = (np.minimum(distances[found, 1], searchRadius) - distances[found, 0]) / 2
+        return np.where(found, indices[:, 0], -1), margins
+
+    def register(self, movingPoints, movingNormals=None, distanceThreshold=np.inf, maxIterations=30,
+                 tolerance=0.000001, relativeTolerance=0.0001, angleThreshold=None, weighting=None, weightScale=None):
+        """
+        Aligns movingPoints onto the fixed points. Correspondences farther than distanceThreshold are
+        rejected, and, if angleThreshold (degrees) is given, those whose normals (movingNormals, rotated
+        with the points) differ by more than that angle. PCA normals are only defined up to their sign,
+        so a normal and its opposite count as the same direction. Stops after maxIterations or when the mean
+        error changes by less than tolerance or by less than relativeTolerance times its last value.
+        Returns the mean error of every iteration and (T, R, t), the final homogeneous transform, its
+        rotation and its translation.
+        """
+        from scipy.spatial import cKDTree
+
+        # neighbouring queries visit the same tree nodes, so the points are queried in KD-tree order
+        order = cKDTree(movingPoints).indices
+        movingPoints = np.asarray(movingPoints, dtype=float)[order]
+        if angleThreshold is not None:
+            movingNormals = np.asarray(movingNormals, dtype=float)[order]
+            movingNormals = movingNormals / np.linalg.norm(movingNormals, axis=1)[:, np.newaxis]
+            fixedNormalLengths = np.linalg.norm(self.fixedNormals, axis=1)
+            minimumCosine = np.cos(np.radians(angleThreshold))
+        points = movingPoints
+        indices, margins = self.nearestNeighbors(points, distanceThreshold)
+        anchors = points.copy()
+        previousError = 0
+        meanErrors = []
+        finalT = np.identity(4)
+        for iteration in range(maxIterations):
+            if iteration > 0:
+                # only the points that moved past their margin can have a new nearest neighbour
+                drifts = points - anchors
+                stale = np.flatnonzero(np.einsum('ij,ij->i', drifts, drifts) >= margins ** 2)
+                indices[stale], margins[stale] = self.nearestNeighbors(points[stale], distanceThreshold)
+                anchors[stale] = points[stale]
+            offsets = self.fixedPoints[indices] - points
+            distances = np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
+            distances[indices < 0] = np.inf
+            keep = distances < distanceThreshold
+            if angleThreshold is not None:
+                # the moving normals follow the rotation found so far; the normals need not share an orientation
+                cosines = np.einsum('ij,ij->i', np.dot(movingNormals, finalT[:3, :3].T), self.fixedNormals[indices])
+                keep &= np.abs(cosines) >= minimumCosine * fixedNormalLengths[indices]
+            matchedPoints = points[keep]
+            matchedFixedPoints = self.fixedPoints[indices[keep]]
+            matchedNormals = self.fixedNormals[indices[keep]]
+            weights = None
+            if weighting is not None:
+                residuals = np.einsum('ij,ij->i', matchedNormals, matchedFixedPoints - matchedPoints)
+                weights = self.weights(residuals, weighting, weightScale)
+            T, R, t = bestFitTransformPointToPlane(matchedPoints, matchedFixedPoints, matchedNormals, weights)
+            finalT = np.dot(T, finalT)
+            points = np.dot(points, R.T) + t
+            meanError = np.mean(distances[keep])
+            meanErrors.append(meanError)
+            change = np.abs(previousError - meanError)
+            if tolerance is not None and change < tolerance:
+                break
+            if relativeTolerance and change < relativeTolerance * meanError:
+                break
+            previousError = meanError
+        return meanErrors, (finalT, finalT[:3, :3], finalT[:, 3])
+
+
+def pointToPlaneICP(sourcePoints, destinationPoints, sourceNormals, destinationNormals, distanceThreshold=np.inf,
+                    maxIterations=30, tolerance=0.000001, **options):
+    """
+    Point-to-plane ICP of the (N x 3) sourcePoints onto destinationPoints, see PointToPlaneICP.register
+    for the options. Correspondences farther than distanceThreshold are rejected. Stops after
+    maxIterations or when the mean error changes by less than tolerance.
+    Returns the mean error of every iteration and (T, R, t), the final homogeneous transform, its
+    rotation and its translation.
+    """
+    meanErrors, transform = PointToPlaneICP(destinationPoints, destinationNormals).register(
+        sourcePoints, sourceNormals, distanceThreshold, maxIterations, tolerance, **options)
+    print("Refinement took ", len(meanErrors) - 1, " iterations")
+    return meanErrors, transform
+
+
+def finalIterationICP(fixedPoints, movingPoints, distanceThreshold, normalSearchRadius):
+    """
+    Rigid point-to-plane ICP refinement of movingPoints onto fixedPoints, returned as an ITK transform.
+    """
+    import itk
+
+    fixedNormals = extractPCANormalsInRadius(fixedPoints, normalSearchRadius)
+    movingNormals = extractPCANormalsInRadius(movingPoints, normalSearchRadius)
+    _, (T, R, t) = pointToPlaneICP(movingPoints, fixedPoints, movingNormals, fixedNormals, distanceThreshold)
+    transform = itk.Rigid3DTransform.D.New()
+    transform.SetMatrix(itk.matrix_from_array(R), 0.000001)
+    transform.SetTranslation([t[0], t[1], t[2]])
+    return movingPoints, transform
+
+
+def estimateTransform(sourcePoints, targetPoints, sourceFeatures, targetFeatures, voxelSize, scalingOption, parameters):
+    """
+    RANSAC on the FPFH correspondences, repeated with scaling if scalingOption is set and the rigid
+    fit is poor, followed by a point-to-plane ICP refinement.
+    Returns the ITK transform mapping the source points onto the target points and whether the
+    similarity (scaling) estimate was kept.
+    """
+    import itk
+
+    similarityFlag = False
+    # Establish correspondences by nearest neighbour search in feature space
+    targetIndices, sourceIndices = findCorrespondences(targetFeatures, sourceFeatures, mutualFilter=True)
+    fixedCorrespondences = targetPoints[targetIndices]
+    movingCorrespondences = sourcePoints[sourceIndices]
+    print(f"FPFH generates {len(targetIndices)} putative correspondences.")
+
+    # Check corner case when both meshes are same
+    if np.allclose(fixedCorrespondences, movingCorrespondences):
+        print("Same meshes therefore returning Identity Transform")
+        transform = itk.VersorRigid3DTransform[itk.D].New()
+        transform.SetIdentity()
+        return [transform, transform]
+
+    ransacStart = time.time()
+    inlierValue = float(parameters["distanceThreshold"]) * voxelSize
+    # every RANSAC attempt and the refinement are scored against the same target tree
+    targetFitness = FitnessEvaluator(targetPoints)
+    # Initial alignment using RANSAC parallel iterations with no scaling
+    bestTransform, fitness, rmse = ransacRegistration(sourcePoints, targetPoints, movingCorrespondences,
+        fixedCorrespondences, parameters["maxRANSAC"], 3, inlierValue, scalingOption=False, checkEdgeLength=True,
+        correspondenceDistance=0.9)
+    meanFitness, meanRMSE, _ = targetFitness.evaluate(sourcePoints, inlierValue, itk.transform_from_dict(bestTransform))
+    bestFitness, bestRMSE = meanFitness, meanRMSE
+    print("Best Fitness without Scaling ", bestFitness, " RMSE is ", bestRMSE)
+
+    if scalingOption:
+        attempt = 0
+        while meanFitness < 0.99 and attempt < 10:
+            transformDictionary, fitness, rmse = ransacRegistration(sourcePoints, targetPoints, movingCorrespondences,
+                fixedCorrespondences, int(parameters["maxRANSAC"]), 3, inlierValue, scalingOption=True,
+                checkEdgeLength=False, correspondenceDistance=0.9)
+            meanFitness, meanRMSE, _ = targetFitness.evaluate(sourcePoints, inlierValue,
+                                                              itk.transform_from_dict(transformDictionary))
+            print("Scaling Attempt = ", attempt, " Fitness = ", meanFitness, " RMSE = ", meanRMSE)
+            if meanFitness > bestFitness or (meanFitness == bestFitness and meanRMSE < bestRMSE):
+                bestFitness, bestRMSE = meanFitness, meanRMSE
+                bestTransform = transformDictionary
+                similarityFlag = True
+            attempt = attempt + 1
+
+    print("RANSAC Duraction ", time.time() - ransacStart)
+    print("Best Fitness after scaling ", bestFitness)
+    firstTransform = itk.transform_from_dict(bestTransform)
+    sourcePoints = transformPoints(sourcePoints, firstTransform)
+
+    print("Starting Rigid Refinement")
+    distanceThreshold = parameters["ICPDistanceThreshold"] * voxelSize
+    inlier, rmse, _ = targetFitness.evaluate(sourcePoints, distanceThreshold)
+    print("Before Inlier = ", inlier, " RMSE = ", rmse)
+    _, secondTransform = finalIterationICP(targetPoints, sourcePoints, distanceThreshold,
+                                           float(parameters["normalSearchRadius"] * voxelSize))
+    inlier, rmse, _ = targetFitness.evaluate(sourcePoints, distanceThreshold, secondTransform)
+    print("After Inlier = ", inlier, " RMSE = ", rmse)
+    firstTransform.Compose(secondTransform)
+    return firstTransform, similarityFlag
+
+
+def itkToVTKMatrix(itkTransform):
+    """
+    4x4 vtkMatrix4x4 of the matrix and offset of an ITK transform.
+    """
+    matrix = itkTransform.GetMatrix()
+    offset = itkTransform.GetOffset()
+    vtkMatrix = vtk.vtkMatrix4x4()
+    for i in range(3):
+        for j in range(3):
+            vtkMatrix.SetElement(i, j, matrix(i, j))
+        vtkMatrix.SetElement(i, 3, offset[i])
+    return vtkMatrix
+
+
+# Deformable registration
+def cpdRegistration(targetArray, sourceArray, CPDIterations, CPDTolerance, alpha, beta):
+    from cpdalp import DeformableRegistration
+
+    return DeformableRegistration(
+        **{
+            "X": targetArray,
+            "Y": sourceArray,
+            "max_iterations": CPDIterations,
+            "tolerance": CPDTolerance,
+            "low_rank": True,
+        },
+        alpha=alpha,
+        beta=beta,
+    )
+
+
+def runCPDRegistration(sourceLandmarks, sourcePoints, targetPoints, parameters, workingFolder=None):
+    """
+    Deforms the source points, carrying the source landmarks along, onto the target points with CPD,
+    or with BCPD from parameters["BCPDFolder"] if parameters["Acceleration"] is set. BCPD exchanges
+    files in workingFolder (a new temporary folder if None).
+    Returns the deformed landmarks.
+    """
+    import tempfile
+    import subprocess
+
+    sourceArrayCombined = np.append(sourcePoints, sourceLandmarks, axis=0)
+    targetArray = np.asarray(targetPoints)
+    cloudSize = np.max(targetArray, 0) - np.min(targetArray, 0)
+    targetArray = targetArray * 25 / cloudSize
+    sourceArrayCombined = sourceArrayCombined * 25 / cloudSize
+
+    if parameters["Acceleration"] == 0:
+        registration = cpdRegistration(targetArray, sourceArrayCombined, parameters["CPDIterations"],
+                                       parameters["CPDTolerance"], parameters["alpha"], parameters["beta"])
+        deformedArray, _ = registration.register()
+    else:
+        with tempfile.TemporaryDirectory(dir=workingFolder) as folder:
+            targetPath = os.path.join(folder, "target.txt")
+            sourcePath = os.path.join(folder, "source.txt")
+            np.savetxt(targetPath, targetArray, delimiter=",")
+            np.savetxt(sourcePath, sourceArrayCombined, delimiter=",")
+            path = os.path.join(parameters["BCPDFolder"], "bcpd")
+            cmd = f'"{path}" -x "{targetPath}" -y "{sourcePath}" -l{parameters["alpha"]} -b{parameters["beta"]} -g0.1 -K140 -J500 -c1e-6 -p -d7 -e0.3 -f0.3 -ux -N1'
+            # bcpd writes its output files to the working directory
+            subprocess.run(cmd, shell=True, check=True, text=True, capture_output=True, cwd=folder)
+            deformedArray = np.loadtxt(os.path.join(folder, "output_y.txt"))
+    # Capture output landmarks from source pointcloud
+    return deformedArray[-len(sourceLandmarks):] * cloudSize / 25
+
+
+def warpPolyData(polyData, sourceLandmarks, targetLandmarks):
+    """
+    Thin plate spline warp of polyData taking the (landmarks x 3) sourceLandmarks to targetLandmarks.
+    """
+    transform = vtk.vtkThinPlateSplineTransform()
+    transform.SetSourceLandmarks(pointsToVTK(sourceLandmarks))
+    transform.SetTargetLandmarks(pointsToVTK(targetLandmarks))
+    transform.SetBasisToR()  # for 3D transform
+    transformFilter = vtk.vtkTransformPolyDataFilter()
+    transformFilter.SetInputData(polyData)
+    transformFilter.SetTransform(transform)
+    transformFilter.Update()
+    return transformFilter.GetOutput()
+
+
+def projectPointsPolydata(sourcePolydata, targetPolydata, originalPoints, rayLength):
+    """
+    Projects the vtkPoints originalPoints onto targetPolydata along the normals of their closest
+    sourcePolydata points, up to rayLength in either direction, or to the closest target point if no
+    surface is hit. Returns the projected points as a vtkPolyData.
+    """
+    print("original points: ", originalPoints.GetNumberOfPoints())
+    # set up polydata for projected points to return
+    projectedPointData = vtk.vtkPolyData()
+    projectedPoints = vtk.vtkPoints()
+    projectedPointData.SetPoints(projectedPoints)
+
+    # set up locater for intersection with normal vector rays
+    obbTree = vtk.vtkOBBTree()
+    obbTree.SetDataSet(targetPolydata)
+    obbTree.BuildLocator()
+
+    # set up point locator for finding surface normals and closest point
+    pointLocator = vtk.vtkPointLocator()
+    pointLocator.SetDataSet(sourcePolydata)
+    pointLocator.BuildLocator()
+
+    targetPointLocator = vtk.vtkPointLocator()
+    targetPointLocator.SetDataSet(targetPolydata)
+    targetPointLocator.BuildLocator()
+
+    # get surface normal from each landmark point
+    normalArray = sourcePolydata.GetPointData().GetArray("Normals")
+    if not normalArray:
+        print("no normal array, calculating....")
+        normalFilter = vtk.vtkPolyDataNormals()
+        normalFilter.ComputePointNormalsOn()
+        normalFilter.SetInputData(sourcePolydata)
+        normalFilter.Update()
+        normalArray = normalFilter.GetOutput().GetPointData().GetArray("Normals")
+        if not normalArray and sourcePolydata.GetNumberOfPoints() >= 3:
+            print("no surface cells, estimating normals from the points")
+            normalArray = estimatePolyDataNormals(sourcePolydata)
+        if not normalArray:
+            print("Error: no normal array")
+            return projectedPointData
+    for index in range(originalPoints.GetNumberOfPoints()):
+        originalPoint = originalPoints.GetPoint(index)
+        # get ray direction from closest normal
+        closestPointId = pointLocator.FindClosestPoint(originalPoint)
+        rayDirection = normalArray.GetTuple(closestPointId)
+        rayEndPoint = [originalPoint[dim] + rayDirection[dim] * rayLength for dim in range(3)]
+        intersectionIds = vtk.vtkIdList()
+        intersectionPoints = vtk.vtkPoints()
+        obbTree.IntersectWithLine(originalPoint, rayEndPoint, intersectionPoints, intersectionIds)
+        # if there are intersections, update the point to most external one.
+        if intersectionPoints.GetNumberOfPoints() > 0:
+            projectedPoints.InsertNextPoint(intersectionPoints.GetPoint(intersectionPoints.GetNumberOfPoints() - 1))
+            continue
+        # if there are no intersections, reverse the normal vector
+        rayEndPoint = [originalPoint[dim] - rayDirection[dim] * rayLength for dim in range(3)]
+        obbTree.IntersectWithLine(originalPoint, rayEndPoint, intersectionPoints, intersectionIds)
+        if intersectionPoints.GetNumberOfPoints() > 0:
+            projectedPoints.InsertNextPoint(intersectionPoints.GetPoint(0))
+        # if none in reverse direction, use closest mesh point
+        else:
+            closestPointId = targetPointLocator.FindClosestPoint(originalPoint)
+            projectedPoints.InsertNextPoint(targetPolydata.GetPoint(closestPointId))
+    return projectedPointData
+
+
+# Pairwise alignment
+def alignPair(sourcePolyData, targetPolyData, sourceLandmarks, scalingOption, projectionFactor, parameters,
+              usePoissonSubsample=False, workingFolder=None, cache=None):
+    """
+    Transfers the (landmarks x 3) sourceLandmarks of the source model to the target model: subsampling
+    and FPFH features, RANSAC and ICP, CPD of the subsampled clouds carrying the landmarks, and unless
+    projectionFactor is 0, projection of the landmarks onto the target surface along the normals of the
+    TPS warped source, up to projectionFactor times the target size. sourcePolyData is scaled in place.
+    cache is an optional FeatureCache.
+    Returns the predicted (landmarks x 3) landmarks.
+    """
+    sourcePoints, targetPoints, sourceFeatures, targetFeatures, voxelSize, scalingFactor = subsamplePair(
+        sourcePolyData, targetPolyData, scalingOption, parameters, usePoissonSubsample, cache)
+    similarityTransform, similarityFlag = estimateTransform(sourcePoints, targetPoints, sourceFeatures,
+        targetFeatures, voxelSize, scalingOption, parameters)
+    sourceLandmarks = transformPoints(np.asarray(sourceLandmarks, dtype=float) * scalingFactor, similarityTransform)
+    sourcePoints = transformPoints(sourcePoints, similarityTransform)
+    predictedLandmarks = runCPDRegistration(sourceLandmarks, sourcePoints, targetPoints, parameters, workingFolder)
+    if projectionFactor == 0:
+        return predictedLandmarks
+    alignedPolyData = transformPolyData(sourcePolyData, itkToVTKMatrix(similarityTransform))
+    warpedPolyData = warpPolyData(alignedPolyData, sourceLandmarks, predictedLandmarks)
+    maxProjection = targetPolyData.GetLength() * projectionFactor
+    projectedPoints = projectPointsPolydata(warpedPolyData, targetPolyData, pointsToVTK(predictedLandmarks), maxProjection)
+    return vtk_np.vtk_to_numpy(projectedPoints.GetPoints().GetData()).astype(float)
+
+
+def alignPairFiles(task):
+    """
+    Worker entry point: reads the models of a task (see runPairs) and runs alignPair. Returns a dictionary
+    with the predicted 'landmarks', or the 'error' message if the pair failed, and the 'seconds' spent.
+    """
+    startTime = time.perf_counter()
+    cache = None
+    try:
+        if task.get('featureCacheFolder'):
+            cache = FeatureCache(task['featureCacheFolder'], task.get('featureCacheSize', DEFAULT_FEATURE_CACHE_SIZE))
+        landmarks = alignPair(readModel(task['sourceModelPath']), readModel(task['targetModelPath']),
+            task['sourceLandmarks'], task['scalingOption'], task['projectionFactor'], task['parameters'],
+            task.get('usePoissonSubsample', False), cache=cache)
+        error = None
+    except Exception as e:
+        landmarks = None
+        error = f"{type(e).__name__}: {e}"
+    return {'landmarks': landmarks, 'error': error, 'seconds': time.perf_counter() - startTime,
+            'featureCache': None if cache is None else cache.statistics()}
+
+
+# Process pool
+def estimatePairMemory(task):
+    """
+    Rough peak memory in bytes of aligning the pair of a task, from the model file sizes and the number
+    of subsampled points expected at the task's point density.
+    """
+    modelBytes = os.path.getsize(task['sourceModelPath']) + os.path.getsize(task['targetModelPath'])
+    subsampledPoints = SUBSAMPLED_POINTS_PER_DENSITY * float(task['parameters']['pointDensity']) ** 2
+    return int(WORKER_MEMORY + MODEL_MEMORY_FACTOR * modelBytes + CPD_BYTES_PER_POINT_PAIR * subsampledPoints ** 2)
+
+
+def availableMemory():
+    """
+    Available physical memory in bytes, None if it cannot be determined.
+    """
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def workerNumber(tasks, workers=None, memoryLimit=None):
+    """
+    Number of worker processes for the tasks: workers (the CPU count if None), at most one per task,
+    and capped so that as many of the most memory hungry pairs fit in memoryLimit bytes (by default
+    MEMORY_FRACTION of the available memory).
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(tasks)))
+    if memoryLimit is None:
+        available = availableMemory()
+        memoryLimit = None if available is None else MEMORY_FRACTION * available
+    if memoryLimit is not None and tasks:
+        pairMemory = max(estimatePairMemory(task) for task in tasks)
+        workers = max(1, min(workers, int(memoryLimit // max(pairMemory, 1))))
+    return workers
+
+
+def pythonExecutable():
+    """
+    Python interpreter to start worker processes with. In Slicer sys.executable is the application,
+    so the PythonSlicer launcher next to it is used. The same lookup as the GPA module's
+    Support/process_lib.py, kept here so the ALPACA engine does not import from another module.
+    """
+    import sys
+    import shutil
+
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+    for name in ('PythonSlicer', 'PythonSlicer.exe'):
+        candidate = os.path.join(os.path.dirname(sys.executable), name)
+        if os.path.isfile(candidate):
+            return candidate
+    return shutil.which('PythonSlicer')
+
+
+def _initializeWorker(threadNumber):
+    # leave the CPUs to the other workers instead of every worker running ITK's default thread count
+    import itk
+    itk.MultiThreaderBase.SetGlobalMaximumNumberOfThreads(max(2, threadNumber))
+    itk.MultiThreaderBase.SetGlobalDefaultNumberOfThreads(threadNumber)
+
+
+def runPairs(tasks, workers=None, memoryLimit=None, cancelEvent=None, progressCallback=None, resultCallback=None,
+             pollInterval=0.2, pairFunction=alignPairFiles):
+    """
+    Aligns the pairs of tasks in a pool of worker processes. Every task is a dictionary with the
+    'sourceModelPath', the (landmarks x 3) 'sourceLandmarks' of the source model, the 'targetModelPath',
+    'scalingOption', 'projectionFactor', the ALPACA 'parameters' and optionally 'usePoissonSubsample',
+    and the 'featureCacheFolder' and 'featureCacheSize' (bytes) of a FeatureCache shared by the workers.
+    workers: process count, None for the number of CPUs; capped by memoryLimit (see workerNumber).
+    1 runs the pairs in this process.
+    cancelEvent: an object with is_set(), such as a threading.Event. Once it is set no more pairs are
+    started; pairs already running finish.
+    progressCallback(pairsDone, pairNumber) is called when a pair finishes and every pollInterval seconds
+    while waiting, so a GUI can process its events.
+    resultCallback(taskIndex, result) is called in this process for every finished pair, with the result
+    of alignPairFiles.
+    pairFunction: the picklable worker function a task is passed to, alignPairFiles by default.
+    A worker process that dies, for example by a segmentation fault or the out of memory killer, breaks
+    the pool. The pool is then rebuilt and the pairs that were running are retried one at a time, so the
+    pair that ends its worker again is found and recorded as failed; the other pairs are not lost.
+    Returns the list of results, None for pairs that were cancelled.
+    """
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    from concurrent.futures.process import BrokenProcessPool
+    import multiprocessing
+
+    results = [None] * len(tasks)
+    pairsDone = 0
+
+    def cancelled():
+        return cancelEvent is not None and cancelEvent.is_set()
+
+    def finish(taskIndex, result):
+        nonlocal pairsDone
+        results[taskIndex] = result
+        pairsDone += 1
+        if resultCallback is not None:
+            resultCallback(taskIndex, result)
+        if progressCallback is not None:
+            progressCallback(pairsDone, len(tasks))
+
+    if not tasks:
+        return results
+    workers = workerNumber(tasks, workers, memoryLimit)
+    if workers == 1:
+        for taskIndex, task in enumerate(tasks):
+            if cancelled():
+                break
+            finish(taskIndex, pairFunction(task))
+        return results
+
+    context = multiprocessing.get_context('spawn')
+    executable = pythonExecutable()
+    if executable is not None:
+        context.set_executable(executable)
+    threadNumber = max(1, (os.cpu_count() or 1) // workers)
+
+    def newExecutor():
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_initializeWorker,
+                                   initargs=(threadNumber,))
+
+    def failed(startTime, error):
+        return {'landmarks': None, 'error': f"{type(error).__name__}: {error}",
+                'seconds': time.perf_counter() - startTime, 'featureCache': None}
+
+    executor = newExecutor()
+    try:
+        # keep only as many pairs in flight as there are workers, so cancelling stops the queue quickly
+        pending = iter(enumerate(tasks))
+        # pairs that were running when a worker died, retried one at a time to find the one that ends its worker
+        retries = []
+        running = {}
+        while True:
+            while len(running) < (1 if retries else workers) and not cancelled():
+                if retries:
+                    taskIndex = retries.pop(0)
+                else:
+                    taskIndex, task = next(pending, (None, None))
+                    if task is None:
+                        break
+                running[executor.submit(pairFunction, tasks[taskIndex])] = (taskIndex, time.perf_counter())
+            if not running:
+                break
+            finished, notFinished = wait(running, timeout=pollInterval, return_when=FIRST_COMPLETED)
+            brokenPool = None
+            for future in finished:
+                taskIndex, startTime = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    brokenPool = e
+                    if len(finished) + len(notFinished) == 1:
+                        # the only pair in flight ended its worker
+                        finish(taskIndex, failed(startTime, e))
+                    else:
+                        retries.append(taskIndex)
+                    continue
+                except Exception as e:
+                    # e.g. a result that cannot be unpickled
+                    result = failed(startTime, e)
+                finish(taskIndex, result)
+            if brokenPool is not None:
+                # the futures still running fail with the pool as well
+                retries.extend(taskIndex for taskIndex, startTime in running.values())
+                retries.sort()
+                running = {}
+                executor.shutdown(wait=True)
+                executor = newExecutor()
+            if not finished and progressCallback is not None:
+                progressCallback(pairsDone, len(tasks))
+    finally:
+        executor.shutdown(wait=True)
+    return results
@@ -0,0 +1,296 @@
+"""
+Timing benchmarks for the ALPACA registration engine in alpaca_lib.
+
+These only need numpy/scipy (and itk or scikit-learn for some loop references), so they can be run
+from the Slicer python console
+  import ALPACALib.benchmark_lib as benchmark_lib
+  benchmark_lib.benchmarkICP()
+or from a plain python interpreter started in the ALPACA module folder.
+"""
+import time
+import tracemalloc
+import numpy as np
+
+
+def timeCall(function, *args, traceMemory=True, **kwargs):
+    """
+    Runs function and returns (result, wall time in seconds, peak traced memory in bytes). tracemalloc
+    slows down every allocation, so the timed call runs untraced and the peak is measured in a second
+    call, unless traceMemory is False (the peak is then None). Functions that update their arguments in
+    place get the updated arguments in the second call.
+    """
+    startTime = time.perf_counter()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - startTime
+    peak = None
+    if traceMemory:
+        tracemalloc.start()
+        try:
+            function(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def printResults(rows):
+    if not rows:
+        return
+    header = list(rows[0].keys())
+    print(", ".join(header))
+    for row in rows:
+        print(", ".join(f"{row[key]:.6g}" if isinstance(row[key], float) else str(row[key]) for key in header))
+
+
+# Point locator loop the ALPACA fitness evaluator in alpaca_lib replaced, kept as benchmark reference
+def loopFitness(movingPoints, fixedPoints, distanceThreshold):
+    """
+    Inlier ratio and mean inlier distance from one ITK point locator query per moving point (needs itk).
+    """
+    import itk
+    movingPointSet = itk.Mesh.F3.New()
+    movingPointSet.SetPoints(itk.vector_container_from_array(movingPoints.flatten().astype("float32")))
+    fixedPointSet = itk.Mesh.F3.New()
+    fixedPointSet.SetPoints(itk.vector_container_from_array(fixedPoints.flatten().astype("float32")))
+    PointType = itk.Point[itk.F, 3]
+    PointsContainerType = itk.VectorContainer[itk.IT, PointType]
+    pointsLocator = itk.PointsLocator[PointsContainerType].New()
+    pointsLocator.SetPoints(fixedPointSet.GetPoints())
+    pointsLocator.Initialize()
+    fitness = 0
+    inlierDistance = 0
+    for i in range(movingPointSet.GetNumberOfPoints()):
+        closestPoint = pointsLocator.FindClosestPoint(movingPointSet.GetPoint(i))
+        distance = (fixedPointSet.GetPoint(closestPoint) - movingPointSet.GetPoint(i)).GetNorm()
+        if distance < distanceThreshold:
+            fitness = fitness + 1
+            inlierDistance = inlierDistance + distance
+    if fitness == 0:
+        return 0, np.inf
+    return fitness / movingPointSet.GetNumberOfPoints(), inlierDistance / fitness
+
+
+def benchmarkFitness(pointCounts=(5000, 20000, 100000), evaluationNumber=11, distanceThreshold=0.05, noise=0.02,
+                     workers=-1, loopLimit=100000):
+    """
+    Times evaluationNumber fitness evaluations of perturbed copies of a noisy unit sphere against the
+    sphere, as estimateTransform scores its RANSAC attempts, with alpaca_lib.FitnessEvaluator (one
+    KD-tree, batched queries on workers threads) and, up to loopLimit points, with loopFitness (needs
+    itk). Reports the speedup and the largest differences in inlier ratio and inlier RMSE.
+    """
+    import ALPACALib.alpaca_lib as alpaca_lib
+    rng = np.random.default_rng(0)
+    rows = []
+    for pointNumber in pointCounts:
+        fixedPoints = rng.normal(size=(pointNumber, 3))
+        fixedPoints /= np.linalg.norm(fixedPoints, axis=1)[:, np.newaxis]
+        fixedPoints += noise * rng.normal(size=fixedPoints.shape)
+        movingClouds = []
+        for _ in range(evaluationNumber):
+            rotation, _ = np.linalg.qr(np.eye(3) + 0.05 * rng.normal(size=(3, 3)))
+            rotation *= np.sign(np.diag(rotation))
+            movingClouds.append((fixedPoints + noise * rng.normal(size=fixedPoints.shape)) @ rotation.T
+                                + 0.01 * rng.normal(size=3))
+        # float32 clouds, as the point locator loop sees them
+        fixedPoints = fixedPoints.astype(np.float32)
+        movingClouds = [points.astype(np.float32) for points in movingClouds]
+
+        def evaluateAll():
+            evaluator = alpaca_lib.FitnessEvaluator(fixedPoints, workers=workers)
+            return [evaluator.evaluate(points, distanceThreshold)[:2] for points in movingClouds]
+
+        results, elapsed, peak = timeCall(evaluateAll)
+        row = {
+            "points": pointNumber,
+            "evaluations": evaluationNumber,
+            "seconds": elapsed,
+            "peakMB": peak / 2**20,
+            "meanRatio": float(np.mean([ratio for ratio, _ in results])),
+            "loopSeconds": float('nan'),
+            "speedup": float('nan'),
+            "ratioDifference": float('nan'),
+            "rmseDifference": float('nan'),
+        }
+        if pointNumber <= loopLimit:
+            startTime = time.perf_counter()
+            loopResults = [loopFitness(points, fixedPoints, distanceThreshold) for points in movingClouds]
+            loopTime = time.perf_counter() - startTime
+            row["loopSeconds"] = loopTime
+            row["speedup"] = loopTime / elapsed
+            row["ratioDifference"] = float(max(abs(a[0] - b[0]) for a, b in zip(results, loopResults)))
+            row["rmseDifference"] = float(max(abs(a[1] - b[1]) for a, b in zip(results, loopResults)))
+        rows.append(row)
+    printResults(rows)
+    return rows
+
+
+# Per-iteration ICP loop the ALPACA ICP engine in alpaca_lib replaced, kept as benchmark reference
+def loopPointToPlaneICP(sourcePoints, destinationPoints, sourceNormals, destinationNormals, distanceThreshold=np.inf,
+                        maxIterations=30, tolerance=0.000001):
+    """
+    Point-to-plane ICP refitting a scikit-learn neighbour index every iteration, measuring the normal
+    angles point by point and solving the full linear system with a pseudo-inverse (needs scikit-learn).
+    """
+    import ALPACALib.alpaca_lib as alpaca_lib
+    from sklearn.neighbors import NearestNeighbors
+    src = np.ones((4, sourcePoints.shape[0]))
+    src[:3, :] = sourcePoints.T
+    previousError = 0
+    meanErrors = []
+    finalT = np.identity(4)
+    for i in range(maxIterations):
+        neighbors = NearestNeighbors(n_neighbors=1, algorithm="kd_tree")
+        neighbors.fit(destinationPoints)
+        distances, indices = neighbors.kneighbors(src[:3, :].T, return_distance=True)
+        distances, indices = distances.ravel(), indices.ravel()
+        matchedNormals = destinationNormals[indices, :]
+        angles = np.zeros(sourceNormals.shape[0])
+        for k in range(sourceNormals.shape[0]):
+            v1 = sourceNormals[k, :]
+            v2 = matchedNormals[k, :]
+            angles[k] = np.arccos(v1.dot(v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))) / np.pi * 180
+        keep = distances < distanceThreshold
+        A = src[:3, keep].T
+        normals = matchedNormals[keep]
+        H = np.column_stack((np.cross(A, normals), normals))
+        b = np.einsum('ij,ij->i', normals, destinationPoints[indices[keep]] - A)
+        tr = np.dot(np.linalg.pinv(H), b)
+        T = alpaca_lib.eulerMatrix(tr[0], tr[1], tr[2])
+        T[:3, 3] = tr[3:]
+        finalT = np.dot(T, finalT)
+        src = np.dot(T, src)
+        meanError = np.mean(distances[keep])
+        meanErrors.append(meanError)
+        if np.abs(previousError - meanError) < tolerance:
+            break
+        previousError = meanError
+    return meanErrors, (finalT, finalT[:3, :3], finalT[:, 3])
+
+
+def makeSyntheticSurface(pointNumber, rng, axes=(30.0, 20.0, 12.0), bumps=1.5):
+    """
+    Returns random points on a bumpy ellipsoid and their unit normals, estimated from the implicit
+    surface gradient.
+    """
+    axes = np.asarray(axes)
+    directions = rng.normal(size=(pointNumber, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+    radii = 1 + bumps / axes.min() * np.sin(3 * directions[:, 0]) * np.cos(2 * directions[:, 1])
+    points = directions * axes * radii[:, np.newaxis]
+    normals = directions / axes
+    normals /= np.linalg.norm(normals, axis=1)[:, np.newaxis]
+    return points, normals
+
+
+def benchmarkICP(pointCounts=(5000, 50000), angle=5.0, shift=1.0, distanceThreshold=3.0, maxIterations=30,
+                 weightings=(None, "huber", "tukey"), loopLimit=50000):
+    """
+    Times alpaca_lib.pointToPlaneICP on two independent samplings of a synthetic surface, the moving
+    one rotated by angle degrees and shifted by shift, for each robust weighting, and, up to loopLimit
+    points, loopPointToPlaneICP. Reports the iterations, the speedup over the loop and the rotation
+    (degrees) and translation errors of the recovered transform.
+    """
+    import ALPACALib.alpaca_lib as alpaca_lib
+    rng = np.random.default_rng(0)
+    rows = []
+    for pointNumber in pointCounts:
+        fixedPoints, fixedNormals = makeSyntheticSurface(pointNumber, rng)
+        movingPoints, movingNormals = makeSyntheticSurface(pointNumber, rng)
+        axis = rng.normal(size=3)
+        axis /= np.linalg.norm(axis)
+        theta = np.radians(angle)
+        cross = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+        rotation = np.eye(3) + np.sin(theta) * cross + (1 - np.cos(theta)) * np.dot(cross, cross)
+        translation = shift * rng.normal(size=3) / np.sqrt(3)
+        # the moving cloud is the fixed surface displaced; ICP has to undo the displacement
+        movingPoints = np.dot(movingPoints, rotation.T) + translation
+        movingNormals = np.dot(movingNormals, rotation.T)
+
+        def transformErrors(R, t):
+            rotationError = np.degrees(np.arccos(np.clip((np.trace(np.dot(R, rotation)) - 1) / 2, -1, 1)))
+            return float(rotationError), float(np.linalg.norm(np.dot(R, translation) + t))
+
+        loopTime = float('nan')
+        loopErrors = (float('nan'), float('nan'))
+        if pointNumber <= loopLimit:
+            startTime = time.perf_counter()
+            _, (_, R, t) = loopPointToPlaneICP(movingPoints, fixedPoints, movingNormals, fixedNormals,
+                                               distanceThreshold, maxIterations)
+            loopTime = time.perf_counter() - startTime
+            loopErrors = transformErrors(R, t[:3])
+        for weighting in weightings:
+            startTime = time.perf_counter()
+            meanErrors, (_, R, t) = alpaca_lib.PointToPlaneICP(fixedPoints, fixedNormals).register(
+                movingPoints, movingNormals, distanceThreshold, maxIterations, weighting=weighting)
+            elapsed = time.perf_counter() - startTime
+            rotationError, translationError = transformErrors(R, t[:3])
+            rows.append({
+                "points": pointNumber,
+                "weighting": str(weighting),
+                "iterations": len(meanErrors),
+                "seconds": elapsed,
+                "loopSeconds": loopTime,
+                "speedup": loopTime / elapsed,
+                "rotationError": rotationError,
+                "translationError": translationError,
+                "loopRotationError": loopErrors[0],
+                "loopTranslationError": loopErrors[1],
+            })
+    printResults(rows)
+    return rows
+
+
+# Per-point PCA the ALPACA normal estimation in alpaca_lib replaced, kept as benchmark reference
+def loopNormals(points, searchRadius):
+    """
+    Normals from one scikit-learn PCA fit per radius neighbourhood, oriented towards positive z
+    (needs scikit-learn).
+    """
+    from sklearn.neighbors import KDTree
+    from sklearn.decomposition import PCA
+    indices = KDTree(points, metric="minkowski").query_radius(points, r=searchRadius)
+    pca = PCA(n_components=3)
+    normals = []
+    for neighbours in indices:
+        pca.fit(np.identity(3) if len(neighbours) < 3 else points[neighbours])
+        normals.append(pca.components_[np.argmin(pca.explained_variance_)])
+    normals = np.array(normals)
+    normals[normals[:, 2] < 0] *= -1
+    return normals
+
+
+def benchmarkNormals(pointCounts=(5000, 20000, 100000), searchRadius=1.5, neighbourCount=30, loopLimit=20000):
+    """
+    Times alpaca_lib.estimateNormals on synthetic surfaces: the radius neighbourhoods, compared with
+    loopNormals up to loopLimit points, the k-nearest neighbourhoods and the graph orientation, which
+    should point every normal outward.
+    """
+    import ALPACALib.alpaca_lib as alpaca_lib
+    rng = np.random.default_rng(0)
+    # the first call pays for the scipy imports
+    alpaca_lib.estimateNormals(makeSyntheticSurface(100, rng)[0], None, searchRadius, orientation="graph")
+    rows = []
+    for pointNumber in pointCounts:
+        points, surfaceNormals = makeSyntheticSurface(pointNumber, rng)
+        normals, elapsed, peak = timeCall(alpaca_lib.estimateNormals, points, None, searchRadius)
+        row = {
+            "points": pointNumber,
+            "seconds": elapsed,
+            "peakMB": peak / 2**20,
+            "loopSeconds": float('nan'),
+            "speedup": float('nan'),
+            "maxDifference": float('nan'),
+        }
+        if pointNumber <= loopLimit:
+            startTime = time.perf_counter()
+            loopResult = loopNormals(points, searchRadius)
+            row["loopSeconds"] = time.perf_counter() - startTime
+            row["speedup"] = row["loopSeconds"] / elapsed
+            row["maxDifference"] = float(np.abs(loopResult - normals).max())
+        _, row["knnSeconds"], _ = timeCall(alpaca_lib.estimateNormals, points, neighbourCount, traceMemory=False)
+        normals, row["graphSeconds"], _ = timeCall(alpaca_lib.estimateNormals, points, neighbourCount,
+                                                   orientation="graph", traceMemory=False)
+        row["outwardFraction"] = float(np.mean(np.einsum('ij,ij->i', normals, surfaceNormals) > 0))
+        rows.append(row)
+    printResults(rows)
+    return rows
@@ -0,0 +1,22 @@
+"""
+Worker side of ALPACATest.
+
+Functions that ALPACATest sends to alpaca_lib.runPairs worker processes. They live outside ALPACA.py
+because the workers run PythonSlicer, which cannot import the module's Qt and scene code.
+"""
+import os
+import time
+
+
+def exitingPairFunction(task):
+    """
+    Stand-in for alpaca_lib.alignPairFiles that ends its worker process abruptly, as a segmentation
+    fault or the out of memory killer would, for tasks with 'exitWorker' set. Otherwise returns the
+    task's 'landmarks' after task['seconds'], like alignPairFiles.
+    """
+    startTime = time.perf_counter()
+    if task.get('exitWorker'):
+        os._exit(1)
+    time.sleep(task.get('seconds', 0))
+    return {'landmarks': task['landmarks'], 'error': None, 'seconds': time.perf_counter() - startTime,
+            'featureCache': None}
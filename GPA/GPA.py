@@ -13,6 +13,11 @@ import json
 
 import Support.vtk_lib as vtk_lib
 import Support.gpa_lib as gpa_lib
+import Support.io_lib as io_lib
+import Support.kernel_lib as kernel_lib
+import Support.distance_lib as distance_lib
+import Support.tps_lib as tps_lib
+import Support.resampling_lib as resampling_lib
 import  numpy as np
 from datetime import datetime
 import scipy.linalg as sp
@@ -150,7 +155,8 @@ class sliderGroup(qt.QGroupBox):
         self.spinBox.setValue(0)
         self.comboBox.clear()
 
-    def __init__(self, parent=None, onSliderChanged=None, onComboBoxChanged=None, dynamic_min=0, dynamic_max=1):
+    def __init__(self, parent=None, onSliderChanged=None, onComboBoxChanged=None, dynamic_min=0, dynamic_max=1,
+                 onSliderPressed=None, onSliderReleased=None):
         super().__init__(parent)
 
         self.dynamic_min = dynamic_min
@@ -181,6 +187,10 @@ class sliderGroup(qt.QGroupBox):
             self.slider.valueChanged.connect(onSliderChanged)
         if onComboBoxChanged:
             self.comboBox.currentIndexChanged.connect(onComboBoxChanged)
+        if onSliderPressed:
+            self.slider.sliderPressed.connect(onSliderPressed)
+        if onSliderReleased:
+            self.slider.sliderReleased.connect(onSliderReleased)
 
         # layout
         slidersLayout = qt.QGridLayout()
@@ -263,47 +273,143 @@ class LMData:
       self.sortedEig = gpa_lib.pairEig(self.val, self.vec)
       self.procdist = outputData.proc_dist.to_numpy()
       self.procdist=self.procdist.reshape(-1,1)
+      twoDim = gpa_lib.makeTwoDim(self.lm)
+      self.totalVariance = np.einsum('ij,ij->',twoDim,twoDim)/float(twoDim.shape[1])
       return 1
     except:
       print("Error loading results")
       self.GPALogTextbox.insertPlainText("Error loading results: Failed to initialize from file \n")
       return 0
 
-  def calcLMVariation(self, SampleScaleFactor, BoasOption):
-    i,j,k=self.lmOrig.shape
-    varianceMat=np.zeros((i,j))
-    for subject in range(k):
-      tmp=pow((self.lmOrig[:,:,subject]-self.mShape),2)
-      varianceMat=varianceMat+tmp
+  def calcLMVariation(self, SampleScaleFactor, BoasOption, dtype=np.float64):
     # if GPA scaling has been skipped, don't apply image size scaling factor
     if(BoasOption):
-      varianceMat =np.sqrt(varianceMat/(k-1))
-    else:
-      varianceMat = SampleScaleFactor*np.sqrt(varianceMat/(k-1))
-    return varianceMat
+      SampleScaleFactor = 1.0
+    return kernel_lib.landmarkVariance(self.lmOrig, self.mShape, SampleScaleFactor, dtype)
 
-  def doGpa(self,BoasOption):
+  def doGpa(self,BoasOption, memoryCeiling=None, tolerance=0.0001, maxIterations=5, acceleration=None):
+    """
+    memoryCeiling: if set, the GPA runs out of core (gpa_lib.runGPASolverOutOfCore), processing chunks of
+    specimens so the working memory stays below this many bytes. lmOrig is then typically a memory map
+    from io_lib.createLandmarkMemmap.
+    tolerance, maxIterations, acceleration: stopping rule and mean update of gpa_lib.runGPASolver. The
+    convergence trace is stored in self.gpaTrace.
+    """
     i,j,k=self.lmOrig.shape
-    self.centriodSize=np.zeros(k)
-    for subjectNum in range(k):
-      self.centriodSize[subjectNum]=np.linalg.norm(self.lmOrig[:,:,subjectNum]-self.lmOrig[:,:,subjectNum].mean(axis=0))
-    if not BoasOption:
-      self.lm, self.mShape=gpa_lib.runGPA(self.lmOrig)
-    else:
-      self.lm, self.mShape=gpa_lib.runGPANoScale(self.lmOrig)
+    if memoryCeiling is not None:
+      self.centriodSize=gpa_lib.centroidSizeOutOfCore(self.lmOrig, memoryCeiling)
+      self.lm, self.mShape, self.gpaTrace=gpa_lib.runGPASolverOutOfCore(self.lmOrig, memoryCeiling, scale=not BoasOption,
+        tolerance=tolerance, maxIterations=maxIterations, acceleration=acceleration)
+      self.procdist = gpa_lib.procDist(self.lm, self.mShape)
+      return
+    centered=self.lmOrig-self.lmOrig.mean(axis=0, keepdims=True)
+    self.centriodSize=np.sqrt(np.einsum('ijk,ijk->k',centered,centered))
+    self.lm, self.mShape, self.gpaTrace=gpa_lib.runGPASolver(self.lmOrig, scale=not BoasOption, tolerance=tolerance,
+      maxIterations=maxIterations, acceleration=acceleration)
     self.procdist = gpa_lib.procDist(self.lm, self.mShape)
 
-  def calcEigen(self):
+  def calcEigen(self, method='auto', pcNumber=None, truncatedSolver='randomized', memoryCeiling=None):
+    """
+    method: 'covariance' decomposes the full 3p x 3p covariance matrix, 'gram' decomposes the
+    k x k specimen Gram matrix and maps the eigenvectors back to coordinate space, 'truncated'
+    computes only the leading pcNumber PCs with truncatedSolver ('randomized' or 'lanczos').
+    'auto' uses the truncated solver when pcNumber is given and both the specimen and coordinate
+    counts are large, otherwise the Gram matrix whenever there are fewer specimens than coordinates.
+    memoryCeiling: if set, the covariance or Gram matrix is accumulated out of core in chunks of
+    specimens within this many bytes, and method is ignored.
+    """
     i, j, k = self.lmOrig.shape
+    self.eigenInfo=None
+    if memoryCeiling is not None:
+      self.totalVariance=kernel_lib.squaredDeviationSum(self.lm, self.mShape).sum()/float(k)
+      self.val, self.vec = gpa_lib.calcEigenOutOfCore(self.lm, self.mShape, memoryCeiling, pcNumber)
+      self.eigenMethod = 'outOfCore'
+      self.sortedEig = gpa_lib.pairEig(self.val, self.vec)
+      return
     twoDim=gpa_lib.makeTwoDim(self.lm)
-    covMatrix=gpa_lib.calcCov(twoDim)
-    if k>i*j: # limit results returned if sample number is less than observations
-      self.val, self.vec = sp.eigh(covMatrix)
-    else:
-      self.val, self.vec=sp.eigh(covMatrix, eigvals=(i * j - k, i * j - 1))
-    self.val=self.val[::-1]
-    self.vec=self.vec[:, ::-1]
+    self.totalVariance=np.einsum('ij,ij->',twoDim,twoDim)/float(k)
+    self.val, self.vec, self.eigenMethod, self.eigenInfo = gpa_lib.calcEigenByMethod(twoDim, method, pcNumber, truncatedSolver)
+    self.sortedEig = gpa_lib.pairEig(self.val, self.vec)
+
+  def resampleShapeStatistics(self, BoasOption, mode='bootstrap', replicateNumber=1000, groups=None, pcNumber=10, seed=0, workers=None):
+    """
+    Bootstrap (PC stability) or permutation (group differences, groups holds one label per specimen)
+    replicates of the GPA and PCA of this dataset, run in a process pool by resampling_lib.resample.
+    The results are also stored in self.resamplingResults.
+    """
+    self.resamplingResults = resampling_lib.resample(self.lm, mode, replicateNumber, groups=groups, scale=not BoasOption,
+      pcNumber=pcNumber, seed=seed, workers=workers)
+    return self.resamplingResults
+
+  def addSpecimens(self, newLandmarks, BoasOption, driftTolerance=None, pcNumber=None, compareToFull=False, comparePCs=10):
+    """
+    Adds the (landmarks x 3 x new specimens) array newLandmarks to an analysis set up by doGpa and
+    calcEigen. The new specimens are aligned to the existing consensus and the mean shape, eigenvalues
+    and eigenvectors are updated from them instead of being recomputed.
+    The drift is the Procrustes distance between the previous and the updated mean shape. If it exceeds
+    driftTolerance, the GPA and PCA are recomputed from scratch for all specimens instead.
+    If compareToFull is set, a full recompute is also run to measure how far the incremental result is
+    from it, over the first comparePCs PCs.
+    Returns a report dictionary, also stored as self.incrementalReport.
+    """
+    newLandmarks = np.array(newLandmarks, dtype=float)
+    i, j, k = self.lm.shape
+    newNumber = newLandmarks.shape[2]
+    centered = newLandmarks-newLandmarks.mean(axis=0, keepdims=True)
+    centroidSize = np.concatenate((np.ravel(self.centriodSize), np.sqrt(np.einsum('ijk,ijk->k',centered,centered))))
+    previousMeanShape = np.array(self.mShape)
+    # GPA is invariant to the similarity transforms already applied, so a refit can start from the aligned shapes
+    allLandmarks = np.concatenate((self.lm, newLandmarks), axis=2)
+
+    gpa_lib.alignToConsensus(previousMeanShape, newLandmarks, scale=not BoasOption)
+    meanVec = np.reshape(previousMeanShape, i*j, order='F')
+    newVec = np.transpose(newLandmarks,(1,0,2)).reshape(i*j, newNumber)
+    meanVec, val, vec, totalVariance = gpa_lib.updateEigenIncremental(meanVec, self.val, self.vec, k, newVec,
+      self.totalVariance, pcNumber)
+    meanShape = np.reshape(meanVec, (i,j), order='F')
+    drift = float(np.linalg.norm(meanShape-previousMeanShape))
+    report = {'specimensAdded': newNumber, 'drift': drift, 'driftTolerance': driftTolerance}
+
+    if driftTolerance is not None and drift > driftTolerance:
+      self.lmOrig = allLandmarks.copy()
+      self.doGpa(BoasOption)
+      self.centriodSize = centroidSize
+      self.calcEigen(pcNumber=pcNumber)
+      report['mode'] = 'refit'
+      self.incrementalReport = report
+      return report
+
+    self.lm = np.concatenate((self.lm, newLandmarks), axis=2)
+    self.lmOrig = self.lm
+    self.mShape = meanShape
+    self.val, self.vec = val, vec
+    self.totalVariance = totalVariance
+    self.centriodSize = centroidSize
+    self.procdist = gpa_lib.procDist(self.lm, self.mShape).reshape(-1,1)
+    self.eigenMethod = 'incremental'
+    self.eigenInfo = None
     self.sortedEig = gpa_lib.pairEig(self.val, self.vec)
+    report['mode'] = 'incremental'
+
+    if compareToFull:
+      if not BoasOption:
+        fullLandmarks, fullMeanShape = gpa_lib.runGPABatched(allLandmarks)
+      else:
+        fullLandmarks, fullMeanShape = gpa_lib.runGPANoScaleBatched(allLandmarks)
+      # compare in the frame of the incremental result
+      fullMeanShape = gpa_lib.alignShape(self.mShape, fullMeanShape)
+      gpa_lib.alignShapes(self.mShape, fullLandmarks)
+      fullVal, fullVec = gpa_lib.calcEigenGram(gpa_lib.makeTwoDim(fullLandmarks))
+      # with fewer specimens than comparePCs the trailing eigenvalues are zero and their PCs arbitrary
+      nonzero = np.count_nonzero(fullVal > 1e-12*max(fullVal.max(), np.finfo(float).tiny))
+      count = min(comparePCs, len(self.val), nonzero)
+      cosines = np.abs(np.einsum('ij,ij->j', self.vec[:,:count], fullVec[:,:count]))
+      report['meanShapeDifference'] = float(np.linalg.norm(self.mShape-fullMeanShape))
+      report['maxProcrustesDistanceDifference'] = float(np.abs(np.ravel(self.procdist)-gpa_lib.procDist(fullLandmarks, fullMeanShape)).max())
+      report['maxEigenvalueRelativeError'] = float((np.abs(self.val[:count]-fullVal[:count])/fullVal[:count]).max())
+      report['minPCCosine'] = float(cosines.min())
+    self.incrementalReport = report
+    return report
 
   def ExpandAlongPCs(self, numVec,scaleFactor,SampleScaleFactor):
     b=0
@@ -368,7 +474,6 @@ class LMData:
     temp = np.vstack((np.array(headerCoordinate), temp))
     np.savetxt(outputFolder + os.sep + "meanShape.csv", temp, delimiter=",", fmt='%s')
 
-    percentVar = self.val / self.val.sum()
     files = np.array(files)
     i = files.shape
     files = files.reshape(i[0], 1)
@@ -399,11 +504,46 @@ class LMData:
     twoDcoors = gpa_lib.makeTwoDim(self.lm)
     scores = np.dot(np.transpose(twoDcoors), self.vec)
     scores = np.real(scores)
+    self.pcScores = scores
     headerPC.insert(0, "Sample_name")
     temp = np.column_stack((files.reshape(i, 1), scores))
     temp = np.vstack((headerPC, temp))
     np.savetxt(outputFolder + os.sep + "pcScores.csv", temp, fmt="%s", delimiter=",")
 
+  def writeResultsBundle(self, outputFolder, files, metadata):
+    """
+    Writes the analysis results as a binary bundle next to the CSV output, so they can be
+    reloaded memory-mapped by initializeFromBundle without parsing or recomputation.
+    Call after writeOutData, which computes the PC scores.
+    """
+    arrays = {
+      'lm': self.lm,
+      'mShape': self.mShape,
+      'val': np.real(self.val),
+      'vec': np.real(self.vec),
+      'pcScores': self.pcScores,
+      'procdist': np.ravel(self.procdist),
+      'centroidSize': np.ravel(self.centriodSize),
+      }
+    metadata = dict(metadata)
+    metadata['SampleNames'] = list(files)
+    metadata['TotalVariance'] = float(self.totalVariance)
+    return io_lib.writeResultsBundle(outputFolder, arrays, metadata)
+
+  def initializeFromBundle(self, resultsFolder):
+    arrays, metadata = io_lib.readResultsBundle(resultsFolder)
+    self.lm = arrays['lm']
+    self.lmOrig = self.lm
+    self.mShape = arrays['mShape']
+    self.val = arrays['val']
+    self.vec = arrays['vec']
+    self.pcScores = arrays['pcScores']
+    self.procdist = arrays['procdist'].reshape(-1,1)
+    self.centriodSize = arrays['centroidSize'].reshape(-1,1)
+    self.totalVariance = metadata['TotalVariance']
+    self.sortedEig = gpa_lib.pairEig(self.val, self.vec)
+    return metadata
+
   def flattenArray(self, dataArray):
     i,j,k=dataArray.shape
     tmp=np.zeros((i*j,k))
@@ -804,12 +944,11 @@ class GPAWidget(ScriptedLoadableModuleWidget):
 
     # PC warping helper functions
     def setupPCTransform():
-      if self.slider1.boxValue() > 0:
+      if self.slider1.boxValue() > 0 and hasattr(self, 'pcDisplacementBasis'):
         self.currentPC = self.slider1.boxValue()
         self.pcMax = np.max(self.scatterDataAll, axis=0)[self.currentPC - 1]
         self.pcMin = np.min(self.scatterDataAll, axis=0)[self.currentPC - 1]
         self.pcScoreAbsMax = max(abs(self.pcMin), abs(self.pcMax))  # Maximum absolute deviation
-        self.displacementGridData = getGridTransform(self.currentPC)
 
         needNewNode = not hasattr(self, 'gridTransformNode') or not slicer.mrmlScene.IsNodePresent(self.gridTransformNode)
         if needNewNode:
@@ -820,73 +959,51 @@ class GPAWidget(ScriptedLoadableModuleWidget):
         self.cloneLandmarkNode.SetAndObserveTransformNodeID(self.gridTransformNode.GetID())
         if hasattr(self, 'cloneModelNode') and self.modelVisualizationType.checked:
           self.cloneModelNode.SetAndObserveTransformNodeID(self.gridTransformNode.GetID())
+          if getattr(self, 'proxyModelNode', None) is not None:
+            self.proxyModelNode.SetAndObserveTransformNodeID(self.gridTransformNode.GetID())
 
         self.slider1.setRange(self.pcMin, self.pcMax)  # Dynamic range displayed
         self.slider1.spinBox.setValue(0)
         updatePCScaling()
 
-    def getGridTransform(pcValue):
-      logic = GPALogic()
-      magnification = self.spinMagnification.value
-
-      shiftMax = self.LM.ExpandAlongSinglePC(pcValue, self.pcScoreAbsMax * magnification, self.sampleSizeScaleFactor)
-      target = self.rawMeanLandmarks + shiftMax
-      targetLMVTK = logic.convertNumpyToVTK(target)
-      sourceLMVTK = logic.convertNumpyToVTK(self.rawMeanLandmarks)
-
-      VTKTPS = vtk.vtkThinPlateSplineTransform()
-      VTKTPS.SetSourceLandmarks(targetLMVTK)
-      VTKTPS.SetTargetLandmarks(sourceLMVTK)
-      VTKTPS.SetBasisToR()
-
-      modelBounds = [0] * 6
-      if hasattr(self, 'cloneModelNode') and self.cloneModelNode is not None and self.modelVisualizationType.checked:
-          modelBounds = getExpandedBounds(self.cloneModelNode)
-      else:
-          modelBounds = getExpandedBounds(self.cloneLandmarkNode)
-      origin = (modelBounds[0], modelBounds[2], modelBounds[4])
-      size = (modelBounds[1] - modelBounds[0], modelBounds[3] - modelBounds[2], modelBounds[5] - modelBounds[4])
-      dimension = 50
-      extent = [0] * 6
-      extent[1::2] = [dimension - 1] * 3
-      spacing = (size[0]/dimension, size[1]/dimension, size[2]/dimension)
-
-      transformToGrid = vtk.vtkTransformToGrid()
-      transformToGrid.SetInput(VTKTPS)
-      transformToGrid.SetGridOrigin(origin)
-      transformToGrid.SetGridSpacing(spacing)
-      transformToGrid.SetGridExtent(extent)
-      transformToGrid.Update()
-
-      return transformToGrid.GetOutput()
-
-    def getExpandedBounds(node, paddingFactor=0.1):
-        bounds = [0] * 6
-        node.GetRASBounds(bounds)
-        # Expand bounds by paddingFactor
-        xRange = bounds[1] - bounds[0]
-        yRange = bounds[3] - bounds[2]
-        zRange = bounds[5] - bounds[4]
-        bounds[0] -= xRange * paddingFactor
-        bounds[1] += xRange * paddingFactor
-        bounds[2] -= yRange * paddingFactor
-        bounds[3] += yRange * paddingFactor
-        bounds[4] -= zRange * paddingFactor
-        bounds[5] += zRange * paddingFactor
-
-        return bounds
     def updatePCScaling():
-      if hasattr(self, 'gridTransformNode'):
+      if hasattr(self, 'gridTransformNode') and hasattr(self, 'pcDisplacementBasis'):
+        import time
+        if getattr(self, 'proxyModelNode', None) is not None and self.pcWarpUpdateTime is None:
+          # the latency runs to the end of the next render, see onPCWarpRendered
+          self.pcWarpUpdateTime = time.perf_counter()
         dynamic_value = self.slider1.sliderValue()  # Mapped PC score from spinbox
-        if self.pcScoreAbsMax > 1e-6:  # Avoid division by zero
-          sf = dynamic_value / self.pcScoreAbsMax
-        else:
-          sf = 0.0
-        # Clamp scaling factor
-        sf = max(min(sf, 1.0), -1.0)
-        self.gridTransformNode.GetTransformFromParent().SetDisplacementScale(sf)
+        # Clamp to the observed score range
+        score = max(min(dynamic_value, self.pcScoreAbsMax), -self.pcScoreAbsMax)
+        pcScores = np.zeros(len(self.pcDisplacementBasis))
+        pcScores[self.currentPC - 1] = score * self.pcDisplacementMagnification
+        GPALogic().combineDisplacementBasis(self.pcDisplacementBasis, pcScores, self.displacementGridArray)
+        self.displacementGridData.Modified()
+        self.gridTransformNode.GetTransformFromParent().Modified()
+
+    def showPCWarpModel(modelType):
+      # swap between the decimated proxy and the full resolution PC warped model
+      if getattr(self, 'proxyModelNode', None) is None:
+        return
+      self.displayedPCWarpModel = modelType
+      self.proxyModelNode.SetDisplayVisibility(modelType == 'proxy')
+      self.cloneModelNode.SetDisplayVisibility(modelType == 'full')
+
+    def onPCSliderPressed():
+      if self.proxyModelCheckBox.checked and not self.stopRecordButton.enabled:
+        showPCWarpModel('proxy')
+
+    def onPCSliderReleased():
+      if getattr(self, 'proxyModelNode', None) is None or self.displayedPCWarpModel == 'full':
+        return
+      showPCWarpModel('full')
+      updatePCScaling()
+      self.GPALogTextbox.insertPlainText(GPALogic().formatPCWarpLatencies(self.pcWarpLatencies, self.pcWarpPointNumbers))
+      self.pcWarpLatencies = {'proxy': [], 'full': []}
 
     def onUpdateMagnificationClicked():
+      if hasattr(self, 'pcDisplacementBasis'):
+        self.updatePCDisplacementMagnification()
       setupPCTransform()
 
     # PC warping
@@ -926,10 +1043,29 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     visLayout.addWidget(magnificationWidget, 3, 1, 1, 3)  # row 4, column 0, span across 3 columns
 
     self.PCList=[]
-    self.slider1=sliderGroup(onSliderChanged = updatePCScaling, onComboBoxChanged = setupPCTransform)
+    self.slider1=sliderGroup(onSliderChanged = updatePCScaling, onComboBoxChanged = setupPCTransform,
+      onSliderPressed = onPCSliderPressed, onSliderReleased = onPCSliderReleased)
     self.slider1.connectList(self.PCList)
     visLayout.addWidget(self.slider1,4,1,1,3)
 
+    # Level of detail: warp a decimated copy of the model while the slider is dragged
+    self.proxyModelCheckBox = qt.QCheckBox()
+    self.proxyModelCheckBox.checked = True
+    self.proxyModelCheckBox.setText("Use decimated proxy model while dragging")
+    self.proxyModelCheckBox.setToolTip("Warp a decimated copy of the 3D model while the PC slider is dragged and the full resolution model when it is released. The full resolution model is always used while recording.")
+    visLayout.addWidget(self.proxyModelCheckBox,5,1)
+    proxyReductionLabel = qt.QLabel("Proxy decimation target reduction:")
+    proxyReductionLabel.setAlignment(qt.Qt.AlignRight | qt.Qt.AlignVCenter)
+    visLayout.addWidget(proxyReductionLabel,5,2)
+    self.proxyReductionSpinBox = qt.QDoubleSpinBox()
+    self.proxyReductionSpinBox.setDecimals(2)
+    self.proxyReductionSpinBox.setSingleStep(0.05)
+    self.proxyReductionSpinBox.setMinimum(0)
+    self.proxyReductionSpinBox.setMaximum(0.99)
+    self.proxyReductionSpinBox.setValue(0.9)
+    self.proxyReductionSpinBox.setToolTip("Fraction of the triangles removed from the model to make the proxy, applied when the interactive visualization is set up")
+    visLayout.addWidget(self.proxyReductionSpinBox,5,3)
+
     # Create Animations
     animate=ctk.ctkCollapsibleButton()
     animate.text='Create animation of PC Warping'
@@ -947,6 +1083,21 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     animateLayout.addWidget(self.stopRecordButton,1,5,1,2)
     self.stopRecordButton.connect('clicked(bool)', self.onStopRecording)
 
+    sweepStepsLabel = qt.QLabel("Sweep steps:")
+    sweepStepsLabel.setAlignment(qt.Qt.AlignRight | qt.Qt.AlignVCenter)
+    animateLayout.addWidget(sweepStepsLabel,2,1)
+    self.sweepStepsSpinBox = qt.QSpinBox()
+    self.sweepStepsSpinBox.setMinimum(2)
+    self.sweepStepsSpinBox.setMaximum(1000)
+    self.sweepStepsSpinBox.setValue(21)
+    self.sweepStepsSpinBox.setToolTip("Number of evenly spaced scores in the batch PC sweep")
+    animateLayout.addWidget(self.sweepStepsSpinBox,2,2)
+    self.createSweepButton = qt.QPushButton("Create PC Sweep Sequence")
+    self.createSweepButton.toolTip = "Compute the warps of the selected PC over its full score range and store them in sequences, without recording the slider."
+    self.createSweepButton.enabled = False
+    animateLayout.addWidget(self.createSweepButton,2,3,1,4)
+    self.createSweepButton.connect('clicked(bool)', self.onCreatePCSweep)
+
     # Reset button
     resetButton = qt.QPushButton("Reset Scene")
     resetButton.checkable = False
@@ -1038,7 +1189,7 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.slider1.populateComboBox(self.PCList)
     self.PCList.append('None')
     self.LM.val=np.real(self.LM.val)
-    percentVar=self.LM.val/self.LM.val.sum()
+    percentVar=self.LM.val/self.LM.totalVariance
     self.vectorOne.clear()
     self.vectorTwo.clear()
     self.vectorThree.clear()
@@ -1075,18 +1226,7 @@ class GPAWidget(ScriptedLoadableModuleWidget):
 
     tableNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTableNode', 'Procrustes Distance Table')
     GPANodeCollection.AddItem(tableNode)
-    col1=tableNode.AddColumn()
-    col1.SetName('ID')
-
-    col2=tableNode.AddColumn()
-    col2.SetName('Procrustes Distance')
-    tableNode.SetColumnType('ID',vtk.VTK_STRING)
-    tableNode.SetColumnType('Procrustes Distance',vtk.VTK_FLOAT)
-
-    for i in range(len(files)):
-      tableNode.AddEmptyRow()
-      tableNode.SetCellText(i,0,sortedArray['filename'][i])
-      tableNode.SetCellText(i,1,str(sortedArray['procdist'][i]))
+    vtk_lib.setTableColumns(tableNode, [('ID', sortedArray['filename'].tolist()), ('Procrustes Distance', sortedArray['procdist'])])
 
     barPlot = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLPlotSeriesNode', 'Distances')
     GPANodeCollection.AddItem(barPlot)
@@ -1119,6 +1259,8 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.outText.setText(" ")
     self.LM_dir_name=None
     self.openResultsButton.enabled = False
+    self.removePCWarpRenderObservers()
+    self.proxyModelNode = None
 
     self.grayscaleSelector.setCurrentPath("")
     self.FudSelect.setCurrentPath("")
@@ -1154,6 +1296,7 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.selectorButton.enabled = False
     self.stopRecordButton.enabled = False
     self.startRecordButton.enabled = False
+    self.createSweepButton.enabled = False
 
     #delete data from previous runs
     self.nodeCleanUp()
@@ -1358,44 +1501,16 @@ class GPAWidget(ScriptedLoadableModuleWidget):
   def onLoadFromFile(self):
     self.initializeOnLoad() #clean up module from previous runs
     logic = GPALogic()
-    import pandas
-
-    # Load data
-    outputDataPath = os.path.join(self.resultsDirectory, 'outputData.csv')
-    meanShapePath = os.path.join(self.resultsDirectory, 'meanShape.csv')
-    eigenVectorPath = os.path.join(self.resultsDirectory, 'eigenvector.csv')
-    eigenValuePath = os.path.join(self.resultsDirectory, 'eigenvalues.csv')
-    eigenValueNames = ['Index', 'Scores']
-    try:
-      eigenValues = pandas.read_csv(eigenValuePath, names=eigenValueNames)
-      eigenVector = pandas.read_csv(eigenVectorPath)
-      meanShape = pandas.read_csv(meanShapePath)
-      outputData = pandas.read_csv(outputDataPath)
-    except:
-      logging.debug('Result import failed: Missing file')
-      self.GPALogTextbox.insertPlainText(f"Result import failed: Missing file in output folder\n")
-      return
-
-    # Try to load skip scaling and skip LM options from log file, if present
-    self.BoasOption = False
-    self.LMExclusionList=[]
-    logFilePath = os.path.join(self.resultsDirectory, 'analysis.json')
-    try:
-      with open(logFilePath) as json_file:
-        logData = json.load(json_file)
-      self.BoasOption = logData['GPALog'][0]['Boas']
-      self.LMExclusionList = logData['GPALog'][0]['ExcludedLM']
-    except:
-      logging.debug('Log import failed: Cannot read the log file')
-      self.GPALogTextbox.insertPlainText("logging.debug('Log import failed: Cannot read the log file\n")
 
-    # Initialize variables
-    self.LM=LMData()
-    success = self.LM.initializeFromDataFrame(outputData, meanShape, eigenVector, eigenValues)
+    # Load data, preferring the memory-mapped results bundle over the CSV files
+    loadedFromBundle = io_lib.hasResultsBundle(self.resultsDirectory)
+    if loadedFromBundle:
+      success = self.loadResultsFromBundle()
+    else:
+      success = self.loadResultsFromCSV()
     if not success:
       return
 
-    self.files = outputData.Sample_name.tolist()
     shape = self.LM.lmOrig.shape
     print('Loaded ' + str(shape[2]) + ' subjects with ' + str(shape[0]) + ' landmark points.')
     self.GPALogTextbox.insertPlainText(f"Loaded {shape[2]} subjects with {shape[0]} landmark points.\n")
@@ -1420,8 +1535,8 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     logic = GPALogic()
     if self.BoasOption:
         self.sampleSizeScaleFactor = 1.0
-    else:
-      self.sampleSizeScaleFactor = logic.dist2(self.rawMeanLandmarks).max()
+    elif not loadedFromBundle:
+      self.sampleSizeScaleFactor = logic.dist2(self.rawMeanLandmarks, condensed=True).max()
     print("Scale Factor: " + str(self.sampleSizeScaleFactor))
     self.GPALogTextbox.insertPlainText(f"Scale Factor: {self.sampleSizeScaleFactor}\n")
     for landmarkNumber in range (shape[0]):
@@ -1451,11 +1566,14 @@ class GPAWidget(ScriptedLoadableModuleWidget):
 
     #Setup for scatter plots
     shape = self.LM.lm.shape
-    self.LM.calcEigen()
-    self.scatterDataAll= np.zeros(shape=(shape[2],self.pcNumber))
-    for i in range(self.pcNumber):
-      data=gpa_lib.plotTanProj(self.LM.lm,self.LM.sortedEig,i,1)
-      self.scatterDataAll[:,i] = data[:,0]
+    if loadedFromBundle:
+      self.scatterDataAll = np.array(self.LM.pcScores[:,:self.pcNumber])
+    else:
+      self.LM.calcEigen()
+      self.scatterDataAll= np.zeros(shape=(shape[2],self.pcNumber))
+      for i in range(self.pcNumber):
+        data=gpa_lib.plotTanProj(self.LM.lm,self.LM.sortedEig,i,1)
+        self.scatterDataAll[:,i] = data[:,0]
 
     # Set up layout
     self.assignLayoutDescription()
@@ -1480,6 +1598,57 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.landmarkVisualizationType.enabled = True
     self.modelVisualizationType.enabled = True
 
+  def loadResultsFromCSV(self):
+    import pandas
+    outputDataPath = os.path.join(self.resultsDirectory, 'outputData.csv')
+    meanShapePath = os.path.join(self.resultsDirectory, 'meanShape.csv')
+    eigenVectorPath = os.path.join(self.resultsDirectory, 'eigenvector.csv')
+    eigenValuePath = os.path.join(self.resultsDirectory, 'eigenvalues.csv')
+    eigenValueNames = ['Index', 'Scores']
+    try:
+      eigenValues = pandas.read_csv(eigenValuePath, names=eigenValueNames)
+      eigenVector = pandas.read_csv(eigenVectorPath)
+      meanShape = pandas.read_csv(meanShapePath)
+      outputData = pandas.read_csv(outputDataPath)
+    except:
+      logging.debug('Result import failed: Missing file')
+      self.GPALogTextbox.insertPlainText(f"Result import failed: Missing file in output folder\n")
+      return 0
+
+    # Try to load skip scaling and skip LM options from log file, if present
+    self.BoasOption = False
+    self.LMExclusionList=[]
+    logFilePath = os.path.join(self.resultsDirectory, 'analysis.json')
+    try:
+      with open(logFilePath) as json_file:
+        logData = json.load(json_file)
+      self.BoasOption = logData['GPALog'][0]['Boas']
+      self.LMExclusionList = logData['GPALog'][0]['ExcludedLM']
+    except:
+      logging.debug('Log import failed: Cannot read the log file')
+      self.GPALogTextbox.insertPlainText("logging.debug('Log import failed: Cannot read the log file\n")
+
+    # Initialize variables
+    self.LM=LMData()
+    success = self.LM.initializeFromDataFrame(outputData, meanShape, eigenVector, eigenValues)
+    if success:
+      self.files = outputData.Sample_name.tolist()
+    return success
+
+  def loadResultsFromBundle(self):
+    self.LM=LMData()
+    try:
+      metadata = self.LM.initializeFromBundle(self.resultsDirectory)
+    except Exception as e:
+      logging.debug(f'Result import failed: Could not read results bundle: {e}')
+      self.GPALogTextbox.insertPlainText(f"Result import failed: Could not read results bundle: {e}\n")
+      return 0
+    self.files = metadata['SampleNames']
+    self.BoasOption = metadata['Boas']
+    self.LMExclusionList = metadata['ExcludedLM']
+    self.sampleSizeScaleFactor = metadata['SampleSizeScaleFactor']
+    return 1
+
   def onLoad(self):
     self.initializeOnLoad() #clean up module from previous runs
     logic = GPALogic()
@@ -1499,12 +1668,24 @@ class GPAWidget(ScriptedLoadableModuleWidget):
       lmNP=np.asarray(self.LMExclusionList)
     else:
       self.LMExclusionList=[]
+    progressDialog = slicer.util.createProgressDialog(windowTitle="Loading...", labelText="Loading landmark files...",
+      maximum=len(self.inputFilePaths))
+    def updateProgress(filesDone, fileNumber):
+      progressDialog.setValue(filesDone)
+      slicer.app.processEvents()
+    landmarkCache = io_lib.LandmarkCache(os.path.join(slicer.app.cachePath, "GPA", "LandmarkCache"))
     try:
-      self.LM.lmOrig, self.landmarkTypeArray = logic.loadLandmarks(self.inputFilePaths, self.LMExclusionList, self.extension)
+      self.LM.lmOrig, self.landmarkTypeArray = logic.loadLandmarks(self.inputFilePaths, self.LMExclusionList, self.extension,
+        progressCallback=updateProgress, cache=landmarkCache)
     except:
       logging.debug('Load landmark data failed: Could not create an array from landmark files')
       self.GPALogTextbox.insertPlainText(f"Load landmark data failed: Could not create an array from landmark files\n")
       return
+    finally:
+      progressDialog.close()
+    cacheStatistics = landmarkCache.statistics()
+    self.GPALogTextbox.insertPlainText(f"Landmark cache: {cacheStatistics['hits']} hits, {cacheStatistics['misses']} misses, "
+      f"{cacheStatistics['bytesRead']/1024:.1f} KB read, {cacheStatistics['bytesWritten']/1024:.1f} KB written\n")
     shape = self.LM.lmOrig.shape
     print('Loaded ' + str(shape[2]) + ' subjects with ' + str(shape[0]) + ' landmark points.')
     self.GPALogTextbox.insertPlainText(f"Loaded {shape[2]} subjects with {shape[0]} landmark points.\n")
@@ -1512,7 +1693,16 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     # Do GPA
     self.BoasOption=self.BoasOptionCheckBox.checked
     self.LM.doGpa(self.BoasOption)
-    self.LM.calcEigen()
+    trace = self.LM.gpaTrace
+    if trace['converged']:
+      self.GPALogTextbox.insertPlainText(f"GPA converged in {trace['iterations']} iterations (residual {trace['residuals'][-1]:.3g})\n")
+    else:
+      self.GPALogTextbox.insertPlainText(f"GPA stopped after {trace['iterations']} iterations without reaching the tolerance {trace['tolerance']} (residual {trace['residuals'][-1]:.3g})\n")
+    # only the leading PCs are computed for very large datasets, see LMData.calcEigen
+    self.LM.calcEigen(pcNumber=50)
+    if self.LM.eigenInfo is not None:
+      info = self.LM.eigenInfo
+      self.GPALogTextbox.insertPlainText(f"Truncated PCA ({info['solver']}): first {info['pcNumber']} PCs capture {info['capturedVariance']*100:.2f}% of the variance, eigenvalue error bound {info['errorBound'].max():.3g}\n")
     self.pcNumber=10
     self.updateList()
 
@@ -1526,7 +1716,7 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     if self.BoasOption:
       self.sampleSizeScaleFactor = 1.0
     else:
-      self.sampleSizeScaleFactor = logic.dist2(self.rawMeanLandmarks).max()
+      self.sampleSizeScaleFactor = logic.dist2(self.rawMeanLandmarks, condensed=True).max()
     print("Scale Factor: " + str(self.sampleSizeScaleFactor))
     self.GPALogTextbox.insertPlainText(f"Scale Factor for visualizations: {self.sampleSizeScaleFactor}\n")
 
@@ -1564,6 +1754,12 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     try:
       os.makedirs(self.outputFolder)
       self.LM.writeOutData(self.outputFolder, self.files)
+      self.LM.writeResultsBundle(self.outputFolder, self.files, {
+        "ExcludedLM": self.LMExclusionList,
+        "Boas": bool(self.BoasOption),
+        "SampleSizeScaleFactor": float(self.sampleSizeScaleFactor),
+        "SemiLandmarks": self.landmarkTypeArray,
+        })
       # covariate table
       if hasattr(self, 'factorTableNode'):
         try:
@@ -1670,11 +1866,23 @@ class GPAWidget(ScriptedLoadableModuleWidget):
         "Eigenvectors": "eigenvectors.csv",
         "OutputData": "outputData.csv",
         "PCScores": "pcScores.csv",
+        "ResultsBundle": io_lib.BUNDLE_FOLDER_NAME,
         "SemiLandmarks": self.landmarkTypeArray,
         "CovariatesFile": covariatePath
         }
       ]
     }
+    trace = getattr(self.LM, 'gpaTrace', None)
+    if trace is not None:
+      logData["GPALog"][0]["GPAConvergence"] = {
+        "Converged": trace['converged'],
+        "Iterations": trace['iterations'],
+        "Tolerance": trace['tolerance'],
+        "MaxIterations": trace['maxIterations'],
+        "Acceleration": trace['acceleration'] or "none",
+        "Residuals": trace['residuals'],
+        "Seconds": trace['seconds'],
+        }
     logFilePath = outputPath+os.sep+"analysis.json"
     with open(logFilePath, 'w') as logFile:
       print(json.dumps(logData, indent=2), file=logFile)
@@ -1797,20 +2005,9 @@ class GPAWidget(ScriptedLoadableModuleWidget):
   def plotDistributionCloud(self):
     self.unplotDistributions()
     i,j,k=self.LM.lmOrig.shape
-    pt=[0,0,0]
-    #set up vtk point array for each landmark point
-    points = vtk.vtkPoints()
-    points.SetNumberOfPoints(i*k)
-    indexes = vtk.vtkDoubleArray()
-    indexes.SetName('LM Index')
-    pointCounter = 0
-
-    for subject in range(0,k):
-      for landmark in range(0,i):
-        pt=self.LM.lmOrig[landmark,:,subject]
-        points.SetPoint(pointCounter,pt)
-        indexes.InsertNextValue(landmark+1)
-        pointCounter+=1
+    #set up vtk point array for each landmark point, ordered by subject then landmark
+    points = vtk_lib.convertNumpyToVTK(np.transpose(self.LM.lmOrig, (2,0,1)).reshape(i*k,3))
+    indexes = vtk_lib.numpyToVTKArray(np.tile(np.arange(1,i+1), k), 'LM Index', vtk.VTK_DOUBLE)
 
     #add points to polydata
     polydata=vtk.vtkPolyData()
@@ -1850,30 +2047,19 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.unplotDistributions()
     varianceMat = self.LM.calcLMVariation(self.sampleSizeScaleFactor, self.BoasOption)
     i,j,k=self.LM.lmOrig.shape
-    pt=[0,0,0]
     #set up vtk point array for each landmark point
-    points = vtk.vtkPoints()
-    points.SetNumberOfPoints(i)
-    scales = vtk.vtkDoubleArray()
-    scales.SetName("Scales")
-    index = vtk.vtkDoubleArray()
-    index.SetName("Index")
-
-    #set up tensor array to scale ellipses
-    tensors = vtk.vtkDoubleArray()
-    tensors.SetNumberOfTuples(i)
-    tensors.SetNumberOfComponents(9)
-    tensors.SetName("Tensors")
+    points = vtk_lib.convertNumpyToVTK(self.rawMeanLandmarks)
+    scales = vtk_lib.numpyToVTKArray(sliderScale*varianceMat.mean(axis=1), "Scales", vtk.VTK_DOUBLE)
+    index = vtk_lib.numpyToVTKArray(np.arange(1,i+1), "Index", vtk.VTK_DOUBLE)
+
+    #set up tensor array to scale ellipses, with the variances on the diagonal
+    tensorValues = np.zeros((i,9))
+    tensorValues[:,[0,4,8]] = sliderScale*varianceMat
+    tensors = vtk_lib.numpyToVTKArray(tensorValues, "Tensors", vtk.VTK_DOUBLE)
 
     # get fiducial node for mean landmarks, make just labels visible
     self.meanLandmarkNode.SetDisplayVisibility(1)
     self.scaleMeanShapeSlider.value=0
-    for landmark in range(i):
-      pt=self.rawMeanLandmarks[landmark,:]
-      points.SetPoint(landmark,pt)
-      scales.InsertNextValue(sliderScale*(varianceMat[landmark,0]+varianceMat[landmark,1]+varianceMat[landmark,2])/3)
-      tensors.InsertTuple9(landmark,sliderScale*varianceMat[landmark,0],0,0,0,sliderScale*varianceMat[landmark,1],0,0,0,sliderScale*varianceMat[landmark,2])
-      index.InsertNextValue(landmark+1)
 
     polydata=vtk.vtkPolyData()
     polydata.SetPoints(points)
@@ -1928,7 +2114,30 @@ class GPAWidget(ScriptedLoadableModuleWidget):
 
   # Interactive Visualization callbacks and helpers
 
+  def addPCWarpRenderObservers(self):
+    # PC warp latencies are measured from the slider update to the end of the render that shows it
+    self.removePCWarpRenderObservers()
+    self.pcWarpUpdateTime = None
+    layoutManager = slicer.app.layoutManager()
+    for viewIndex in range(layoutManager.threeDViewCount):
+      renderWindow = layoutManager.threeDWidget(viewIndex).threeDView().renderWindow()
+      self.pcWarpRenderObservers.append((renderWindow, renderWindow.AddObserver(vtk.vtkCommand.EndEvent, self.onPCWarpRendered)))
+
+  def removePCWarpRenderObservers(self):
+    for renderWindow, observerTag in getattr(self, 'pcWarpRenderObservers', []):
+      renderWindow.RemoveObserver(observerTag)
+    self.pcWarpRenderObservers = []
+    self.pcWarpUpdateTime = None
+
+  def onPCWarpRendered(self, caller, event):
+    import time
+    if self.pcWarpUpdateTime is not None:
+      self.pcWarpLatencies[self.displayedPCWarpModel].append(time.perf_counter() - self.pcWarpUpdateTime)
+      self.pcWarpUpdateTime = None
+
   def onSelect(self):
+    self.removePCWarpRenderObservers()
+    self.proxyModelNode = None
     self.cloneLandmarkNode = self.copyLandmarkNode
     self.cloneLandmarkNode.CreateDefaultDisplayNodes()
     self.cloneLandmarkDisplayNode = self.cloneLandmarkNode.GetDisplayNode()
@@ -1955,25 +2164,11 @@ class GPAWidget(ScriptedLoadableModuleWidget):
           indexToRemove.append(self.LMExclusionList[i]-1)
         self.sourceLMnumpy=np.delete(self.sourceLMnumpy,indexToRemove,axis=0)
 
-      # set up transform
-      targetLMVTK=logic.convertNumpyToVTK(self.rawMeanLandmarks)
-      sourceLMVTK=logic.convertNumpyToVTK(self.sourceLMnumpy)
-      VTKTPSMean = vtk.vtkThinPlateSplineTransform()
-      VTKTPSMean.SetSourceLandmarks( sourceLMVTK )
-      VTKTPSMean.SetTargetLandmarks( targetLMVTK )
-      VTKTPSMean.SetBasisToR()  # for 3D transform
-
-      # transform from selected to mean
-      self.transformMeanNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTransformNode', 'Mean TPS Transform')
-      GPANodeCollection.AddItem(self.transformMeanNode)
-      self.transformMeanNode.SetAndObserveTransformToParent( VTKTPSMean )
-
-      # load model node
+      # load model node and warp it from the selected specimen to the mean shape
       self.modelNode=slicer.util.loadModel(self.grayscaleSelector.currentPath)
       GPANodeCollection.AddItem(self.modelNode)
       self.modelDisplayNode = self.modelNode.GetDisplayNode()
-      self.modelNode.SetAndObserveTransformNodeID(self.transformMeanNode.GetID())
-      slicer.vtkSlicerTransformLogic().hardenTransform(self.modelNode)
+      logic.warpModelThinPlateSpline(self.modelNode, self.sourceLMnumpy, self.rawMeanLandmarks)
 
       # create a PC warped model as clone of the selected model node
       shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
@@ -1984,6 +2179,20 @@ class GPAWidget(ScriptedLoadableModuleWidget):
       self.cloneModelDisplayNode =  self.cloneModelNode.GetDisplayNode()
       self.cloneModelDisplayNode.SetColor([0,0,1])
       GPANodeCollection.AddItem(self.cloneModelNode)
+
+      # decimated copy warped while the PC slider is dragged
+      if self.proxyModelCheckBox.checked:
+        self.proxyModelNode = logic.createProxyModel(self.cloneModelNode, self.proxyReductionSpinBox.value)
+        self.proxyModelNode.SetName('PC Warped Model Proxy')
+        self.proxyModelNode.GetDisplayNode().SetColor([0,0,1])
+        self.proxyModelNode.SetDisplayVisibility(False)
+        GPANodeCollection.AddItem(self.proxyModelNode)
+        self.displayedPCWarpModel = 'full'
+        self.pcWarpLatencies = {'proxy': [], 'full': []}
+        self.addPCWarpRenderObservers()
+        self.pcWarpPointNumbers = {'proxy': self.proxyModelNode.GetPolyData().GetNumberOfPoints(),
+          'full': self.cloneModelNode.GetPolyData().GetNumberOfPoints()}
+        self.GPALogTextbox.insertPlainText(f"PC warp proxy model: {self.pcWarpPointNumbers['proxy']} of {self.pcWarpPointNumbers['full']} points\n")
       visibility = self.meanLandmarkNode.GetDisplayVisibility()
       self.cloneLandmarkNode.SetDisplayVisibility(visibility)
       # clean up
@@ -2013,11 +2222,51 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     # Set up transform for PCA warping
     self.transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTransformNode', 'PC TPS Transform')
     GPANodeCollection.AddItem(self.transformNode)
+    self.setupPCDisplacementBasis()
 
     # Enable PCA warping and recording
     self.slider1.populateComboBox(self.PCList)
     self.applyEnabled = True
     self.startRecordButton.enabled = True
+    self.createSweepButton.enabled = True
+
+  def getExpandedBounds(self, node, paddingFactor=0.1):
+    bounds = [0] * 6
+    node.GetRASBounds(bounds)
+    # Expand bounds by paddingFactor
+    xRange = bounds[1] - bounds[0]
+    yRange = bounds[3] - bounds[2]
+    zRange = bounds[5] - bounds[4]
+    bounds[0] -= xRange * paddingFactor
+    bounds[1] += xRange * paddingFactor
+    bounds[2] -= yRange * paddingFactor
+    bounds[3] += yRange * paddingFactor
+    bounds[4] -= zRange * paddingFactor
+    bounds[5] += zRange * paddingFactor
+    return bounds
+
+  def setupPCDisplacementBasis(self):
+    # Sample the warp along every PC once, so PC and slider changes only need a weighted sum of grids
+    import time
+    startTime = time.time()
+    logic = GPALogic()
+    self.cloneLandmarkNode.SetAndObserveTransformNodeID(None)
+    if hasattr(self, 'cloneModelNode') and self.modelVisualizationType.checked:
+      bounds = self.getExpandedBounds(self.cloneModelNode)
+    else:
+      bounds = self.getExpandedBounds(self.cloneLandmarkNode)
+    pcScoreAbsMax = np.abs(self.scatterDataAll).max(axis=0)
+    self.pcDisplacementMagnification = self.spinMagnification.value
+    origin, spacing, extent, self.pcDisplacementBasis = logic.getPCDisplacementBasis(self.LM, self.rawMeanLandmarks,
+      pcScoreAbsMax, self.sampleSizeScaleFactor, bounds, self.pcDisplacementMagnification)
+    self.displacementGridData, self.displacementGridArray = vtk_lib.createDisplacementGrid(origin, spacing, extent)
+    self.pcDisplacementGeometry = (origin, spacing, extent)
+    self.GPALogTextbox.insertPlainText(f"PC displacement grids for {len(pcScoreAbsMax)} PCs computed in {time.time()-startTime:.2f} seconds\n")
+
+  def updatePCDisplacementMagnification(self):
+    # The warp is not linear in the PC score, so the grids are resampled for a new magnification
+    if self.spinMagnification.value != self.pcDisplacementMagnification:
+      self.setupPCDisplacementBasis()
 
   def onStartRecording(self):
     #set up sequences for template model and PC TPS transform
@@ -2051,6 +2300,28 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.stopRecordButton.enabled = True
     self.startRecordButton.enabled = False
 
+  def onCreatePCSweep(self):
+    import time
+    startTime = time.time()
+    logic = GPALogic()
+    pc = self.slider1.boxValue()
+    if pc < 1:
+      return
+    # the magnification applied to the displayed warp, which the basis was sampled for
+    magnification = self.pcDisplacementMagnification
+    pcScores = self.scatterDataAll[:, pc - 1]
+    sweeps = [(pc, magnification * pcScores.min(), magnification * pcScores.max(), self.sweepStepsSpinBox.value)]
+    modelNode = None
+    if hasattr(self, 'cloneModelNode') and self.modelVisualizationType.checked:
+      modelNode = self.cloneModelNode
+    origin, spacing, extent = self.pcDisplacementGeometry
+    browserNode, sequenceNodes = logic.writePCSweepSequences(self.pcDisplacementBasis, origin, spacing, extent, sweeps,
+      self.cloneLandmarkNode, modelNode, f"GPA PC {pc} Sweep")
+    GPANodeCollection.AddItem(browserNode)
+    for sequenceNode in sequenceNodes:
+      GPANodeCollection.AddItem(sequenceNode)
+    self.GPALogTextbox.insertPlainText(f"PC {pc} sweep of {self.sweepStepsSpinBox.value} steps written to sequences in {time.time()-startTime:.2f} seconds\n")
+
   def onStopRecording(self):
     browserWidget=slicer.modules.sequences.widgetRepresentation()
     recordWidget = browserWidget.findChild('qMRMLSequenceBrowserPlayWidget')
@@ -2125,70 +2396,47 @@ class GPALogic(ScriptedLoadableModuleLogic):
     annotationLogic = slicer.modules.annotations.logic()
     annotationLogic.CreateSnapShot(name, description, type, 1, imageData)
 
-  def loadLandmarks(self, filePathList, lmToRemove, extension):
-    # initial data array
+  def loadLandmarks(self, filePathList, lmToRemove, extension, progressCallback=None, cache=None):
+    """
+    Reads the landmark files into a (landmarks x 3 x subjects) array with io_lib.loadLandmarkArray.
+    Every file is read even if some fail; all problems are then reported in one message.
+    cache: optional io_lib.LandmarkCache, so only new or changed files are parsed.
+    """
     lmToRemove = [x - 1 for x in lmToRemove]
-    if 'json' in extension:
-      import pandas
-      tempTable = pandas.DataFrame.from_dict(pandas.read_json(filePathList[0])['markups'][0]['controlPoints'])
-      landmarkNumber = len(tempTable)
-      landmarkTypeArray=[]
+    readFunction = cache.read if cache is not None else None
+    try:
+      landmarks, landmarkTypeArray, errors, undefinedLandmarks = io_lib.loadLandmarkArray(filePathList, lmToRemove,
+        progressCallback=progressCallback, readFunction=readFunction)
+    except ValueError as e:
+      logging.debug(str(e))
+      slicer.util.messageBox(f"Error: {e}")
+      return
+    if cache is not None:
+      cache.save()
+    if errors:
+      errorString = "".join(f"{os.path.basename(filePath)}: {message} \n" for filePath, message in errors)
+      warning = f"Error: Loading {len(errors)} of {len(filePathList)} landmark files failed: \n" + errorString
+      logging.debug(warning)
+      slicer.util.messageBox(warning)
+      return
+    if undefinedLandmarks:
       errorString = ""
-      subjectErrorArray = []
       landmarkErrorArray = []
-      for i in range(landmarkNumber):
-        if tempTable['description'][i] =='Semi':
-          landmarkTypeArray.append(str(i+1))
-      landmarks=np.zeros(shape=(landmarkNumber-len(lmToRemove),3,len(filePathList)))
-      for i in range(len(filePathList)):
-        try:
-          tmp1=pandas.DataFrame.from_dict(pandas.read_json(filePathList[i])['markups'][0]['controlPoints'])
-        except:
-          slicer.util.messageBox(f"Error: Load file {filePathList[i]} failed:.")
-          logging.debug(f"Error: Load file {filePathList[i]} failed:.")
-          self.GPALogTextbox.insertPlainText(f"Error: Load file {filePathList[i]} failed:\n")
-        if len(tmp1) == landmarkNumber:
-          lmArray = tmp1['position'].to_numpy()
-          landmarkIndex = 0
-          for j in range(landmarkNumber):
-            if j not in lmToRemove:
-              if tmp1['positionStatus'][j] == 'defined':
-                landmarks[landmarkIndex,:,i]=lmArray[j]
-                landmarkIndex += 1
-              else:
-                subjectFileName = os.path.basename(filePathList[i])
-                message = f"{subjectFileName}: Landmark {str(j+1)} \n"
-                errorString += message
-                if subjectFileName not in subjectErrorArray:
-                  subjectErrorArray.append(subjectFileName)
-                if j not in landmarkErrorArray:
-                  landmarkErrorArray.append(j)
-        else:
-          warning = f"Error: Load file {filePathList[i]} failed. There are {len(tmp1)} landmarks instead of the expected {landmarkNumber}."
-          slicer.util.messageBox(warning)
-          return
-      if (errorString != "") and not all(x in lmToRemove for x in landmarkErrorArray):
-        landmarkErrorArrayString = ', '.join(map(str, [x+1 for x in landmarkErrorArray]))
-        subjectErrorArrayString = ', '.join(subjectErrorArray)
-        warning = "Error: The following undefined landmarks were found: \n" + errorString +\
-                  "To resolve,  exclude the affected landmarks from all subjects using the 'Exclude landmarks' field: " +\
-                  landmarkErrorArrayString +"\n" +\
-                  "Alternatively,  remove the affected subjects from the landmark file selector: " + \
-                  subjectErrorArrayString
-        slicer.util.messageBox(warning)
-        return
-    else:
-      landmarks, landmarkTypeArray = self.initDataArray(filePathList)
-      landmarkNumber = landmarks.shape[0]
-      for i in range(len(filePathList)):
-        tmp1=self.importLandMarks(filePathList[i])
-        if len(tmp1) == landmarkNumber:
-          landmarks[:,:,i] = tmp1
-        else:
-          warning = f"Error: Load file {filePathList[i]} failed. There are {len(tmp1)} landmarks instead of the expected {landmarkNumber}."
-          slicer.util.messageBox(warning)
-          return
-      landmarks = np.delete(landmarks, lmToRemove, axis=0)
+      for filePath, landmarkIndices in undefinedLandmarks.items():
+        subjectFileName = os.path.basename(filePath)
+        for j in landmarkIndices:
+          errorString += f"{subjectFileName}: Landmark {str(j+1)} \n"
+          if j not in landmarkErrorArray:
+            landmarkErrorArray.append(j)
+      landmarkErrorArrayString = ', '.join(map(str, [x+1 for x in sorted(landmarkErrorArray)]))
+      subjectErrorArrayString = ', '.join(os.path.basename(filePath) for filePath in filePathList if filePath in undefinedLandmarks)
+      warning = "Error: The following undefined landmarks were found: \n" + errorString +\
+                "To resolve,  exclude the affected landmarks from all subjects using the 'Exclude landmarks' field: " +\
+                landmarkErrorArrayString +"\n" +\
+                "Alternatively,  remove the affected subjects from the landmark file selector: " + \
+                subjectErrorArrayString
+      slicer.util.messageBox(warning)
+      return
     return landmarks, landmarkTypeArray
 
   def importLandMarks(self, filePath):
@@ -2234,38 +2482,35 @@ class GPALogic(ScriptedLoadableModuleLogic):
     landmarks=np.zeros(shape=(rowNumber,dim,subjectNumber))
     return landmarks, landmarkType
 
-  def dist(self, a):
+  def dist(self, a, condensed=False, dtype=np.float64, memoryBudget=distance_lib.DEFAULT_MEMORY_BUDGET):
     """
     Computes the euclidean distance matrix for nXK points in a 3D space. So the input matrix is nX3xk
-    Returns a nXnXk matrix
+    Returns a nXnXk matrix, or a (n*(n-1)/2)Xk array of condensed distances if condensed is set
     """
     id,jd,kd=a.shape
-    fnx = lambda q : q - np.reshape(q, (id, 1,kd))
-    dx=fnx(a[:,0,:])
-    dy=fnx(a[:,1,:])
-    dz=fnx(a[:,2,:])
-    return (dx**2.0+dy**2.0+dz**2.0)**0.5
-
-  def dist2(self, a):
+    distances=np.empty((distance_lib.condensedSize(id),kd), dtype=dtype)
+    for subject in range(kd):
+      distances[:,subject]=distance_lib.pairwiseDistances(a[:,:,subject], dtype, memoryBudget)
+    if condensed:
+      return distances
+    return np.stack([distance_lib.squareDistanceMatrix(distances[:,subject]) for subject in range(kd)], axis=2)
+
+  def dist2(self, a, condensed=False, dtype=np.float64, memoryBudget=distance_lib.DEFAULT_MEMORY_BUDGET):
     """
     Computes the euclidean distance matrix for n points in a 3D space
-    Returns a nXn matrix
-     """
-    id,jd=a.shape
-    fnx = lambda q : q - np.reshape(q, (id, 1))
-    dx=fnx(a[:,0])
-    dy=fnx(a[:,1])
-    dz=fnx(a[:,2])
-    return (dx**2.0+dy**2.0+dz**2.0)**0.5
+    Returns a nXn matrix, or the n*(n-1)/2 condensed distances if condensed is set
+    """
+    distances=distance_lib.pairwiseDistances(a, dtype, memoryBudget)
+    if condensed:
+      return distances
+    return distance_lib.squareDistanceMatrix(distances)
 
   #plotting functions
 
   def makeScatterPlotWithFactors(self, data, files, factors,title,xAxis,yAxis,pcNumber):
     #create two tables for the first two factors and then check for a third
     #check if there is a table node has been created
-    numPoints = len(data)
-    uniqueFactors, factorCounts = np.unique(factors, return_counts=True)
-    factorNumber = len(uniqueFactors)
+    uniqueFactors = np.unique(factors)
 
     #Set up chart
     plotChartNode=slicer.mrmlScene.GetFirstNodeByName("Chart_PCA_cov" + xAxis + "v" +yAxis)
@@ -2282,29 +2527,12 @@ class GPALogic(ScriptedLoadableModuleLogic):
       if tableNode is None:
         tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", 'PCA Scatter Plot Table Factor ' + factor)
         GPANodeCollection.AddItem(tableNode)
-      else:
-        tableNode.RemoveAllColumns()    #clear previous data from columns
-
-      # Set up columns for X,Y, and labels
-      labels=tableNode.AddColumn()
-      labels.SetName('Subject ID')
-      tableNode.SetColumnType('Subject ID',vtk.VTK_STRING)
-
-      for i in range(pcNumber):
-        pc=tableNode.AddColumn()
-        colName="PC" + str(i+1)
-        pc.SetName(colName)
-        tableNode.SetColumnType(colName, vtk.VTK_FLOAT)
-
-      factorCounter=0
-      table = tableNode.GetTable()
-      table.SetNumberOfRows(factorCounts[factorIndex])
-      for i in range(numPoints):
-        if (factors[i] == factor):
-          table.SetValue(factorCounter, 0,files[i])
-          for j in range(pcNumber):
-            table.SetValue(factorCounter, j+1, data[i,j])
-          factorCounter+=1
+
+      # Set up columns for X,Y, and labels, replacing previous data
+      factorRows = np.flatnonzero(np.asarray(factors) == factor)
+      columns = [('Subject ID', [files[i] for i in factorRows])]
+      columns += [("PC" + str(j+1), data[factorRows,j]) for j in range(pcNumber)]
+      vtk_lib.setTableColumns(tableNode, columns)
 
       plotSeriesNode=slicer.mrmlScene.GetFirstNodeByName("Series_PCA_" + factor + "_" + xAxis + "v" +yAxis)
       if plotSeriesNode is None:
@@ -2342,7 +2570,6 @@ class GPALogic(ScriptedLoadableModuleLogic):
     plotViewNode.SetPlotChartNodeID(plotChartNode.GetID())
 
   def makeScatterPlot(self, data, files, title,xAxis,yAxis,pcNumber):
-    numPoints = len(data)
     #check if there is a table node has been created
     tableNode=slicer.mrmlScene.GetFirstNodeByName('PCA Scatter Plot Table')
     if tableNode is None:
@@ -2350,22 +2577,9 @@ class GPALogic(ScriptedLoadableModuleLogic):
       GPANodeCollection.AddItem(tableNode)
 
       #set up columns for X,Y, and labels
-      labels=tableNode.AddColumn()
-      labels.SetName('Subject ID')
-      tableNode.SetColumnType('Subject ID',vtk.VTK_STRING)
-
-      for i in range(pcNumber):
-        pc=tableNode.AddColumn()
-        colName="PC" + str(i+1)
-        pc.SetName(colName)
-        tableNode.SetColumnType(colName, vtk.VTK_FLOAT)
-
-      table = tableNode.GetTable()
-      table.SetNumberOfRows(numPoints)
-      for i in range(numPoints):
-        table.SetValue(i, 0,files[i])
-        for j in range(pcNumber):
-            table.SetValue(i, j+1, data[i,j])
+      columns = [('Subject ID', list(files))]
+      columns += [("PC" + str(j+1), data[:,j]) for j in range(pcNumber)]
+      vtk_lib.setTableColumns(tableNode, columns)
 
     plotSeriesNode1=slicer.mrmlScene.GetFirstNodeByName("Series_PCA" + xAxis + "v" +yAxis)
     if plotSeriesNode1 is None:
@@ -2479,6 +2693,226 @@ class GPALogic(ScriptedLoadableModuleLogic):
       if modelNode is not None:
         modelNode.SetDisplayVisibility(0)
 
+  def getPCDisplacementBasis(self, LMObj, meanLandmarks, pcScoreAbsMax, sampleScaleFactor, bounds, magnification=1.0, dimension=50):
+    """
+    Samples the TPS warp of the mean landmarks along each PC onto a regular grid covering bounds.
+    The warp for PC n is evaluated at the magnified largest absolute score magnification*pcScoreAbsMax[n-1]
+    and stored per unit magnified score, i.e. linearized the same way as scaling a single displacement grid.
+    The TPS is not linear in the score, so a basis only reproduces the warp at the magnification it was built for.
+    Returns grid origin, spacing, extent and a (PCs x grid points x 3) displacement array.
+    """
+    origin = (bounds[0], bounds[2], bounds[4])
+    size = (bounds[1] - bounds[0], bounds[3] - bounds[2], bounds[5] - bounds[4])
+    extent = [0] * 6
+    extent[1::2] = [dimension - 1] * 3
+    spacing = (size[0]/dimension, size[1]/dimension, size[2]/dimension)
+    gridPoints = tps_lib.gridPoints(origin, spacing, extent)
+    basis = np.zeros((len(pcScoreAbsMax), dimension**3, 3))
+    for pcIndex, scoreMax in enumerate(pcScoreAbsMax):
+      if scoreMax <= 1e-6:  # Avoid division by zero
+        continue
+      scoreMax = scoreMax * magnification
+      shiftMax = LMObj.ExpandAlongSinglePC(pcIndex + 1, scoreMax, sampleScaleFactor)
+      # same R basis TPS as vtkThinPlateSplineTransform, from the shifted landmarks back to the mean
+      spline = tps_lib.fitThinPlateSpline(meanLandmarks + shiftMax, meanLandmarks)
+      tps_lib.evaluateThinPlateSpline(spline, gridPoints, out=basis[pcIndex])
+      basis[pcIndex] -= gridPoints
+      basis[pcIndex] /= scoreMax
+    return origin, spacing, extent, basis
+
+  def warpModelThinPlateSpline(self, modelNode, sourceLandmarks, targetLandmarks, workers=None):
+    """
+    Warps the points of modelNode in place with the R basis thin plate spline mapping sourceLandmarks
+    onto targetLandmarks, the result of hardening a vtkThinPlateSplineTransform on the model.
+    Point normals, if the model has them, are recomputed for the warped surface.
+    """
+    points = slicer.util.arrayFromModelPoints(modelNode)
+    spline = tps_lib.fitThinPlateSpline(sourceLandmarks, targetLandmarks)
+    tps_lib.evaluateThinPlateSpline(spline, points, out=points, workers=workers)
+    slicer.util.arrayFromModelPointsModified(modelNode)
+    polyData = modelNode.GetPolyData()
+    if polyData.GetPointData().GetNormals() is not None:
+      normals = vtk.vtkPolyDataNormals()
+      normals.SetInputData(polyData)
+      normals.SplittingOff()
+      normals.ConsistencyOff()
+      normals.Update()
+      polyData.GetPointData().SetNormals(normals.GetOutput().GetPointData().GetNormals())
+      modelNode.Modified()
+
+  def createProxyModel(self, modelNode, targetReduction=0.9):
+    """
+    Creates a model node holding a decimated copy of modelNode, with targetReduction the fraction of
+    triangles to remove, as a cheap stand in for the full model during interaction.
+    """
+    proxyModelNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLModelNode', modelNode.GetName() + ' Proxy')
+    proxyModelNode.SetAndObservePolyData(vtk_lib.decimatePolyData(modelNode.GetPolyData(), targetReduction))
+    proxyModelNode.CreateDefaultDisplayNodes()
+    return proxyModelNode
+
+  def formatPCWarpLatencies(self, latencies, pointNumbers):
+    """
+    Summarizes the PC slider latencies (in seconds, from the update to the end of the render showing it)
+    collected for the proxy and the full model.
+    """
+    text = ""
+    for modelType in ['proxy', 'full']:
+      if len(latencies[modelType]) > 0:
+        times = 1000*np.array(latencies[modelType])
+        text += f"PC warp latency, {modelType} model ({pointNumbers[modelType]} points): mean {times.mean():.1f} ms, max {times.max():.1f} ms over {len(times)} updates\n"
+    return text
+
+  def getVolumeDisplacementGrid(self, sourceLandmarks, targetLandmarks, bounds, resolution):
+    """
+    Samples the R basis TPS from targetLandmarks to sourceLandmarks once on a resolution^3 grid covering
+    bounds. As a vtkGridTransform this maps positions of the warped volume back into the source volume.
+    Returns the displacement grid vtkImageData.
+    """
+    origin = (bounds[0], bounds[2], bounds[4])
+    spacing = tuple(max(bounds[2*axis+1] - bounds[2*axis], 1e-6) / (resolution - 1) for axis in range(3))
+    extent = [0, resolution - 1] * 3
+    gridData, gridArray = vtk_lib.createDisplacementGrid(origin, spacing, extent)
+    gridPoints = tps_lib.gridPoints(origin, spacing, extent)
+    spline = tps_lib.fitThinPlateSpline(targetLandmarks, sourceLandmarks)
+    tps_lib.evaluateThinPlateSpline(spline, gridPoints, out=gridArray)
+    gridArray -= gridPoints
+    return gridData
+
+  def warpVolume(self, volumeNode, sourceLandmarks, targetLandmarks, outputVolumeNode, gridResolution=32, cache=None,
+    preview=False, previewFactor=4, numberOfThreads=None):
+    """
+    Warps volumeNode from sourceLandmarks to targetLandmarks into outputVolumeNode. Instead of evaluating the
+    TPS at every voxel, it is sampled on a coarse gridResolution^3 displacement grid and the volume is
+    resliced through the interpolated grid with a multithreaded vtkImageReslice.
+    cache: a vtk_lib.WarpCache kept by the caller; grids are cached per landmark configuration (i.e. per
+    PC state) and resolution, preview images per volume.
+    preview: warps a copy of the volume downsampled by previewFactor along each axis, for interactive use
+    before the full resolution warp.
+    """
+    import hashlib
+    if cache is None:
+      cache = vtk_lib.WarpCache()
+    imageData = volumeNode.GetImageData()
+    ijkToRAS = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRAS)
+    if preview:
+      previewKey = ('preview', volumeNode.GetID(), previewFactor, imageData.GetMTime())
+      downsampled = cache.get(previewKey)
+      if downsampled is None:
+        downsampled = vtk_lib.downsampleImage(imageData, ijkToRAS, previewFactor)
+        cache.put(previewKey, downsampled)
+      imageData, ijkToRAS = downsampled
+    bounds = [0]*6
+    volumeNode.GetRASBounds(bounds)
+    landmarkHash = hashlib.blake2b(np.ascontiguousarray(np.round(np.hstack((sourceLandmarks, targetLandmarks)), 6)).tobytes(),
+      digest_size=16).hexdigest()
+    gridKey = ('grid', landmarkHash, gridResolution, tuple(np.round(bounds, 6)))
+    gridData = cache.get(gridKey)
+    if gridData is None:
+      gridData = self.getVolumeDisplacementGrid(sourceLandmarks, targetLandmarks, bounds, gridResolution)
+      cache.put(gridKey, gridData)
+    rasToIJK = vtk.vtkMatrix4x4()
+    vtk.vtkMatrix4x4.Invert(ijkToRAS, rasToIJK)
+    warpedImage = vtk_lib.resliceImageThroughTransform(imageData, rasToIJK, vtk_lib.createGridTransform(gridData), ijkToRAS,
+      imageData.GetDimensions(), numberOfThreads)
+    outputVolumeNode.SetIJKToRASMatrix(ijkToRAS)
+    outputVolumeNode.SetAndObserveImageData(warpedImage)
+    return outputVolumeNode
+
+  def combineDisplacementBasis(self, basis, pcScores, out):
+    """
+    Writes the displacement field for the given PC scores, sum(pcScores[n] * basis[n]), into out.
+    """
+    out[:] = 0
+    for pcIndex in np.flatnonzero(pcScores):
+      out += pcScores[pcIndex] * basis[pcIndex]
+    return out
+
+  def iteratePCSweep(self, basis, origin, spacing, extent, sweeps, pointSets):
+    """
+    Computes the warped states of a PC sweep from the displacement basis of getPCDisplacementBasis, without rendering.
+    sweeps: list of (PC number, minimum score, maximum score, number of steps), scores including any magnification.
+    pointSets: list of (points x 3) arrays in mean shape space, e.g. the mean landmarks and the model points.
+    Yields (PC number, score, list of warped point arrays) per step. The points are moved by the inverse of the
+    grid transform, as the PC grid transform node displays them.
+    """
+    gridData, gridArray = vtk_lib.createDisplacementGrid(origin, spacing, extent)
+    gridTransform = vtk_lib.createGridTransform(gridData, 'linear')
+    inverseTransform = gridTransform.GetInverse()
+    pcScores = np.zeros(len(basis))
+    for pc, minimumScore, maximumScore, stepNumber in sweeps:
+      for score in np.linspace(minimumScore, maximumScore, stepNumber):
+        pcScores[:] = 0
+        pcScores[pc - 1] = score
+        self.combineDisplacementBasis(basis, pcScores, gridArray)
+        gridData.Modified()
+        gridTransform.Modified()
+        yield pc, score, [vtk_lib.transformPointArray(inverseTransform, points) for points in pointSets]
+
+  def writePCSweepSequences(self, basis, origin, spacing, extent, sweeps, landmarkNode, modelNode=None, name='GPA PC Sweep'):
+    """
+    Stores every state of the PC sweep (see iteratePCSweep) of landmarkNode and, if given, modelNode directly in
+    sequence nodes, one item per step. Returns the sequence browser node synchronizing them.
+    """
+    import json
+    frameLandmarkNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode', name + ' Landmarks')
+    frameLandmarkNode.CopyContent(landmarkNode)
+    pointSets = [slicer.util.arrayFromMarkupsControlPoints(landmarkNode)]
+    sequenceNodes = [slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSequenceNode', name + ' Landmark Sequence')]
+    if modelNode is not None:
+      framePolyData = vtk.vtkPolyData()
+      framePolyData.DeepCopy(modelNode.GetPolyData())
+      frameModelNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLModelNode', name + ' Model')
+      frameModelNode.SetAndObservePolyData(framePolyData)
+      frameModelPoints = slicer.util.arrayFromModelPoints(frameModelNode)
+      pointSets.append(slicer.util.arrayFromModelPoints(modelNode).copy())
+      sequenceNodes.append(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSequenceNode', name + ' Model Sequence'))
+    for sequenceNode in sequenceNodes:
+      sequenceNode.SetIndexName('frame')
+      sequenceNode.SetIndexUnit('')
+    pcs, scores = [], []
+    for frameIndex, (pc, score, warpedPointSets) in enumerate(self.iteratePCSweep(basis, origin, spacing, extent, sweeps, pointSets)):
+      slicer.util.updateMarkupsControlPointsFromArray(frameLandmarkNode, warpedPointSets[0])
+      sequenceNodes[0].SetDataNodeAtValue(frameLandmarkNode, str(frameIndex))
+      if modelNode is not None:
+        frameModelPoints[:] = warpedPointSets[1]
+        slicer.util.arrayFromModelPointsModified(frameModelNode)
+        sequenceNodes[1].SetDataNodeAtValue(frameModelNode, str(frameIndex))
+      pcs.append(int(pc))
+      scores.append(float(score))
+    slicer.mrmlScene.RemoveNode(frameLandmarkNode)
+    if modelNode is not None:
+      slicer.mrmlScene.RemoveNode(frameModelNode)
+    browserNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSequenceBrowserNode', name)
+    for sequenceNode in sequenceNodes:
+      sequenceNode.SetAttribute('GPA.PCSweep', json.dumps({'pcs': pcs, 'scores': scores}))
+      browserNode.AddSynchronizedSequenceNode(sequenceNode)
+    browserNode.SetSelectedItemNumber(0)
+    return browserNode, sequenceNodes
+
+  def writePCSweepFrameStack(self, basis, origin, spacing, extent, sweeps, pointSets, pointSetNames, folder, dtype=np.float32):
+    """
+    Writes every state of the PC sweep (see iteratePCSweep) to folder as a compact binary frame stack, readable
+    with io_lib.readFrameStack. Each frame holds the warped pointSets one after the other; the manifest records
+    their names and sizes and the PC and score of each frame. Returns the frame stack folder.
+    """
+    frameNumber = sum(sweep[3] for sweep in sweeps)
+    pointNumbers = [len(points) for points in pointSets]
+    frames = io_lib.createFrameStack(folder, frameNumber, sum(pointNumbers), dtype)
+    pcs, scores = [], []
+    for frameIndex, (pc, score, warpedPointSets) in enumerate(self.iteratePCSweep(basis, origin, spacing, extent, sweeps, pointSets)):
+      frames[frameIndex] = np.vstack(warpedPointSets)
+      pcs.append(int(pc))
+      scores.append(float(score))
+    frames.flush()
+    metadata = {
+      "pointSets": [{"name": setName, "pointNumber": pointNumber} for setName, pointNumber in zip(pointSetNames, pointNumbers)],
+      "pcs": pcs,
+      "scores": scores,
+    }
+    io_lib.writeFrameStackManifest(folder, metadata)
+    return folder
+
   def calcEndpoints(self,LMObj,LM,pc, scaleFactor):
     i,j=LM.shape
     tmp=np.zeros((i,j))
@@ -2510,11 +2944,7 @@ class GPALogic(ScriptedLoadableModuleLogic):
     return lmData
 
   def convertNumpyToVTK(self, A):
-    x,y=A.shape
-    points=vtk.vtkPoints()
-    for i in range(x):
-      points.InsertNextPoint(A[i,0], A[i,1], A[i,2])
-    return points
+    return vtk_lib.convertNumpyToVTK(A)
 
   def convertNumpyToVTKmatrix44(self, A):
     x,y=A.shape
@@ -2581,6 +3011,10 @@ class GPATest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_GPA1()
+    self.setUp()
+    self.test_BulkConversion()
+    self.setUp()
+    self.test_HeadlessAnalysisBundle()
 
   def test_GPA1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -2627,3 +3061,85 @@ class GPATest(ScriptedLoadableModuleTest):
     self.assertEqual(outputScalarRange[1], inputScalarRange[1])
 
     self.delayDisplay('Test passed')
+
+  def test_BulkConversion(self):
+    """ The bulk numpy to VTK point and table conversions should keep every value.
+    Their timing is measured by benchmark_lib.benchmarkBulkConversion.
+    """
+    from vtk.util import numpy_support
+    self.delayDisplay("Starting the bulk conversion test")
+    rng = np.random.default_rng(0)
+
+    points = rng.normal(size=(1000, 3))
+    converted = numpy_support.vtk_to_numpy(vtk_lib.convertNumpyToVTK(points).GetData())
+    np.testing.assert_array_equal(converted, points)
+    # extra columns are dropped and single precision input is widened
+    converted = numpy_support.vtk_to_numpy(GPALogic().convertNumpyToVTK(rng.normal(size=(10, 4)).astype(np.float32)).GetData())
+    self.assertEqual(converted.shape, (10, 3))
+    self.assertEqual(converted.dtype, np.float64)
+
+    tableNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTableNode')
+    names = ["specimen_" + str(index) for index in range(100)]
+    values = rng.normal(size=(100, 3))
+    vtk_lib.setTableColumns(tableNode, [('Subject ID', names)] + [("PC" + str(j+1), values[:,j]) for j in range(3)])
+    table = tableNode.GetTable()
+    self.assertEqual(tableNode.GetNumberOfRows(), 100)
+    self.assertEqual(tableNode.GetNumberOfColumns(), 4)
+    self.assertEqual([table.GetColumnByName('Subject ID').GetValue(index) for index in range(100)], names)
+    for j in range(3):
+      column = numpy_support.vtk_to_numpy(table.GetColumnByName("PC" + str(j+1)))
+      np.testing.assert_array_equal(column, values[:,j].astype(np.float32))
+    # the columns are replaced, not appended
+    vtk_lib.setTableColumns(tableNode, [('Subject ID', names[:5]), ('Size', np.arange(5))])
+    self.assertEqual(tableNode.GetNumberOfColumns(), 2)
+    self.assertEqual(tableNode.GetNumberOfRows(), 5)
+    np.testing.assert_array_equal(numpy_support.vtk_to_numpy(table.GetColumnByName('Size')), np.arange(5))
+    self.delayDisplay('Bulk conversion test passed')
+
+  def test_HeadlessAnalysisBundle(self):
+    """ The headless analysis (Support/analysis_lib.py) should write the same results bundle as the
+    analysis steps of GPAWidget.onLoad.
+    """
+    import tempfile
+    import Support.analysis_lib as analysis_lib
+    import Support.benchmark_lib as benchmark_lib
+    self.delayDisplay("Starting the headless analysis bundle test")
+    tempFolder = tempfile.mkdtemp()
+    landmarkFolder = os.path.join(tempFolder, 'landmarks')
+    benchmark_lib.writeSyntheticLandmarkFiles(landmarkFolder, 20, 30)
+    summary = analysis_lib.runAnalysis(landmarkFolder, os.path.join(tempFolder, 'headless'), timestampFolder=False)
+    headlessArrays, headlessMetadata = io_lib.readResultsBundle(summary['outputFolder'])
+
+    # the analysis steps of GPAWidget.onLoad
+    logic = GPALogic()
+    filePaths, files, extension = analysis_lib.findLandmarkFiles(landmarkFolder)
+    LM = LMData()
+    LM.lmOrig, landmarkTypeArray = logic.loadLandmarks(filePaths, [], extension)
+    LM.doGpa(False)
+    LM.calcEigen(pcNumber=50)
+    sampleSizeScaleFactor = logic.dist2(LM.lmOrig.mean(2), condensed=True).max()
+    guiFolder = os.path.join(tempFolder, 'gui')
+    os.makedirs(guiFolder)
+    LM.writeOutData(guiFolder, files)
+    LM.writeResultsBundle(guiFolder, files, {
+      "ExcludedLM": [],
+      "Boas": False,
+      "SampleSizeScaleFactor": float(sampleSizeScaleFactor),
+      "SemiLandmarks": landmarkTypeArray,
+      })
+    guiArrays, guiMetadata = io_lib.readResultsBundle(guiFolder)
+
+    self.assertEqual(sorted(headlessMetadata), sorted(guiMetadata))
+    for key, value in guiMetadata.items():
+      if isinstance(value, float):
+        self.assertAlmostEqual(headlessMetadata[key], value, delta=1e-9*abs(value), msg=key)
+      else:
+        self.assertEqual(headlessMetadata[key], value, msg=key)
+    self.assertEqual(sorted(headlessArrays), sorted(guiArrays))
+    for name, array in guiArrays.items():
+      # eigenvectors and PC scores are defined up to their sign
+      if name in ('vec', 'pcScores'):
+        np.testing.assert_allclose(np.abs(headlessArrays[name]), np.abs(array), rtol=1e-6, atol=1e-9, err_msg=name)
+      else:
+        np.testing.assert_allclose(headlessArrays[name], array, rtol=1e-6, atol=1e-9, err_msg=name)
+    self.delayDisplay('Headless analysis bundle test passed')
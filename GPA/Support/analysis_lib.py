@@ -0,0 +1,184 @@
+"""
+Headless GPA analysis: a folder of landmark files in, a results bundle out.
+
+runAnalysis follows the analysis steps of GPAWidget.onLoad (landmark loading, GPA, PCA, PC scores,
+Procrustes distances and the visualization scale factor) without scene nodes or the GUI, and writes
+the results bundle that the module's "Load previous analysis" step reads like one written by the
+GUI. Only numpy and scipy are needed, so it runs in plain python as well as in Slicer:
+
+    python -m Support.analysis_lib landmarkFolder outputFolder --exclude 3,7
+    Slicer --no-main-window --python-script GPA/Support/analysis_lib.py landmarkFolder outputFolder
+"""
+import os
+import sys
+import time
+import json
+from datetime import datetime
+
+import numpy as np
+
+if __name__ == '__main__' and __package__ in (None, ''):
+    # run as a script, e.g. with Slicer --python-script: make the Support package importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Support.gpa_lib as gpa_lib
+import Support.io_lib as io_lib
+import Support.distance_lib as distance_lib
+
+LANDMARK_EXTENSIONS = ('.mrk.json', '.json', '.fcsv')
+
+# Leading PCs of the truncated PCA for large datasets, as GPAWidget.onLoad calls LMData.calcEigen
+DEFAULT_PC_NUMBER = 50
+
+
+def landmarkExtension(filePath):
+    for extension in LANDMARK_EXTENSIONS:
+        if filePath.lower().endswith(extension):
+            return extension
+    return None
+
+
+def findLandmarkFiles(landmarkFolder):
+    """
+    Sorted landmark file paths in landmarkFolder with the extension of the first one, as selected in the
+    GUI. Returns the paths, the sample names (file names without extension) and the extension.
+    """
+    fileNames = sorted(name for name in os.listdir(landmarkFolder) if landmarkExtension(name) is not None)
+    if not fileNames:
+        raise ValueError(f"No .fcsv, .mrk.json or .json landmark files found in {landmarkFolder}")
+    extension = landmarkExtension(fileNames[0])
+    fileNames = [name for name in fileNames if landmarkExtension(name) == extension]
+    filePaths = [os.path.join(landmarkFolder, name) for name in fileNames]
+    sampleNames = [name[:-len(extension)] for name in fileNames]
+    return filePaths, sampleNames, extension
+
+
+def runAnalysis(landmarkFolder, outputFolder, excludedLandmarks=(), boas=False, pcNumber=DEFAULT_PC_NUMBER, tolerance=0.0001,
+                maxIterations=5, acceleration=None, workers=None, timestampFolder=True):
+    """
+    Runs the GPA and PCA of the landmark files in landmarkFolder and writes the results bundle.
+    excludedLandmarks: one-based landmark numbers left out of the analysis.
+    boas: skip scaling (Boas coordinates).
+    pcNumber: large datasets use the truncated PCA of this many PCs, as in the GUI (see
+    gpa_lib.calcEigenByMethod); None always computes the full decomposition.
+    tolerance, maxIterations, acceleration: stopping rule and mean update of gpa_lib.runGPASolver.
+    timestampFolder: write into a date and time stamped subfolder of outputFolder, as the GUI does.
+    Returns a summary dictionary with the output folder, the dataset size, the GPA trace and the
+    seconds spent in each stage.
+    """
+    stageSeconds = {}
+    startTime = time.perf_counter()
+    filePaths, sampleNames, extension = findLandmarkFiles(landmarkFolder)
+    excludedLandmarks = [int(number) for number in excludedLandmarks]
+    landmarks, landmarkTypeArray, errors, undefinedLandmarks = io_lib.loadLandmarkArray(filePaths,
+        [number - 1 for number in excludedLandmarks], workers=workers)
+    if errors:
+        raise ValueError(f"Loading {len(errors)} of {len(filePaths)} landmark files failed: " +
+                         "; ".join(f"{os.path.basename(filePath)}: {message}" for filePath, message in errors))
+    if undefinedLandmarks:
+        raise ValueError("Undefined landmarks found, exclude them from all subjects: " +
+                         "; ".join(f"{os.path.basename(filePath)}: {[index + 1 for index in indices]}" for filePath, indices in undefinedLandmarks.items()))
+    stageSeconds['load'] = time.perf_counter() - startTime
+
+    stageStart = time.perf_counter()
+    centered = landmarks - landmarks.mean(axis=0, keepdims=True)
+    centroidSize = np.sqrt(np.einsum('ijk,ijk->k', centered, centered))
+    del centered
+    aligned, meanShape, trace = gpa_lib.runGPASolver(landmarks, scale=not boas, tolerance=tolerance,
+        maxIterations=maxIterations, acceleration=acceleration)
+    procdist = gpa_lib.procDist(aligned, meanShape)
+    stageSeconds['gpa'] = time.perf_counter() - stageStart
+
+    stageStart = time.perf_counter()
+    twoDim = gpa_lib.makeTwoDim(aligned)
+    totalVariance = np.einsum('ij,ij->', twoDim, twoDim) / float(twoDim.shape[1])
+    eigVal, eigVec, eigenMethod, eigenInfo = gpa_lib.calcEigenByMethod(twoDim, pcNumber=pcNumber)
+    pcScores = np.real(np.dot(np.transpose(twoDim), eigVec))
+    del twoDim
+    stageSeconds['pca'] = time.perf_counter() - stageStart
+
+    stageStart = time.perf_counter()
+    # the GUI takes the scale factor from the mean of LMData.lmOrig after doGpa, which runGPASolver has
+    # aligned in place, so it is the largest landmark distance in the mean aligned shape
+    if boas:
+        sampleSizeScaleFactor = 1.0
+    else:
+        sampleSizeScaleFactor = float(distance_lib.pairwiseDistances(aligned.mean(axis=2)).max())
+    if timestampFolder:
+        outputFolder = os.path.join(outputFolder, datetime.now().strftime('%Y-%m-%d_%H_%M_%S'))
+    os.makedirs(outputFolder, exist_ok=True)
+    arrays = {
+        'lm': aligned,
+        'mShape': meanShape,
+        'val': np.real(eigVal),
+        'vec': np.real(eigVec),
+        'pcScores': pcScores,
+        'procdist': np.ravel(procdist),
+        'centroidSize': centroidSize,
+    }
+    metadata = {
+        "ExcludedLM": excludedLandmarks,
+        "Boas": bool(boas),
+        "SampleSizeScaleFactor": sampleSizeScaleFactor,
+        "SemiLandmarks": landmarkTypeArray,
+        "SampleNames": sampleNames,
+        "TotalVariance": float(totalVariance),
+    }
+    io_lib.writeResultsBundle(outputFolder, arrays, metadata)
+    stageSeconds['write'] = time.perf_counter() - stageStart
+    stageSeconds['total'] = time.perf_counter() - startTime
+    return {
+        'outputFolder': outputFolder,
+        'inputPath': landmarkFolder,
+        'extension': extension,
+        'landmarks': int(aligned.shape[0]),
+        'specimens': int(aligned.shape[2]),
+        'eigenMethod': eigenMethod,
+        'gpaTrace': trace,
+        'seconds': stageSeconds,
+    }
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a GPA and PCA on a folder of landmark files and write a results bundle.")
+    parser.add_argument('landmarkFolder', help="folder with .fcsv or .mrk.json landmark files")
+    parser.add_argument('outputFolder', help="folder the results are written to, in a time stamped subfolder")
+    parser.add_argument('--exclude', default="", help="comma separated one-based landmark numbers to exclude")
+    parser.add_argument('--boas', action='store_true', help="skip scaling (Boas coordinates)")
+    parser.add_argument('--pc-number', type=int, default=DEFAULT_PC_NUMBER,
+                        help=f"leading PCs to compute for large datasets, as the GUI does (default {DEFAULT_PC_NUMBER}, 0 for all PCs)")
+    parser.add_argument('--tolerance', type=float, default=0.0001, help="GPA mean shape change tolerance")
+    parser.add_argument('--max-iterations', type=int, default=5, help="GPA iteration limit")
+    parser.add_argument('--anderson', action='store_true', help="use Anderson acceleration for the GPA")
+    parser.add_argument('--workers', type=int, default=None, help="threads for reading landmark files")
+    args = parser.parse_args(argv)
+    excludedLandmarks = [int(number) for number in args.exclude.split(',') if number.strip()]
+    summary = runAnalysis(args.landmarkFolder, args.outputFolder, excludedLandmarks, boas=args.boas, pcNumber=args.pc_number or None,
+        tolerance=args.tolerance, maxIterations=args.max_iterations, acceleration='anderson' if args.anderson else None,
+        workers=args.workers)
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+def exitApplication(exitCode):
+    # Slicer --python-script keeps the application running after the script, so quit it explicitly
+    if 'slicer' in sys.modules:
+        import slicer
+        slicer.app.exit(exitCode)
+    else:
+        sys.exit(exitCode)
+
+
+if __name__ == '__main__':
+    exitCode = 0
+    try:
+        main()
+    except SystemExit as error:
+        # argparse usage errors and --help
+        exitCode = error.code if isinstance(error.code, int) else int(error.code is not None)
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        exitCode = 1
+    exitApplication(exitCode)
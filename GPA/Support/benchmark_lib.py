@@ -0,0 +1,691 @@
+"""
+Timing and memory benchmarks for the GPA support libraries.
+
+These only need numpy/scipy, so they can be run from the Slicer python console
+  import Support.benchmark_lib as benchmark_lib
+  benchmark_lib.benchmarkBatchedGPA()
+or from a plain python interpreter started in the GPA module folder.
+benchmarkSuite times every stage of the workflow and writes a JSON report; compare the reports of
+two commits with compareBenchmarkReports to catch regressions.
+"""
+import time
+import tracemalloc
+import numpy as np
+
+import Support.gpa_lib as gpa_lib
+import Support.kernel_lib as kernel_lib
+
+
+def makeSyntheticLandmarks(landmarkNumber, specimenNumber, noise=0.01, seed=0, noiseModel='isotropic', modeNumber=3):
+    """
+    Returns a (landmarkNumber x 3 x specimenNumber) array of noisy copies of one random
+    shape, each with a random rotation, scale and translation applied.
+    noiseModel: 'isotropic' adds gaussian noise of standard deviation noise to every coordinate,
+    'anisotropic' scales that noise per landmark and axis by a random factor between 0.2 and 2,
+    'modes' draws the shapes from modeNumber random shape modes of decreasing variance (a PC
+    structure of about the same total variance) plus a tenth of the isotropic noise.
+    """
+    rng = np.random.default_rng(seed)
+    baseShape = rng.normal(size=(landmarkNumber, 3))
+    baseShape = gpa_lib.scaleShape(gpa_lib.centerShape(baseShape))
+    deviations = noise * rng.normal(size=(landmarkNumber, 3, specimenNumber))
+    modelRng = np.random.default_rng([seed, 1])
+    if noiseModel == 'anisotropic':
+        deviations *= modelRng.uniform(0.2, 2.0, size=(landmarkNumber, 3, 1))
+    elif noiseModel == 'modes':
+        directions, _ = np.linalg.qr(modelRng.normal(size=(3 * landmarkNumber, modeNumber)))
+        modeDeviations = noise * np.sqrt(3 * landmarkNumber) / np.arange(1, modeNumber + 1)
+        scores = modelRng.normal(size=(modeNumber, specimenNumber)) * modeDeviations[:, np.newaxis]
+        deviations = 0.1 * deviations + np.dot(directions, scores).reshape(landmarkNumber, 3, specimenNumber)
+    elif noiseModel != 'isotropic':
+        raise ValueError(f"Unknown noise model '{noiseModel}'")
+    shapes = baseShape[:, :, np.newaxis] + deviations
+    rotations, _ = np.linalg.qr(rng.normal(size=(specimenNumber, 3, 3)))
+    scales = rng.uniform(10, 50, size=specimenNumber)
+    translations = rng.normal(scale=100, size=(3, specimenNumber))
+    shapes = np.einsum('ijk,kjl->ilk', shapes, rotations) * scales + translations[np.newaxis, :, :]
+    return shapes
+
+
+def timeCall(function, *args, traceMemory=True, **kwargs):
+    """
+    Runs function and returns (result, wall time in seconds, peak traced memory in bytes). tracemalloc
+    slows down every allocation, so the timed call runs untraced and the peak is measured in a second
+    call, unless traceMemory is False (the peak is then None). Functions that update their arguments in
+    place get the updated arguments in the second call.
+    """
+    startTime = time.perf_counter()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - startTime
+    peak = None
+    if traceMemory:
+        tracemalloc.start()
+        try:
+            function(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def printResults(rows):
+    if not rows:
+        return
+    header = list(rows[0].keys())
+    print(", ".join(header))
+    for row in rows:
+        print(", ".join(f"{row[key]:.6g}" if isinstance(row[key], float) else str(row[key]) for key in header))
+
+
+def benchmarkBatchedGPA(specimenCounts=(50, 200, 1000, 5000, 20000), landmarkNumber=50, boas=False, loopLimit=5000):
+    """
+    Compares the per-specimen GPA loop with the batched engine on synthetic data.
+    The loop is only timed up to loopLimit specimens. Returns one dictionary per specimen count.
+    """
+    if boas:
+        loopGPA, batchedGPA = gpa_lib.runGPANoScale, gpa_lib.runGPANoScaleBatched
+    else:
+        loopGPA, batchedGPA = gpa_lib.runGPA, gpa_lib.runGPABatched
+    rows = []
+    for specimenNumber in specimenCounts:
+        landmarks = makeSyntheticLandmarks(landmarkNumber, specimenNumber)
+        (batchedLM, batchedMean), batchedTime, batchedPeak = timeCall(batchedGPA, landmarks.copy())
+        row = {
+            "specimens": specimenNumber,
+            "landmarks": landmarkNumber,
+            "batchedSeconds": batchedTime,
+            "batchedPeakMB": batchedPeak / 2**20,
+            "loopSeconds": float('nan'),
+            "loopPeakMB": float('nan'),
+            "maxDifference": float('nan'),
+        }
+        if specimenNumber <= loopLimit:
+            (loopLM, loopMean), loopTime, loopPeak = timeCall(loopGPA, landmarks.copy())
+            row["loopSeconds"] = loopTime
+            row["loopPeakMB"] = loopPeak / 2**20
+            row["maxDifference"] = float(np.abs(loopLM - batchedLM).max())
+        rows.append(row)
+    printResults(rows)
+    return rows
+
+
+def benchmarkTruncatedPCA(sizes=((2000, 1500), (5000, 3000)), pcNumber=20, solvers=('randomized', 'lanczos'), noise=0.05):
+    """
+    Compares the truncated PCA solvers with the exact Gram/covariance decomposition for
+    (landmarks, specimens) pairs in sizes. Reports the observed eigenvalue error next to the
+    a posteriori error bound returned by gpa_lib.calcEigenTruncated. For closely spaced
+    eigenvalues the bound holds for the nearest exact eigenvalue, not necessarily the one
+    with the same index.
+    """
+    rows = []
+    for landmarkNumber, specimenNumber in sizes:
+        landmarks = makeSyntheticLandmarks(landmarkNumber, specimenNumber, noise=noise)
+        aligned, _ = gpa_lib.runGPABatched(landmarks)
+        twoDim = gpa_lib.makeTwoDim(aligned)
+        (exactVal, exactVec), exactTime, _ = timeCall(gpa_lib.calcEigenGram, twoDim, traceMemory=False)
+        for solver in solvers:
+            (eigVal, eigVec, info), elapsed, peak = timeCall(gpa_lib.calcEigenTruncated, twoDim, pcNumber, solver=solver)
+            count = len(eigVal)
+            rows.append({
+                "landmarks": landmarkNumber,
+                "specimens": specimenNumber,
+                "solver": solver,
+                "pcNumber": count,
+                "seconds": elapsed,
+                "peakMB": peak / 2**20,
+                "exactSeconds": exactTime,
+                "capturedVariance": float(info['capturedVariance']),
+                "maxEigenvalueError": float(np.abs(exactVal[:count] - eigVal).max()),
+                "maxErrorBound": float(info['errorBound'].max()),
+            })
+    printResults(rows)
+    return rows
+
+
+def benchmarkResultsBundle(outputFolder, landmarkNumber=5000, specimenNumber=10000, pcNumber=100):
+    """
+    Writes a results bundle of the given size to outputFolder and times the memory-mapped reload,
+    including touching the arrays needed to set up the GPA module (scores, mean shape, distances).
+    """
+    import Support.io_lib as io_lib
+    rng = np.random.default_rng(0)
+    arrays = {
+        'lm': rng.normal(size=(landmarkNumber, 3, specimenNumber)),
+        'mShape': rng.normal(size=(landmarkNumber, 3)),
+        'val': np.sort(rng.uniform(size=pcNumber))[::-1],
+        'vec': rng.normal(size=(3 * landmarkNumber, pcNumber)),
+        'pcScores': rng.normal(size=(specimenNumber, pcNumber)),
+        'procdist': rng.uniform(size=specimenNumber),
+        'centroidSize': rng.uniform(size=specimenNumber),
+    }
+    metadata = {'SampleNames': [f"specimen_{index}" for index in range(specimenNumber)]}
+    _, writeTime, _ = timeCall(io_lib.writeResultsBundle, outputFolder, arrays, metadata, traceMemory=False)
+    del arrays
+
+    def reload():
+        loaded, loadedMetadata = io_lib.readResultsBundle(outputFolder)
+        return float(loaded['pcScores'][:, :10].sum() + loaded['mShape'].sum() + loaded['procdist'].min())
+
+    _, readTime, readPeak = timeCall(reload)
+    rows = [{
+        "landmarks": landmarkNumber,
+        "specimens": specimenNumber,
+        "writeSeconds": writeTime,
+        "reloadSeconds": readTime,
+        "reloadPeakMB": readPeak / 2**20,
+    }]
+    printResults(rows)
+    return rows
+
+
+# Per-specimen loop implementations the kernels in kernel_lib replaced, kept as benchmark references
+def loopCovariance(vec):
+    i, j = vec.shape
+    meanVec = np.zeros(i)
+    for x in range(j):
+        meanVec += vec[:, x] / float(j)
+    covMatrix = np.zeros((i, i))
+    for x in range(j):
+        t1 = ((vec[:, x] - meanVec).T).reshape(i, 1)
+        t2 = (vec[:, x] - meanVec).reshape(1, i)
+        covMatrix += np.dot(t1, t2) / float(j)
+    return covMatrix
+
+
+def loopLandmarkVariance(landmarks, meanShape, scaleFactor=1.0):
+    i, j, k = landmarks.shape
+    varianceMat = np.zeros((i, j))
+    for subject in range(k):
+        varianceMat = varianceMat + pow((landmarks[:, :, subject] - meanShape), 2)
+    return scaleFactor * np.sqrt(varianceMat / (k - 1))
+
+
+def loopProcrustesDistances(landmarks, meanShape):
+    i, j, k = landmarks.shape
+    procDists = np.zeros(k)
+    for x in range(k):
+        procDists[x] = np.linalg.norm(landmarks[:, :, x] - meanShape, 'fro')
+    return procDists
+
+
+def benchmarkKernels(sizes=((50, 100), (200, 500), (1000, 1000), (5000, 200)), dtypes=(np.float64, np.float32), loopLimit=2000):
+    """
+    Compares the loop implementations with the kernel_lib kernels for (landmarks, specimens) pairs in
+    sizes. The covariance loop is only timed while 3 x landmarks is at most loopLimit.
+    maxRelativeError is measured against the float64 loop result.
+    """
+    rows = []
+    for landmarkNumber, specimenNumber in sizes:
+        landmarks = makeSyntheticLandmarks(landmarkNumber, specimenNumber)
+        meanShape = landmarks.mean(axis=2)
+        twoDim = gpa_lib.makeTwoDim(landmarks)
+        kernels = [
+            ("covariance", loopCovariance, kernel_lib.covariance, (twoDim,), 3 * landmarkNumber <= loopLimit),
+            ("landmarkVariance", loopLandmarkVariance, kernel_lib.landmarkVariance, (landmarks, meanShape), True),
+            ("procrustesDistances", loopProcrustesDistances, kernel_lib.procrustesDistances, (landmarks, meanShape), True),
+        ]
+        for name, loopFunction, kernelFunction, arguments, runLoop in kernels:
+            reference, loopTime, loopPeak = float('nan'), float('nan'), float('nan')
+            if runLoop:
+                reference, loopTime, loopPeak = timeCall(loopFunction, *arguments)
+            for dtype in dtypes:
+                result, kernelTime, kernelPeak = timeCall(kernelFunction, *arguments, dtype=dtype)
+                maxRelativeError = float('nan')
+                if runLoop:
+                    maxRelativeError = float(np.abs(result - reference).max() / np.abs(reference).max())
+                rows.append({
+                    "kernel": name,
+                    "landmarks": landmarkNumber,
+                    "specimens": specimenNumber,
+                    "dtype": np.dtype(dtype).name,
+                    "loopSeconds": loopTime,
+                    "kernelSeconds": kernelTime,
+                    "speedup": loopTime / kernelTime,
+                    "loopPeakMB": loopPeak / 2**20,
+                    "kernelPeakMB": kernelPeak / 2**20,
+                    "maxRelativeError": maxRelativeError,
+                })
+    printResults(rows)
+    return rows
+
+
+def writeSyntheticLandmarks(out, noise=0.01, seed=0, chunkSize=100):
+    """
+    Fills a (landmarks x 3 x specimens) array, e.g. a memory map, with data like makeSyntheticLandmarks,
+    chunkSize specimens at a time so the full array never has to fit in memory.
+    """
+    landmarkNumber, _, specimenNumber = out.shape
+    baseShape = np.random.default_rng(seed).normal(size=(landmarkNumber, 3))
+    baseShape = gpa_lib.scaleShape(gpa_lib.centerShape(baseShape))
+    for start in range(0, specimenNumber, chunkSize):
+        count = min(chunkSize, specimenNumber - start)
+        rng = np.random.default_rng([seed, start])
+        shapes = baseShape[:, :, np.newaxis] + noise * rng.normal(size=(landmarkNumber, 3, count))
+        rotations, _ = np.linalg.qr(rng.normal(size=(count, 3, 3)))
+        scales = rng.uniform(10, 50, size=count)
+        translations = rng.normal(scale=100, size=(3, count))
+        out[:, :, start:start + count] = np.einsum('ijk,kjl->ilk', shapes, rotations) * scales + translations[np.newaxis, :, :]
+    return out
+
+
+def benchmarkOutOfCoreGPA(outputFolder, sizes=((2000, 500), (20000, 300)), memoryCeiling=256 * 2**20, pcNumber=20, compareLimit=2 * 10**7):
+    """
+    Runs the out-of-core GPA and PCA on memory-mapped synthetic (landmarks, specimens) datasets written to
+    outputFolder and checks the peak traced memory of each stage against memoryCeiling. Datasets with at
+    most compareLimit coordinates are also run in memory to report the largest difference.
+    """
+    import os
+    import Support.io_lib as io_lib
+    rows = []
+    for landmarkNumber, specimenNumber in sizes:
+        filePath = os.path.join(outputFolder, f"landmarks_{landmarkNumber}_{specimenNumber}.npy")
+        landmarks = writeSyntheticLandmarks(io_lib.createLandmarkMemmap(filePath, landmarkNumber, specimenNumber))
+        inMemory = np.array(landmarks) if landmarks.size <= compareLimit else None
+        (aligned, meanShape), gpaTime, gpaPeak = timeCall(gpa_lib.runGPAOutOfCore, landmarks, memoryCeiling)
+        (eigVal, eigVec), eigenTime, eigenPeak = timeCall(gpa_lib.calcEigenOutOfCore, aligned, meanShape, memoryCeiling, pcNumber)
+        row = {
+            "landmarks": landmarkNumber,
+            "specimens": specimenNumber,
+            "fileMB": os.path.getsize(filePath) / 2**20,
+            "ceilingMB": memoryCeiling / 2**20,
+            "gpaSeconds": gpaTime,
+            "gpaPeakMB": gpaPeak / 2**20,
+            "eigenSeconds": eigenTime,
+            "eigenPeakMB": eigenPeak / 2**20,
+            "withinCeiling": max(gpaPeak, eigenPeak) <= memoryCeiling,
+            "maxDifference": float('nan'),
+            "maxEigenvalueDifference": float('nan'),
+        }
+        if inMemory is not None:
+            referenceAligned, _ = gpa_lib.runGPABatched(inMemory)
+            referenceVal, _ = gpa_lib.calcEigenGram(gpa_lib.makeTwoDim(referenceAligned))
+            row["maxDifference"] = float(np.abs(referenceAligned - aligned).max())
+            row["maxEigenvalueDifference"] = float(np.abs(referenceVal[:len(eigVal)] - eigVal).max())
+        del landmarks, aligned
+        rows.append(row)
+    printResults(rows)
+    return rows
+
+
+def benchmarkGPASolver(sizes=((50, 200), (500, 1000)), noiseLevels=(0.01, 0.3, 1.0), tolerance=1e-8, maxIterations=500, boas=False):
+    """
+    Compares iterations and time to reach tolerance for the plain and the Anderson accelerated mean update
+    of gpa_lib.runGPASolver on synthetic (landmarks, specimens) data at each noise level. The first row of
+    each case shows where the current default stopping rule (tolerance 0.0001, 5 iterations) ends.
+    """
+    rows = []
+    settings = [
+        ("default", {}),
+        ("plain", {"tolerance": tolerance, "maxIterations": maxIterations}),
+        ("anderson", {"tolerance": tolerance, "maxIterations": maxIterations, "acceleration": "anderson"}),
+    ]
+    for landmarkNumber, specimenNumber in sizes:
+        for noise in noiseLevels:
+            landmarks = makeSyntheticLandmarks(landmarkNumber, specimenNumber, noise=noise)
+            for name, options in settings:
+                (_, _, trace), elapsed, _ = timeCall(gpa_lib.runGPASolver, landmarks.copy(), scale=not boas, traceMemory=False, **options)
+                rows.append({
+                    "landmarks": landmarkNumber,
+                    "specimens": specimenNumber,
+                    "noise": noise,
+                    "solver": name,
+                    "converged": trace['converged'],
+                    "iterations": trace['iterations'],
+                    "finalResidual": trace['residuals'][-1],
+                    "seconds": elapsed,
+                })
+    printResults(rows)
+    return rows
+
+
+def benchmarkThinPlateSpline(vertexCounts=(100000, 500000, 2000000), landmarkNumber=50, workerCounts=(1, None), compareVTK=True):
+    """
+    Measures the throughput in vertices per second of the numpy thin plate spline evaluator in
+    tps_lib for random vertices around a synthetic landmark set, for each thread pool size in
+    workerCounts (None is the default pool size). If VTK can be imported, the same points are also
+    warped with vtkThinPlateSplineTransform (R basis) for the reference throughput and the largest
+    coordinate difference.
+    """
+    import Support.tps_lib as tps_lib
+    try:
+        import vtk
+        from vtk.util import numpy_support
+    except ImportError:
+        compareVTK = False
+    rng = np.random.default_rng(0)
+    sourceLandmarks = 50 * rng.normal(size=(landmarkNumber, 3))
+    targetLandmarks = sourceLandmarks + 2 * rng.normal(size=(landmarkNumber, 3))
+    spline = tps_lib.fitThinPlateSpline(sourceLandmarks, targetLandmarks)
+    rows = []
+    for vertexNumber in vertexCounts:
+        vertices = 60 * rng.normal(size=(vertexNumber, 3))
+        reference = None
+        vtkRate = float('nan')
+        if compareVTK:
+            transform = vtk.vtkThinPlateSplineTransform()
+            transform.SetSourceLandmarks(makeVTKPoints(sourceLandmarks))
+            transform.SetTargetLandmarks(makeVTKPoints(targetLandmarks))
+            transform.SetBasisToR()
+            transform.Update()
+            warpedPoints = vtk.vtkPoints()
+            warpedPoints.SetDataTypeToDouble()
+            _, vtkTime, _ = timeCall(transform.TransformPoints, makeVTKPoints(vertices), warpedPoints, traceMemory=False)
+            reference = numpy_support.vtk_to_numpy(warpedPoints.GetData())
+            vtkRate = vertexNumber / vtkTime
+        for workers in workerCounts:
+            startTime = time.perf_counter()
+            warped = tps_lib.evaluateThinPlateSpline(spline, vertices, workers=workers)
+            elapsed = time.perf_counter() - startTime
+            rows.append({
+                "vertices": vertexNumber,
+                "landmarks": landmarkNumber,
+                "workers": "default" if workers is None else workers,
+                "seconds": elapsed,
+                "verticesPerSecond": vertexNumber / elapsed,
+                "vtkVerticesPerSecond": vtkRate,
+                "maxDifference": float(np.abs(warped - reference).max()) if reference is not None else float('nan'),
+            })
+    printResults(rows)
+    return rows
+
+
+def makeVTKPoints(array):
+    import vtk
+    from vtk.util import numpy_support
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(array, dtype=float), deep=True))
+    return points
+
+
+def benchmarkBulkConversion(valueCounts=(250000, 2000000), columnNumber=10, repeats=3):
+    """
+    Times vtk_lib.convertNumpyToVTK and vtk_lib.setTableColumns (one name column and columnNumber float
+    columns) for each number of values, best of repeats, and reports the time per value relative to the
+    first size, which stays near 1 when the conversions scale linearly. Needs the Slicer python console.
+    """
+    import slicer
+    import Support.vtk_lib as vtk_lib
+    tableNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTableNode')
+
+    def convertPoints(valueNumber):
+        vtk_lib.convertNumpyToVTK(np.random.rand(valueNumber // 3, 3))
+
+    def fillTable(valueNumber):
+        rowNumber = valueNumber // columnNumber
+        values = np.random.rand(rowNumber, columnNumber)
+        vtk_lib.setTableColumns(tableNode, [('Subject ID', ["specimen_" + str(index) for index in range(rowNumber)])] +
+                                [("PC" + str(j + 1), values[:, j]) for j in range(columnNumber)])
+
+    rows = []
+    try:
+        for function in (convertPoints, fillTable):
+            firstRate = None
+            for valueNumber in valueCounts:
+                seconds = min(timeCall(function, valueNumber, traceMemory=False)[1] for _ in range(repeats))
+                if firstRate is None:
+                    firstRate = seconds / valueNumber
+                rows.append({
+                    "conversion": function.__name__,
+                    "values": valueNumber,
+                    "seconds": seconds,
+                    "relativeTimePerValue": seconds / valueNumber / firstRate,
+                })
+    finally:
+        slicer.mrmlScene.RemoveNode(tableNode)
+    printResults(rows)
+    return rows
+
+
+def benchmarkResampling(landmarkNumber=50, specimenNumber=200, replicateNumber=200, workerCounts=(1, 2, 4, None), pcNumber=10, mode='bootstrap'):
+    """
+    Times resampling_lib.resample on synthetic data for each process count in workerCounts (None is
+    one process per CPU) and reports the speedup over the first entry. Replicates are seeded
+    independently of the process count, so every row must reproduce the first row's results.
+    """
+    import os
+    import Support.resampling_lib as resampling_lib
+    landmarks = makeSyntheticLandmarks(landmarkNumber, specimenNumber)
+    groups = np.arange(specimenNumber) % 2
+    rows = []
+    firstResults = None
+    for workers in workerCounts:
+        startTime = time.perf_counter()
+        results = resampling_lib.resample(landmarks, mode, replicateNumber, groups=groups, pcNumber=pcNumber, workers=workers)
+        elapsed = time.perf_counter() - startTime
+        if firstResults is None:
+            firstResults, firstTime = results, elapsed
+        rows.append({
+            "landmarks": landmarkNumber,
+            "specimens": specimenNumber,
+            "replicates": replicateNumber,
+            "workers": os.cpu_count() if workers is None else workers,
+            "seconds": elapsed,
+            "replicatesPerSecond": replicateNumber / elapsed,
+            "speedup": firstTime / elapsed,
+            "identical": all(np.array_equal(results['replicates'][key], firstResults['replicates'][key]) for key in results['replicates']),
+        })
+    printResults(rows)
+    return rows
+
+
+def writeFcsvLandmarks(filePath, points):
+    """
+    Writes a (landmarks x 3) array as a Slicer .fcsv markups file.
+    """
+    lines = [
+        "# Markups fiducial file version = 4.11",
+        "# CoordinateSystem = LPS",
+        "# columns = id,x,y,z,ow,ox,oy,oz,vis,sel,lock,label,desc,associatedNodeID",
+    ]
+    for index, point in enumerate(points):
+        lines.append(f"vtkMRMLMarkupsFiducialNode_{index},{point[0]:.17g},{point[1]:.17g},{point[2]:.17g},0,0,0,1,1,1,1,F-{index + 1},,")
+    with open(filePath, 'w') as landmarkFile:
+        landmarkFile.write("\n".join(lines) + "\n")
+
+
+def writeMarkupsJsonLandmarks(filePath, points):
+    """
+    Writes a (landmarks x 3) array as a Slicer .mrk.json point list.
+    """
+    import json
+    controlPoints = [{
+        "id": str(index + 1),
+        "label": f"F-{index + 1}",
+        "description": "",
+        "associatedNodeID": "",
+        "position": [float(coordinate) for coordinate in point],
+        "orientation": [-1.0, -0.0, -0.0, -0.0, -1.0, -0.0, 0.0, 0.0, 1.0],
+        "selected": True,
+        "locked": False,
+        "visibility": True,
+        "positionStatus": "defined",
+    } for index, point in enumerate(points)]
+    markups = {
+        "@schema": "https://raw.githubusercontent.com/slicer/slicer/master/Modules/Loadable/Markups/Resources/Schema/markups-schema-v1.0.3.json#",
+        "markups": [{
+            "type": "Fiducial",
+            "coordinateSystem": "LPS",
+            "coordinateUnits": "mm",
+            "locked": False,
+            "labelFormat": "%N-%d",
+            "controlPoints": controlPoints,
+        }],
+    }
+    with open(filePath, 'w') as landmarkFile:
+        json.dump(markups, landmarkFile, indent=4)
+
+
+def writeSyntheticLandmarkFiles(folder, landmarkNumber, specimenNumber, noise=0.01, seed=0, extension='.fcsv', noiseModel='isotropic'):
+    """
+    Writes specimenNumber synthetic landmark files (see makeSyntheticLandmarks) to folder, as .fcsv
+    or .mrk.json depending on extension. Returns the file paths.
+    """
+    import os
+    writers = {'.fcsv': writeFcsvLandmarks, '.mrk.json': writeMarkupsJsonLandmarks}
+    if extension not in writers:
+        raise ValueError(f"Unknown landmark file extension '{extension}'")
+    os.makedirs(folder, exist_ok=True)
+    landmarks = makeSyntheticLandmarks(landmarkNumber, specimenNumber, noise=noise, seed=seed, noiseModel=noiseModel)
+    filePaths = []
+    for specimen in range(specimenNumber):
+        filePath = os.path.join(folder, f"specimen_{specimen:06d}{extension}")
+        writers[extension](filePath, landmarks[:, :, specimen])
+        filePaths.append(filePath)
+    return filePaths
+
+
+def benchmarkHeadlessAnalysis(outputFolder, sizes=((50, 100), (50, 1000), (500, 1000), (50, 10000)), pcNumber=50):
+    """
+    Writes synthetic (landmarks, specimens) datasets of landmark files to outputFolder and runs the headless
+    analysis_lib.runAnalysis on each, reporting the wall time per stage and the peak traced memory.
+    """
+    import os
+    import Support.analysis_lib as analysis_lib
+    rows = []
+    for landmarkNumber, specimenNumber in sizes:
+        landmarkFolder = os.path.join(outputFolder, f"landmarks_{landmarkNumber}x{specimenNumber}")
+        if not os.path.isdir(landmarkFolder) or len(os.listdir(landmarkFolder)) != specimenNumber:
+            writeSyntheticLandmarkFiles(landmarkFolder, landmarkNumber, specimenNumber)
+        summary, elapsed, peak = timeCall(analysis_lib.runAnalysis, landmarkFolder,
+            os.path.join(outputFolder, f"results_{landmarkNumber}x{specimenNumber}"),
+            pcNumber=pcNumber, timestampFolder=False)
+        rows.append({
+            "landmarks": landmarkNumber,
+            "specimens": specimenNumber,
+            "loadSeconds": summary['seconds']['load'],
+            "gpaSeconds": summary['seconds']['gpa'],
+            "pcaSeconds": summary['seconds']['pca'],
+            "writeSeconds": summary['seconds']['write'],
+            "seconds": elapsed,
+            "peakMB": peak / 2**20,
+        })
+    printResults(rows)
+    return rows
+
+
+def benchmarkEnvironment():
+    """
+    Describes the machine and code version of a benchmark run, for the JSON reports.
+    """
+    import os
+    import sys
+    import platform
+    import subprocess
+    from datetime import datetime
+    import scipy
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "date": datetime.now().isoformat(timespec='seconds'),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+    }
+
+
+def benchmarkSuite(outputFolder, sizes=((50, 100), (50, 1000), (500, 1000)), extensions=('.fcsv', '.mrk.json'), noise=0.01,
+                   noiseModel='isotropic', pcNumber=None, repeats=3, resultsPath=None):
+    """
+    Times every stage of the GPA workflow on synthetic (landmarks, specimens) cohorts written to outputFolder in
+    each landmark file format: ingest (io_lib.loadLandmarkArray), GPA (gpa_lib.runGPASolver), PCA
+    (gpa_lib.calcEigenByMethod), output (io_lib.writeResultsBundle) and reload (io_lib.readResultsBundle).
+    Each stage is run repeats times; the fastest wall time and the largest peak traced memory are reported.
+    The rows and benchmarkEnvironment() are written as JSON to resultsPath (by default a time stamped file in
+    outputFolder), for compareBenchmarkReports. Returns the rows.
+    """
+    import os
+    import json
+    import Support.io_lib as io_lib
+    environment = benchmarkEnvironment()
+    rows = []
+    for landmarkNumber, specimenNumber in sizes:
+        for extension in extensions:
+            landmarkFolder = os.path.join(outputFolder, f"cohort_{landmarkNumber}x{specimenNumber}_{noiseModel}{extension.replace('.', '_')}")
+            if not os.path.isdir(landmarkFolder) or len(os.listdir(landmarkFolder)) != specimenNumber:
+                writeSyntheticLandmarkFiles(landmarkFolder, landmarkNumber, specimenNumber, noise=noise, extension=extension,
+                                            noiseModel=noiseModel)
+            filePaths = sorted(os.path.join(landmarkFolder, name) for name in os.listdir(landmarkFolder))
+            resultsFolder = os.path.join(outputFolder, f"results_{landmarkNumber}x{specimenNumber}")
+            stageTimes = {}
+
+            def runStage(stage, function, *args, **kwargs):
+                result, elapsed, peak = timeCall(function, *args, **kwargs)
+                seconds, peakBytes = stageTimes.get(stage, (float('inf'), 0))
+                stageTimes[stage] = (min(seconds, elapsed), max(peakBytes, peak))
+                return result
+
+            for repeat in range(repeats):
+                landmarks = runStage('ingest', io_lib.loadLandmarkArray, filePaths)[0]
+                aligned, meanShape, trace = runStage('gpa', gpa_lib.runGPASolver, landmarks)
+                twoDim = gpa_lib.makeTwoDim(aligned)
+                eigVal, eigVec, eigenMethod, eigenInfo = runStage('pca', gpa_lib.calcEigenByMethod, twoDim, pcNumber=pcNumber)
+                arrays = {
+                    'lm': aligned,
+                    'mShape': meanShape,
+                    'val': eigVal,
+                    'vec': eigVec,
+                    'pcScores': np.dot(np.transpose(twoDim), eigVec),
+                    'procdist': gpa_lib.procDist(aligned, meanShape),
+                }
+                runStage('output', io_lib.writeResultsBundle, resultsFolder, arrays, {"SampleNames": filePaths})
+                runStage('reload', io_lib.readResultsBundle, resultsFolder, mmapMode=None)
+            for stage, (seconds, peak) in stageTimes.items():
+                rows.append({
+                    "landmarks": landmarkNumber,
+                    "specimens": specimenNumber,
+                    "format": extension,
+                    "noiseModel": noiseModel,
+                    "stage": stage,
+                    "seconds": seconds,
+                    "peakMB": peak / 2**20,
+                })
+    printResults(rows)
+    if resultsPath is None:
+        resultsPath = os.path.join(outputFolder, f"benchmark_{environment['date'].replace(':', '-')}.json")
+    with open(resultsPath, 'w') as resultsFile:
+        json.dump({"environment": environment, "repeats": repeats, "results": rows}, resultsFile, indent=2)
+    print(f"Benchmark results written to {resultsPath}")
+    return rows
+
+
+def compareBenchmarkReports(baselinePath, currentPath, slowdownLimit=1.2, minimumSeconds=0.01):
+    """
+    Compares two JSON reports of benchmarkSuite stage by stage. Returns one row per stage present in
+    both, with the time ratio current / baseline. Stages slower than slowdownLimit are flagged, unless
+    they got slower by less than minimumSeconds, which is within the timing noise of short stages.
+    """
+    import json
+    reports = []
+    for path in (baselinePath, currentPath):
+        with open(path) as reportFile:
+            reports.append(json.load(reportFile))
+
+    def key(row):
+        return (row["landmarks"], row["specimens"], row["format"], row["noiseModel"], row["stage"])
+
+    baselineRows = {key(row): row for row in reports[0]["results"]}
+    rows = []
+    for row in reports[1]["results"]:
+        baseline = baselineRows.get(key(row))
+        if baseline is None:
+            continue
+        ratio = row["seconds"] / max(baseline["seconds"], 1e-9)
+        rows.append({
+            "landmarks": row["landmarks"],
+            "specimens": row["specimens"],
+            "format": row["format"],
+            "stage": row["stage"],
+            "baselineSeconds": baseline["seconds"],
+            "seconds": row["seconds"],
+            "ratio": ratio,
+            "regression": ratio > slowdownLimit and row["seconds"] - baseline["seconds"] > minimumSeconds,
+        })
+    print(f"Baseline {reports[0]['environment'].get('commit')}, current {reports[1]['environment'].get('commit')}")
+    printResults(rows)
+    return rows
@@ -0,0 +1,128 @@
+"""
+Blockwise pairwise euclidean distances with condensed output.
+
+The condensed layout is the one used by scipy.spatial.distance (pdist/squareform): the upper
+triangle of the n x n distance matrix, row by row, with the n*(n-1)/2 entries for i < j.
+Distances are computed for a block of rows at a time, with the block size chosen so the
+temporaries stay within memoryBudget bytes. The output can be a .npy file opened as a
+memory map, for matrices that do not fit in RAM.
+"""
+import numpy as np
+
+DEFAULT_MEMORY_BUDGET = 64 * 2**20
+
+# Above this dimension distances are computed from inner products instead of coordinate differences
+DIFFERENCE_DIMENSION_LIMIT = 8
+
+
+def condensedSize(n):
+    return n * (n - 1) // 2
+
+
+def condensedRowStart(n, row):
+    """
+    Position of the distance between row and row + 1 in the condensed array.
+    """
+    return n * row - row * (row + 1) // 2
+
+
+def condensedIndex(n, row, column):
+    if row == column:
+        raise ValueError("The condensed distance array has no diagonal entries")
+    if row > column:
+        row, column = column, row
+    return condensedRowStart(n, row) + column - row - 1
+
+
+def squareSize(condensed):
+    n = int(round((1 + np.sqrt(1 + 8 * len(condensed))) / 2))
+    if condensedSize(n) != len(condensed):
+        raise ValueError(f"{len(condensed)} is not the length of a condensed distance array")
+    return n
+
+
+def createDistanceMemmap(filePath, n, dtype=np.float64):
+    """
+    Creates a .npy file holding a condensed distance array for n points and returns it as a writable memory map.
+    """
+    return np.lib.format.open_memmap(filePath, mode='w+', dtype=dtype, shape=(condensedSize(n),))
+
+
+def rowBlockSize(rowNumber, columnNumber, dimension, itemSize, memoryBudget):
+    bytesPerRow = columnNumber * itemSize * (dimension + 2 if dimension <= DIFFERENCE_DIMENSION_LIMIT else 3)
+    return int(min(rowNumber, max(1, memoryBudget // max(bytesPerRow, 1))))
+
+
+def pairwiseDistances(points, dtype=np.float64, memoryBudget=DEFAULT_MEMORY_BUDGET, out=None, outputPath=None):
+    """
+    Condensed euclidean distance array between the rows of points (n x dimension).
+    dtype: np.float64 or np.float32, used for the computation and the output.
+    memoryBudget: approximate limit in bytes for the temporaries of one block.
+    out: optional preallocated condensed array (e.g. from createDistanceMemmap) to write into.
+    outputPath: if given (and out is not), the result is written to this .npy file through a memory map.
+    Returns the condensed array.
+    """
+    points = np.asarray(points, dtype=dtype)
+    if points.ndim == 1:
+        points = points[:, np.newaxis]
+    n, dimension = points.shape
+    if out is None:
+        if outputPath is not None:
+            out = createDistanceMemmap(outputPath, n, dtype)
+        else:
+            out = np.empty(condensedSize(n), dtype=dtype)
+    elif len(out) != condensedSize(n):
+        raise ValueError(f"The output array has {len(out)} entries instead of {condensedSize(n)}")
+    if n < 2:
+        return out
+    useDifferences = dimension <= DIFFERENCE_DIMENSION_LIMIT
+    if not useDifferences:
+        # centering keeps the inner product formula accurate for shapes far from the origin
+        points = points - points.mean(axis=0)
+        squaredNorms = np.einsum('ij,ij->i', points, points)
+    itemSize = np.dtype(dtype).itemsize
+    row = 0
+    while row < n - 1:
+        blockRows = rowBlockSize(n - 1 - row, n - row - 1, dimension, itemSize, memoryBudget)
+        rows = slice(row, row + blockRows)
+        columns = slice(row + 1, n)
+        if useDifferences:
+            difference = points[rows, np.newaxis, :] - points[np.newaxis, columns, :]
+            block = np.sqrt(np.einsum('ijk,ijk->ij', difference, difference))
+        else:
+            block = np.dot(points[rows], points[columns].T)
+            block *= -2
+            block += squaredNorms[rows, np.newaxis]
+            block += squaredNorms[np.newaxis, columns]
+            np.maximum(block, 0, out=block)
+            np.sqrt(block, out=block)
+        for blockRow in range(blockRows):
+            currentRow = row + blockRow
+            start = condensedRowStart(n, currentRow)
+            out[start:start + n - currentRow - 1] = block[blockRow, blockRow:]
+        row += blockRows
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+def procrustesDistanceMatrix(landmarks, dtype=np.float64, memoryBudget=DEFAULT_MEMORY_BUDGET, out=None, outputPath=None):
+    """
+    Condensed Procrustes distance array between the specimens of an aligned (landmarks x 3 x specimens) array.
+    """
+    i, j, k = landmarks.shape
+    shapes = np.transpose(landmarks, (2, 0, 1)).reshape(k, i * j)
+    return pairwiseDistances(shapes, dtype, memoryBudget, out, outputPath)
+
+
+def squareDistanceMatrix(condensed):
+    """
+    Expands a condensed distance array to the full symmetric n x n matrix.
+    """
+    n = squareSize(condensed)
+    square = np.zeros((n, n), dtype=condensed.dtype)
+    for row in range(n - 1):
+        start = condensedRowStart(n, row)
+        square[row, row + 1:] = condensed[start:start + n - row - 1]
+        square[row + 1:, row] = condensed[start:start + n - row - 1]
+    return square
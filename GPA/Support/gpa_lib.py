@@ -3,32 +3,106 @@ import os
 import fnmatch
 import scipy.linalg as sp
 
+import Support.kernel_lib as kernel_lib
+
 # PCA
 def makeTwoDim(monsters):
     i,j,k=monsters.shape
-    tmp=np.zeros((i*j,k))
-    for x in range(k):
-      vec=np.reshape(monsters[:,:,x],(i*j),order='F')
-      tmp[:,x]=vec
-    tmp -= np.mean(tmp, axis=1, keepdims=True)
+    # column x holds specimen x flattened in Fortran order (all X, then Y, then Z)
+    tmp=np.transpose(monsters,(1,0,2)).reshape(i*j,k)
+    tmp=tmp-np.mean(tmp, axis=1, keepdims=True)
     return tmp
 
 def calcMean(vec):
+    return vec.mean(axis=1)
+
+def calcCov(vec, dtype=np.float64):
+    return kernel_lib.covariance(vec, dtype)
+
+def calcEigenGram(vec):
+    """
+    Eigen decomposition of calcCov(vec) through the specimens x specimens Gram matrix.
+    vec holds one centered specimen per column (see makeTwoDim). Returns all k eigenpairs,
+    largest first. Eigenvectors of zero eigenvalues are returned as zero columns.
+    """
     i,j=vec.shape
-    meanVec=np.zeros(i)
-    for x in range(j):
-        meanVec+=vec[:,x]/float(j)
-    return meanVec
+    gram=np.dot(np.transpose(vec),vec)/float(j)
+    eigVal, gramVec=sp.eigh(gram)
+    eigVal=eigVal[::-1]
+    gramVec=gramVec[:, ::-1]
+    eigVec=np.dot(vec,gramVec)
+    norms=np.linalg.norm(eigVec, axis=0)
+    nonZero=norms > 1e-10*max(norms.max(), np.finfo(float).tiny)
+    eigVec[:,nonZero]/=norms[nonZero]
+    eigVec[:,~nonZero]=0
+    return eigVal, eigVec
 
-def calcCov(vec):
+def calcEigenTruncated(vec, pcNumber, solver='randomized', oversampling=10, powerIterations=4, seed=0):
+    """
+    Leading pcNumber eigenpairs of calcCov(vec) without forming the covariance matrix.
+    solver: 'randomized' (randomized range finder with power iterations) or 'lanczos' (ARPACK svds).
+    Returns eigVal, eigVec and a dictionary with the captured fraction of the total variance and,
+    per eigenpair, the residual norm ||C v - l v||, which bounds the distance of l to the nearest
+    exact eigenvalue of the covariance matrix.
+    """
     i,j=vec.shape
-    meanVec=calcMean(vec)
-    covMatrix=np.zeros((i,i))
-    for x in range(j):
-      t1=((vec[:,x]-meanVec).T).reshape(i,1)
-      t2=(vec[:,x]-meanVec).reshape(1,i)
-      covMatrix+=np.dot(t1,t2)/float(j)
-    return covMatrix
+    pcNumber=min(pcNumber, i, j)
+    if solver == 'lanczos':
+      from scipy.sparse.linalg import svds
+      pcNumber=min(pcNumber, min(i, j)-1)
+      u,s,vt=svds(vec, k=pcNumber, random_state=seed)
+      order=np.argsort(s)[::-1]
+      u=u[:,order]
+      s=s[order]
+    else:
+      rng=np.random.default_rng(seed)
+      sketchSize=min(pcNumber+oversampling, i, j)
+      q,r=np.linalg.qr(np.dot(vec, rng.normal(size=(j, sketchSize))))
+      for iteration in range(powerIterations):
+        q,r=np.linalg.qr(np.dot(np.transpose(vec), q))
+        q,r=np.linalg.qr(np.dot(vec, q))
+      uSmall,s,vt=np.linalg.svd(np.dot(np.transpose(q), vec), full_matrices=False)
+      u=np.dot(q, uSmall[:,:pcNumber])
+      s=s[:pcNumber]
+    eigVal=s**2/float(j)
+    residual=np.dot(vec, np.dot(np.transpose(vec), u))/float(j)-u*eigVal
+    totalVariance=np.einsum('ij,ij->',vec,vec)/float(j)
+    info={
+      'solver': solver,
+      'pcNumber': pcNumber,
+      'totalVariance': totalVariance,
+      'capturedVariance': eigVal.sum()/totalVariance,
+      'errorBound': np.linalg.norm(residual, axis=0),
+      }
+    return eigVal, u, info
+
+def calcEigenByMethod(vec, method='auto', pcNumber=None, truncatedSolver='randomized'):
+  """
+  Eigen decomposition of calcCov(vec), vec holding one centered specimen per column (see makeTwoDim).
+  method: 'covariance', 'gram', 'truncated' or 'auto', as described in LMData.calcEigen.
+  Returns eigVal and eigVec (largest first), the method used and the calcEigenTruncated info
+  dictionary (None for the other methods).
+  """
+  coordinateNumber, specimenNumber=vec.shape
+  info=None
+  if method == 'auto':
+    if pcNumber is not None and min(coordinateNumber, specimenNumber) >= max(1000, 10*pcNumber):
+      method = 'truncated'
+    else:
+      method = 'covariance' if specimenNumber>coordinateNumber else 'gram'
+  if method == 'truncated':
+    eigVal, eigVec, info = calcEigenTruncated(vec, pcNumber, solver=truncatedSolver)
+  elif method == 'gram':
+    eigVal, eigVec = calcEigenGram(vec)
+  else:
+    covMatrix=calcCov(vec)
+    if specimenNumber>coordinateNumber: # limit results returned if sample number is less than observations
+      eigVal, eigVec = sp.eigh(covMatrix)
+    else:
+      eigVal, eigVec = sp.eigh(covMatrix, subset_by_index=[coordinateNumber - specimenNumber, coordinateNumber - 1])
+    eigVal=eigVal[::-1]
+    eigVec=eigVec[:, ::-1]
+  return eigVal, eigVec, method, info
 
 def sortEig(eVal, eVec):
     i,j=eVec.shape
@@ -58,24 +132,6 @@ def makeTransformMatrix(ePair,pcA,pcB):
     transform[:,1]=vec2.reshape(i).real
     return transform
 
-def plotTanProj(monsters,pcA,pcB):
-    i, j, k = monsters.shape
-    twoDim=makeTwoDim(monsters)
-    mShape=calcMean(twoDim)
-    covMatrix=calcCov(twoDim)
-    if k > i * j:  # limit results returned if sample number is less than observations
-      self.val, self.vec = sp.eigh(covMatrix)
-    else:
-      self.val, self.vec = sp.eigh(covMatrix, eigvals=(i * j - k, i * j - 1))
-    eigVal=eigVal[::-1]
-    eigVec=eigVec[:, ::-1]
-    eigPair=pairEig(eigVal,eigVec)
-    transform=makeTransformMatrix(eigPair,pcA,pcB)
-    transform=np.transpose(transform)
-    coords=np.dot(transform,twoDim)
-    tmp=np.column_stack((coords[0,:],coords[1,:]))
-    return tmp
-
 def plotTanProj(monsters,eigSort,pcA,pcB):
     twoDim=makeTwoDim(monsters)
     transform=makeTransformMatrix(eigSort,pcA,pcB)
@@ -108,13 +164,8 @@ def alignShape(refShape,shape):
 def meanShape(monsters):
     return monsters.mean(axis=2)
 
-def procDist(monsters,mshape):
-    i,j,k=monsters.shape
-    procDists=np.zeros(k)
-    for x in range(k):
-      tmp=monsters[:,:,x]-mshape
-      procDists[x]=np.linalg.norm(tmp,'fro')
-    return procDists
+def procDist(monsters,mshape, dtype=np.float64):
+    return kernel_lib.procrustesDistances(monsters, mshape, dtype)
 
 ################# GPA update
 def runGPA(allLandmarkSets):
@@ -182,3 +233,305 @@ def procrustesAlignNoScale(mean, allLandmarkSets):
 def applyCenter(landmarkSet):
   landmarkSet=centerShape(landmarkSet)
   return landmarkSet
+
+################# Batched GPA
+# The functions below operate on the whole (landmarks x 3 x specimens) array at
+# once: one stacked SVD per iteration instead of one scipy SVD per specimen.
+# They follow runGPA/runGPANoScale step by step and, like them, update the
+# input array in place.
+def centerShapes(allLandmarkSets):
+  allLandmarkSets -= allLandmarkSets.mean(axis=0, keepdims=True)
+  return allLandmarkSets
+
+def scaleShapes(allLandmarkSets):
+  norms=np.sqrt(np.einsum('ijk,ijk->k',allLandmarkSets,allLandmarkSets))
+  allLandmarkSets /= norms
+  return allLandmarkSets
+
+def alignShapes(refShape, allLandmarkSets):
+  """
+  Rotate every shape in the stack onto refShape, equivalent to calling alignShape per specimen.
+  """
+  cross=np.einsum('ij,ilk->kjl',refShape,allLandmarkSets) # refShape^T . shape, stacked
+  u,s,v=np.linalg.svd(cross)
+  rotationMatrices=np.einsum('kij,kjl->kli',u,v) # (u . v)^T == v^T . u^T
+  allLandmarkSets[:]=np.einsum('ijk,kjl->ilk',allLandmarkSets,rotationMatrices)
+  return allLandmarkSets
+
+def procrustesAlignBatched(mean, allLandmarkSets):
+  mean=scaleShape(mean)
+  return alignShapes(mean, allLandmarkSets)
+
+def procrustesAlignNoScaleBatched(mean, allLandmarkSets):
+  mean=centerShape(mean)
+  alignShapes(mean, allLandmarkSets)
+  return centerShapes(allLandmarkSets)
+
+def runGPABatched(allLandmarkSets):
+  allLandmarkSets, currentMeanShape, trace=runGPASolver(allLandmarkSets)
+  return allLandmarkSets, currentMeanShape
+
+def runGPANoScaleBatched(allLandmarkSets):
+  allLandmarkSets, currentMeanShape, trace=runGPASolver(allLandmarkSets, scale=False)
+  return allLandmarkSets, currentMeanShape
+
+def andersonStep(iterates, images):
+  """
+  Anderson mixing of the last fixed point iterates x and their images G(x): the combination of the
+  images whose residuals G(x) - x best cancel in the least squares sense.
+  """
+  if len(iterates) < 2:
+    return images[-1]
+  iterates=np.column_stack(iterates)
+  images=np.column_stack(images)
+  residuals=images-iterates
+  gamma=np.linalg.lstsq(np.diff(residuals, axis=1), residuals[:,-1], rcond=None)[0]
+  return images[:,-1]-np.dot(np.diff(images, axis=1), gamma)
+
+def iterateMeanShape(initialMeanShape, step, scale, tolerance, maxIterations, acceleration, andersonDepth, startTime):
+  """
+  Stopping rule and mean update shared by runGPASolver and runGPASolverOutOfCore. step(meanShape) aligns
+  all shapes to meanShape and returns the mean of the aligned shapes.
+  Returns the last mean shape and the trace dictionary.
+  """
+  import time
+  trace={'tolerance': tolerance, 'maxIterations': maxIterations, 'acceleration': acceleration,
+    'converged': False, 'iterations': 0, 'residuals': [], 'seconds': []}
+  iterates=[]
+  images=[]
+  currentMeanShape=initialMeanShape
+  while trace['iterations']<maxIterations:
+    currentMeanShape=step(initialMeanShape)
+    if not scale:
+      currentMeanShape=centerShape(currentMeanShape)
+    diff=np.linalg.norm(initialMeanShape-currentMeanShape)
+    trace['iterations']+=1
+    trace['residuals'].append(float(diff))
+    trace['seconds'].append(time.perf_counter()-startTime)
+    if diff<=tolerance:
+      trace['converged']=True
+      break
+    if acceleration is None:
+      initialMeanShape=currentMeanShape
+      continue
+    if len(trace['residuals'])>1 and diff>trace['residuals'][-2]:
+      iterates, images = [], []
+    iterates=(iterates+[initialMeanShape.ravel()])[-(andersonDepth+1):]
+    images=(images+[currentMeanShape.ravel()])[-(andersonDepth+1):]
+    initialMeanShape=andersonStep(iterates, images).reshape(currentMeanShape.shape)
+  return currentMeanShape, trace
+
+def runGPASolver(allLandmarkSets, scale=True, tolerance=0.0001, maxIterations=5, acceleration=None, andersonDepth=3):
+  """
+  Batched GPA with a configurable stopping rule. Each iteration aligns all shapes to the current mean
+  estimate and takes their mean; the residual is the change of the mean. The iteration stops once the
+  residual is at most tolerance, or after maxIterations.
+  acceleration: None uses the new mean as next estimate (as runGPA), 'anderson' extrapolates it from the
+  last andersonDepth + 1 iterations, restarting whenever the residual grows.
+  With the defaults the result is the same as runGPA/runGPANoScale. Updates allLandmarkSets in place and
+  returns it, the mean shape and a trace dictionary with the per-iteration residuals and elapsed seconds.
+  """
+  import time
+  if acceleration not in (None, 'anderson'):
+    raise ValueError(f"Unknown GPA acceleration '{acceleration}'")
+  startTime=time.perf_counter()
+  centerShapes(allLandmarkSets)
+  if scale:
+    scaleShapes(allLandmarkSets)
+    align, normalize = procrustesAlignBatched, scaleShape
+  else:
+    align, normalize = procrustesAlignNoScaleBatched, centerShape
+  align(allLandmarkSets[:,:,0].copy(),allLandmarkSets)
+  initialMeanShape=normalize(meanShape(allLandmarkSets))
+
+  def step(mean):
+    align(mean,allLandmarkSets)
+    return meanShape(allLandmarkSets)
+
+  currentMeanShape, trace = iterateMeanShape(initialMeanShape, step, scale, tolerance, maxIterations, acceleration,
+    andersonDepth, startTime)
+  if not scale:
+    centerShapes(allLandmarkSets)
+  return allLandmarkSets, currentMeanShape, trace
+
+################# Incremental update
+# Adding specimens to an existing analysis without repeating the GPA and the eigen decomposition:
+# new shapes are aligned to the existing consensus and the PCA is updated from the new columns.
+def alignToConsensus(meanShape, newLandmarkSets, scale=True):
+  """
+  Centers (and unless scale is False scales) the new shapes and rotates them onto meanShape,
+  in place, as one iteration of runGPABatched/runGPANoScaleBatched would.
+  """
+  centerShapes(newLandmarkSets)
+  if scale:
+    scaleShapes(newLandmarkSets)
+    return procrustesAlignBatched(meanShape, newLandmarkSets)
+  return procrustesAlignNoScaleBatched(meanShape, newLandmarkSets)
+
+def updateEigenIncremental(meanVec, eigVal, eigVec, sampleNumber, newVec, totalVariance, pcNumber=None):
+  """
+  Updates the mean, the eigen decomposition of calcCov and its trace when the columns of newVec
+  are added to the sampleNumber specimens the decomposition was computed from.
+  The covariance change is the rank (new + 1) matrix of the new columns and of the mean shift, so
+  the eigenpairs are recomputed in the span of eigVec and those columns only. The result is exact
+  if eigVec holds all eigenvectors with nonzero eigenvalue, and approximate for a truncated eigVec.
+  Returns the new mean vector, eigenvalues, eigenvectors (largest first) and total variance.
+  """
+  newNumber=newVec.shape[1]
+  totalNumber=sampleNumber+newNumber
+  eigVal=np.real(eigVal)
+  eigVec=np.real(eigVec)
+  keep=eigVal > 1e-12*max(eigVal.max(), np.finfo(float).tiny)
+  eigVal=eigVal[keep]
+  eigVec=eigVec[:,keep]
+  newMean=(sampleNumber*meanVec+newVec.sum(axis=1))/float(totalNumber)
+  # sum over all specimens of (x - newMean)(x - newMean)^T = n*C + update.update^T
+  update=np.column_stack((np.sqrt(sampleNumber)*(meanVec-newMean), newVec-newMean[:,np.newaxis]))
+  newTotalVariance=(sampleNumber*totalVariance+np.einsum('ij,ij->',update,update))/float(totalNumber)
+  residual=update-np.dot(eigVec,np.dot(eigVec.T,update))
+  residualBasis,residualNorms,_=np.linalg.svd(residual, full_matrices=False)
+  residualBasis=residualBasis[:,residualNorms > 1e-10*max(residualNorms.max(initial=0), np.linalg.norm(update), np.finfo(float).tiny)]
+  basis=np.column_stack((eigVec,residualBasis))
+  projected=np.dot(basis.T,update)
+  small=np.dot(projected,projected.T)
+  small[np.arange(len(eigVal)),np.arange(len(eigVal))]+=sampleNumber*eigVal
+  small/=float(totalNumber)
+  newVal,smallVec=sp.eigh(small)
+  newVal=np.clip(newVal[::-1], 0, None)
+  newVecs=np.dot(basis,smallVec[:,::-1])
+  if pcNumber is not None:
+    newVal=newVal[:pcNumber]
+    newVecs=newVecs[:,:pcNumber]
+  return newMean, newVal, newVecs, newTotalVariance
+
+################# Out-of-core GPA
+# The functions below keep the (landmarks x 3 x specimens) array where it is, typically a memory-mapped
+# file (see io_lib.createLandmarkMemmap), and only load chunks of specimens into memory. The chunk size
+# is chosen from a memory ceiling in bytes. Results match runGPABatched/runGPANoScaleBatched and
+# calcEigenGram/calcCov, and the array is updated in place like the in-memory versions.
+
+# Working copies per specimen while a chunk is processed, in multiples of the specimen size
+OUT_OF_CORE_COPIES = 6
+
+def outOfCoreChunkSize(landmarkNumber, memoryCeiling, reservedBytes=0):
+  specimenBytes=OUT_OF_CORE_COPIES*landmarkNumber*3*np.dtype(float).itemsize
+  chunkSize=int((memoryCeiling-reservedBytes)//specimenBytes)
+  if chunkSize < 1:
+    raise MemoryError(f"A memory ceiling of {memoryCeiling/2**20:.2f} MB leaves no room to process a specimen "
+      f"with {landmarkNumber} landmarks ({(reservedBytes+specimenBytes)/2**20:.2f} MB needed)")
+  return chunkSize
+
+def specimenChunks(specimenNumber, chunkSize):
+  for start in range(0, specimenNumber, chunkSize):
+    yield slice(start, min(start+chunkSize, specimenNumber))
+
+def centroidSizeOutOfCore(allLandmarkSets, memoryCeiling):
+  i,j,k=allLandmarkSets.shape
+  centroidSize=np.empty(k)
+  for chunk in specimenChunks(k, outOfCoreChunkSize(i, memoryCeiling)):
+    shapes=np.array(allLandmarkSets[:,:,chunk], dtype=float)
+    centerShapes(shapes)
+    centroidSize[chunk]=np.sqrt(np.einsum('ijk,ijk->k',shapes,shapes))
+  return centroidSize
+
+def alignChunksOutOfCore(allLandmarkSets, chunkSize, function, *args):
+  """
+  Applies the in-place batched function(*args, chunk) to every chunk, writes the chunks back
+  and returns the mean shape of the result.
+  """
+  i,j,k=allLandmarkSets.shape
+  shapeSum=np.zeros((i,j))
+  for chunk in specimenChunks(k, chunkSize):
+    shapes=np.array(allLandmarkSets[:,:,chunk], dtype=float)
+    function(*args, shapes)
+    allLandmarkSets[:,:,chunk]=shapes
+    shapeSum+=shapes.sum(axis=2)
+  return shapeSum/float(k)
+
+def runGPASolverOutOfCore(allLandmarkSets, memoryCeiling, scale=True, tolerance=0.0001, maxIterations=5, acceleration=None,
+                          andersonDepth=3):
+  """
+  runGPASolver on chunks of specimens, so the working memory stays below memoryCeiling bytes. Takes the
+  same stopping rule and acceleration options, updates allLandmarkSets in place and returns it, the mean
+  shape and the trace dictionary.
+  """
+  import time
+  if acceleration not in (None, 'anderson'):
+    raise ValueError(f"Unknown GPA acceleration '{acceleration}'")
+  startTime=time.perf_counter()
+  i,j,k=allLandmarkSets.shape
+  chunkSize=outOfCoreChunkSize(i, memoryCeiling)
+  if scale:
+    alignChunksOutOfCore(allLandmarkSets, chunkSize, lambda shapes: scaleShapes(centerShapes(shapes)))
+    align, normalize = procrustesAlignBatched, scaleShape
+  else:
+    alignChunksOutOfCore(allLandmarkSets, chunkSize, centerShapes)
+    align, normalize = procrustesAlignNoScaleBatched, centerShape
+  initialMeanShape=alignChunksOutOfCore(allLandmarkSets, chunkSize, align, np.array(allLandmarkSets[:,:,0], dtype=float))
+  initialMeanShape=normalize(initialMeanShape)
+  currentMeanShape, trace = iterateMeanShape(initialMeanShape,
+    lambda mean: alignChunksOutOfCore(allLandmarkSets, chunkSize, align, mean),
+    scale, tolerance, maxIterations, acceleration, andersonDepth, startTime)
+  if not scale:
+    alignChunksOutOfCore(allLandmarkSets, chunkSize, centerShapes)
+  return allLandmarkSets, currentMeanShape, trace
+
+def runGPAOutOfCore(allLandmarkSets, memoryCeiling):
+  allLandmarkSets, currentMeanShape, trace = runGPASolverOutOfCore(allLandmarkSets, memoryCeiling)
+  return allLandmarkSets, currentMeanShape
+
+def runGPANoScaleOutOfCore(allLandmarkSets, memoryCeiling):
+  allLandmarkSets, currentMeanShape, trace = runGPASolverOutOfCore(allLandmarkSets, memoryCeiling, scale=False)
+  return allLandmarkSets, currentMeanShape
+
+def centeredChunk(allLandmarkSets, meanVec, chunk):
+  # columns of makeTwoDim for the specimens in chunk
+  i,j,k=allLandmarkSets.shape
+  shapes=np.array(allLandmarkSets[:,:,chunk], dtype=float)
+  return np.transpose(shapes,(1,0,2)).reshape(i*j,-1)-meanVec[:,np.newaxis]
+
+def calcEigenOutOfCore(allLandmarkSets, meanShape, memoryCeiling, pcNumber=None):
+  """
+  Eigen decomposition of the covariance of the aligned shapes, accumulated chunk by chunk.
+  With more specimens than coordinates the 3p x 3p covariance matrix is accumulated, otherwise
+  the k x k Gram matrix, whose eigenvectors are mapped back to coordinate space chunk by chunk.
+  Returns the leading pcNumber eigenpairs (all if None), largest first.
+  """
+  i,j,k=allLandmarkSets.shape
+  meanVec=np.reshape(meanShape, i*j, order='F')
+  itemSize=np.dtype(float).itemsize
+  if k>i*j:
+    count=i*j if pcNumber is None else min(pcNumber, i*j)
+    chunkSize=outOfCoreChunkSize(i, memoryCeiling, 3*(i*j)**2*itemSize)
+    covMatrix=np.zeros((i*j,i*j))
+    for chunk in specimenChunks(k, chunkSize):
+      centered=centeredChunk(allLandmarkSets, meanVec, chunk)
+      covMatrix+=np.dot(centered,centered.T)
+    covMatrix/=float(k)
+    eigVal,eigVec=sp.eigh(covMatrix, subset_by_index=[i*j-count, i*j-1], overwrite_a=True)
+    return eigVal[::-1], eigVec[:,::-1]
+  count=k if pcNumber is None else min(pcNumber, k)
+  # the Gram matrix is filled one pair of chunks at a time, so two chunks are in memory together
+  chunkSize=max(1, outOfCoreChunkSize(i, memoryCeiling, (3*k**2+2*i*j*count)*itemSize)//2)
+  gram=np.zeros((k,k))
+  chunks=list(specimenChunks(k, chunkSize))
+  for index, rowChunk in enumerate(chunks):
+    rowCentered=centeredChunk(allLandmarkSets, meanVec, rowChunk)
+    gram[rowChunk,rowChunk]=np.dot(rowCentered.T,rowCentered)
+    for columnChunk in chunks[index+1:]:
+      block=np.dot(rowCentered.T,centeredChunk(allLandmarkSets, meanVec, columnChunk))
+      gram[rowChunk,columnChunk]=block
+      gram[columnChunk,rowChunk]=block.T
+  gram/=float(k)
+  eigVal,gramVec=sp.eigh(gram, subset_by_index=[k-count, k-1], overwrite_a=True)
+  del gram
+  eigVal=eigVal[::-1]
+  gramVec=gramVec[:,::-1]
+  eigVec=np.zeros((i*j,count))
+  for chunk in chunks:
+    eigVec+=np.dot(centeredChunk(allLandmarkSets, meanVec, chunk),gramVec[chunk])
+  norms=np.linalg.norm(eigVec, axis=0)
+  nonZero=norms > 1e-10*max(norms.max(), np.finfo(float).tiny)
+  eigVec[:,nonZero]/=norms[nonZero]
+  eigVec[:,~nonZero]=0
+  return eigVal, eigVec
@@ -0,0 +1,339 @@
+"""
+File input/output helpers for the GPA module. Nothing here depends on Slicer, so the
+functions can also be used from a plain python interpreter.
+"""
+import os
+import json
+import numpy as np
+
+import Support.process_lib as process_lib
+
+# Results bundle: one uncompressed .npy file per array, so every array can be memory-mapped
+# on reload, plus a bundle.json manifest that is written last.
+BUNDLE_FOLDER_NAME = "resultsBundle"
+BUNDLE_MANIFEST_NAME = "bundle.json"
+BUNDLE_VERSION = 1
+
+
+def hasResultsBundle(resultsFolder):
+    return os.path.isfile(os.path.join(resultsFolder, BUNDLE_FOLDER_NAME, BUNDLE_MANIFEST_NAME))
+
+
+def writeResultsBundle(resultsFolder, arrays, metadata):
+    """
+    Writes the numpy arrays in the arrays dictionary and the JSON serializable metadata
+    dictionary to the bundle folder inside resultsFolder. Returns the bundle folder path.
+    """
+    bundleFolder = os.path.join(resultsFolder, BUNDLE_FOLDER_NAME)
+    os.makedirs(bundleFolder, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(bundleFolder, name + ".npy"), np.asarray(array), allow_pickle=False)
+    manifest = {
+        "version": BUNDLE_VERSION,
+        "arrays": sorted(arrays.keys()),
+        "metadata": metadata,
+    }
+    with open(os.path.join(bundleFolder, BUNDLE_MANIFEST_NAME), 'w') as manifestFile:
+        json.dump(manifest, manifestFile, indent=2)
+    return bundleFolder
+
+
+def readResultsBundle(resultsFolder, mmapMode='r'):
+    """
+    Reads a bundle written by writeResultsBundle. Arrays are memory-mapped unless mmapMode is None.
+    Returns the arrays dictionary and the metadata dictionary.
+    """
+    bundleFolder = os.path.join(resultsFolder, BUNDLE_FOLDER_NAME)
+    with open(os.path.join(bundleFolder, BUNDLE_MANIFEST_NAME)) as manifestFile:
+        manifest = json.load(manifestFile)
+    if manifest["version"] > BUNDLE_VERSION:
+        raise ValueError(f"Results bundle version {manifest['version']} is newer than supported version {BUNDLE_VERSION}")
+    arrays = {}
+    for name in manifest["arrays"]:
+        arrays[name] = np.load(os.path.join(bundleFolder, name + ".npy"), mmap_mode=mmapMode, allow_pickle=False)
+    return arrays, manifest["metadata"]
+
+
+def createLandmarkMemmap(filePath, landmarkNumber, specimenNumber):
+    """
+    Creates a .npy file for a (landmarks x 3 x specimens) float64 array and returns it as a writable
+    memory map. The file is in Fortran order, so the coordinates of each specimen are contiguous and
+    the out-of-core GPA in gpa_lib reads whole chunks of specimens sequentially.
+    """
+    return np.lib.format.open_memmap(filePath, mode='w+', dtype=float, shape=(landmarkNumber, 3, specimenNumber), fortran_order=True)
+
+
+# PC sweep frame stack: all warped states of a sweep in one (frames x points x 3) .npy file,
+# written through a memory map, plus a frameStack.json manifest that is written last.
+FRAME_STACK_ARRAY_NAME = "frames.npy"
+FRAME_STACK_MANIFEST_NAME = "frameStack.json"
+FRAME_STACK_VERSION = 1
+
+
+def createFrameStack(folder, frameNumber, pointNumber, dtype=np.float32):
+    """
+    Creates the frame array of a frame stack in folder and returns it as a writable memory map.
+    float32 halves the file size and is precise enough for display.
+    """
+    os.makedirs(folder, exist_ok=True)
+    return np.lib.format.open_memmap(os.path.join(folder, FRAME_STACK_ARRAY_NAME), mode='w+', dtype=dtype, shape=(frameNumber, pointNumber, 3))
+
+
+def writeFrameStackManifest(folder, metadata):
+    manifest = {
+        "version": FRAME_STACK_VERSION,
+        "metadata": metadata,
+    }
+    with open(os.path.join(folder, FRAME_STACK_MANIFEST_NAME), 'w') as manifestFile:
+        json.dump(manifest, manifestFile, indent=2)
+
+
+def readFrameStack(folder, mmapMode='r'):
+    """
+    Reads a frame stack written with createFrameStack and writeFrameStackManifest.
+    Returns the (frames x points x 3) array, memory-mapped unless mmapMode is None, and the metadata dictionary.
+    """
+    with open(os.path.join(folder, FRAME_STACK_MANIFEST_NAME)) as manifestFile:
+        manifest = json.load(manifestFile)
+    if manifest["version"] > FRAME_STACK_VERSION:
+        raise ValueError(f"Frame stack version {manifest['version']} is newer than supported version {FRAME_STACK_VERSION}")
+    frames = np.load(os.path.join(folder, FRAME_STACK_ARRAY_NAME), mmap_mode=mmapMode, allow_pickle=False)
+    return frames, manifest["metadata"]
+
+
+# Landmark ingestion
+def parseFcsvLandmarks(text):
+    """
+    Parses the text of a legacy .fcsv markups file. Returns (points, defined, descriptions) where
+    points is a (landmarks x 3) array, defined a boolean array and descriptions a list of strings.
+    """
+    rows = [line.rstrip('\r').split(',') for line in text.split('\n') if line.strip() and line[0] != '#']
+    points = np.array([row[1:4] for row in rows], dtype=float).reshape(-1, 3)
+    defined = np.ones(len(rows), dtype=bool)
+    descriptions = [row[12] if len(row) > 12 else "" for row in rows]
+    return points, defined, descriptions
+
+
+def parseMarkupsJsonLandmarks(text):
+    """
+    Parses the control points of the first markup in the text of a .mrk.json file.
+    Returns (points, defined, descriptions) as parseFcsvLandmarks.
+    """
+    controlPoints = json.loads(text)['markups'][0]['controlPoints']
+    points = np.array([controlPoint.get('position') or [0, 0, 0] for controlPoint in controlPoints], dtype=float).reshape(-1, 3)
+    defined = np.array([controlPoint.get('positionStatus', 'defined') == 'defined' for controlPoint in controlPoints], dtype=bool)
+    descriptions = [controlPoint.get('description', "") for controlPoint in controlPoints]
+    return points, defined, descriptions
+
+
+def parseLandmarkText(filePath, text):
+    if filePath.lower().endswith('.fcsv'):
+        return parseFcsvLandmarks(text)
+    return parseMarkupsJsonLandmarks(text)
+
+
+def readLandmarkFile(filePath):
+    with open(filePath, encoding='utf-8') as landmarkFile:
+        return parseLandmarkText(filePath, landmarkFile.read())
+
+
+class LandmarkCache:
+    """
+    On-disk cache of parsed landmark files, to pass as readFunction to loadLandmarkArray.
+    Parsed arrays are stored once per file content hash; an index maps each file path to the
+    modification time, size and content hash seen last. Files whose path, modification time and
+    size match the index are loaded from the cache without being read, files that changed are
+    hashed and only parsed if that content has not been seen before.
+    Call save() after loading to persist the index.
+    """
+    INDEX_NAME = "index.json"
+
+    def __init__(self, cacheFolder):
+        import threading
+        self.cacheFolder = cacheFolder
+        os.makedirs(cacheFolder, exist_ok=True)
+        self.lock = threading.Lock()
+        self.index = {}
+        try:
+            with open(os.path.join(cacheFolder, self.INDEX_NAME)) as indexFile:
+                self.index = json.load(indexFile)
+        except (OSError, ValueError):
+            pass
+        self.resetStatistics()
+
+    def resetStatistics(self):
+        self.hits = 0
+        self.misses = 0
+        self.bytesRead = 0
+        self.bytesWritten = 0
+
+    def statistics(self):
+        return {"hits": self.hits, "misses": self.misses, "bytesRead": self.bytesRead, "bytesWritten": self.bytesWritten}
+
+    def payloadPath(self, contentHash):
+        return os.path.join(self.cacheFolder, contentHash + ".npz")
+
+    def loadPayload(self, contentHash):
+        payloadPath = self.payloadPath(contentHash)
+        with np.load(payloadPath, allow_pickle=False) as payload:
+            parsed = payload['points'], payload['defined'], payload['descriptions'].tolist()
+        return parsed, os.path.getsize(payloadPath)
+
+    def read(self, filePath):
+        import hashlib
+        filePath = os.path.abspath(filePath)
+        fileStat = os.stat(filePath)
+        with self.lock:
+            entry = self.index.get(filePath)
+        if entry is not None and entry["mtime"] == fileStat.st_mtime_ns and entry["size"] == fileStat.st_size:
+            try:
+                parsed, payloadSize = self.loadPayload(entry["hash"])
+                with self.lock:
+                    self.hits += 1
+                    self.bytesRead += payloadSize
+                return parsed
+            except (OSError, ValueError, KeyError):
+                pass
+        with open(filePath, 'rb') as landmarkFile:
+            content = landmarkFile.read()
+        contentHash = hashlib.blake2b(content, digest_size=20).hexdigest()
+        try:
+            parsed, payloadSize = self.loadPayload(contentHash)
+            with self.lock:
+                self.hits += 1
+                self.bytesRead += payloadSize
+        except (OSError, ValueError, KeyError):
+            parsed = parseLandmarkText(filePath, content.decode('utf-8'))
+            points, defined, descriptions = parsed
+            temporaryPath = self.payloadPath(contentHash) + f".{os.getpid()}.{id(content)}.tmp"
+            with open(temporaryPath, 'wb') as payloadFile:
+                np.savez(payloadFile, points=points, defined=defined, descriptions=np.array(descriptions, dtype=str))
+            os.replace(temporaryPath, self.payloadPath(contentHash))
+            with self.lock:
+                self.misses += 1
+                self.bytesWritten += os.path.getsize(self.payloadPath(contentHash))
+        with self.lock:
+            self.index[filePath] = {"mtime": fileStat.st_mtime_ns, "size": fileStat.st_size, "hash": contentHash}
+        return parsed
+
+    def save(self):
+        indexPath = os.path.join(self.cacheFolder, self.INDEX_NAME)
+        with self.lock:
+            with open(indexPath + ".tmp", 'w') as indexFile:
+                json.dump(self.index, indexFile)
+        os.replace(indexPath + ".tmp", indexPath)
+
+
+def _readLandmarkFileForPool(filePath):
+    # process pool workers return the parsed arrays, or the error message
+    try:
+        return readLandmarkFile(filePath), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def loadLandmarkArray(filePathList, lmToRemove=(), workers=None, useProcesses=False, progressCallback=None, progressInterval=0.2, readFunction=None, out=None):
+    """
+    Reads .fcsv/.mrk.json landmark files into a preallocated (landmarks x 3 x files) array using a
+    thread pool (or a process pool if useProcesses is set). The first file that can be read defines the
+    landmark number and the semi-landmark list; an empty file list raises a ValueError, as does a list
+    with no readable file. lmToRemove holds zero-based indices of landmarks left out of the array.
+
+    A file that cannot be read or has a different landmark number does not stop the load: its slice
+    is left as NaN and the file is listed in the returned errors. Kept landmarks whose position is
+    not defined are listed in the returned undefinedLandmarks.
+
+    progressCallback(filesDone, fileNumber) is called from the calling thread at most every
+    progressInterval seconds and once when all files are read.
+    readFunction(filePath) can replace readLandmarkFile, e.g. to add caching; it must be thread safe.
+    Process pool workers always use readLandmarkFile, so readFunction and useProcesses raise a ValueError
+    together.
+    out is an optional (kept landmarks x 3 x files) array to fill instead of allocating one, such as
+    a memory map from createLandmarkMemmap for datasets that do not fit in memory.
+
+    Returns landmarks, landmarkTypeArray (one-based numbers of semi-landmarks, as strings),
+    errors (list of (filePath, message)) and undefinedLandmarks (dictionary of filePath to
+    zero-based landmark indices).
+    """
+    import time
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+    if readFunction is None:
+        readFunction = readLandmarkFile
+    elif useProcesses:
+        raise ValueError("readFunction, e.g. LandmarkCache.read, cannot be combined with useProcesses: the process pool workers read the files with readLandmarkFile.")
+    fileNumber = len(filePathList)
+    if fileNumber == 0:
+        raise ValueError("There are no landmark files to load.")
+    errors = []
+    for firstIndex, filePath in enumerate(filePathList):
+        try:
+            points, defined, descriptions = readFunction(filePath)
+            break
+        except Exception as e:
+            errors.append((filePath, f"{type(e).__name__}: {e}"))
+    else:
+        raise ValueError(f"None of the {fileNumber} landmark files can be read, the first failed with {errors[0][1]}")
+    landmarkNumber = len(points)
+    landmarkTypeArray = [str(index + 1) for index, description in enumerate(descriptions) if description == 'Semi']
+    keep = np.ones(landmarkNumber, dtype=bool)
+    keep[[index for index in lmToRemove if 0 <= index < landmarkNumber]] = False
+    keptIndices = np.flatnonzero(keep)
+    if out is None:
+        landmarks = np.full((len(keptIndices), 3, fileNumber), np.nan)
+    elif out.shape != (len(keptIndices), 3, fileNumber):
+        raise ValueError(f"The output array has shape {out.shape} instead of {(len(keptIndices), 3, fileNumber)}")
+    else:
+        landmarks = out
+        landmarks[:] = np.nan
+    undefinedLandmarks = {}
+
+    def store(fileIndex, parsed):
+        points, defined, descriptions = parsed
+        if len(points) != landmarkNumber:
+            errors.append((filePathList[fileIndex], f"There are {len(points)} landmarks instead of the expected {landmarkNumber}."))
+            return
+        landmarks[:, :, fileIndex] = points[keep]
+        undefined = keptIndices[~defined[keep]]
+        if len(undefined):
+            undefinedLandmarks[filePathList[fileIndex]] = undefined.tolist()
+
+    def readAndStore(fileIndex):
+        try:
+            parsed = readFunction(filePathList[fileIndex])
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+        store(fileIndex, parsed)
+        return None
+
+    store(firstIndex, (points, defined, descriptions))
+    filesDone = firstIndex + 1
+    lastProgressTime = time.time()
+    if useProcesses:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=process_lib.processContext())
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    with executor:
+        if useProcesses:
+            futures = {executor.submit(_readLandmarkFileForPool, filePathList[fileIndex]): fileIndex for fileIndex in range(firstIndex + 1, fileNumber)}
+        else:
+            futures = {executor.submit(readAndStore, fileIndex): fileIndex for fileIndex in range(firstIndex + 1, fileNumber)}
+        for future in as_completed(futures):
+            fileIndex = futures[future]
+            if useProcesses:
+                parsed, message = future.result()
+                if parsed is not None:
+                    store(fileIndex, parsed)
+            else:
+                message = future.result()
+            if message is not None:
+                errors.append((filePathList[fileIndex], message))
+            filesDone += 1
+            if progressCallback is not None and time.time() - lastProgressTime > progressInterval:
+                lastProgressTime = time.time()
+                progressCallback(filesDone, fileNumber)
+    if progressCallback is not None:
+        progressCallback(fileNumber, fileNumber)
+    fileOrder = {filePath: fileIndex for fileIndex, filePath in enumerate(filePathList)}
+    errors.sort(key=lambda error: fileOrder[error[0]])
+    return landmarks, landmarkTypeArray, errors, undefinedLandmarks
@@ -0,0 +1,66 @@
+"""
+Vectorized shape variation kernels: covariance matrix, per-landmark variance and Procrustes distances.
+
+Every kernel takes a dtype argument. np.float64 (the default) gives the same results as the
+original per-specimen loops up to rounding; np.float32 halves the memory of the temporaries
+and the output, which matters for the (3 x landmarks)^2 covariance matrix.
+Landmark arrays are (landmarks x 3 x specimens), as everywhere else in the GPA module.
+"""
+import numpy as np
+
+# Number of array elements processed per block by the landmark kernels, so the temporary
+# difference array stays small (8 MB in float64) for any dataset
+BLOCK_ELEMENTS = 2**20
+
+
+def specimenBlockSize(landmarks):
+    i, j, k = landmarks.shape
+    return max(1, BLOCK_ELEMENTS // (i * j))
+
+
+def covariance(vec, dtype=np.float64):
+    """
+    Covariance matrix of vec, which holds one observation per column, normalized by the
+    number of observations (as gpa_lib.calcCov).
+    """
+    vec = np.asarray(vec, dtype=dtype)
+    centered = vec - vec.mean(axis=1, keepdims=True)
+    return np.dot(centered, centered.T) / np.dtype(dtype).type(vec.shape[1])
+
+
+def squaredDeviationSum(landmarks, meanShape, dtype=np.float64):
+    """
+    Sum over specimens of the squared coordinate differences to meanShape, as a (landmarks x 3) array.
+    """
+    i, j, k = landmarks.shape
+    meanShape = np.asarray(meanShape, dtype=dtype)
+    total = np.zeros((i, j), dtype=dtype)
+    blockSize = specimenBlockSize(landmarks)
+    for start in range(0, k, blockSize):
+        difference = np.asarray(landmarks[:, :, start:start + blockSize], dtype=dtype) - meanShape[:, :, np.newaxis]
+        total += np.einsum('ijk,ijk->ij', difference, difference)
+    return total
+
+
+def landmarkVariance(landmarks, meanShape, scaleFactor=1.0, dtype=np.float64):
+    """
+    Per landmark and coordinate standard deviation around meanShape (k - 1 normalization),
+    multiplied by scaleFactor.
+    """
+    k = landmarks.shape[2]
+    scalarType = np.dtype(dtype).type
+    return scalarType(scaleFactor) * np.sqrt(squaredDeviationSum(landmarks, meanShape, dtype) / scalarType(k - 1))
+
+
+def procrustesDistances(landmarks, meanShape, dtype=np.float64):
+    """
+    Frobenius distance of each specimen to meanShape. Returns an array of length specimens.
+    """
+    k = landmarks.shape[2]
+    meanShape = np.asarray(meanShape, dtype=dtype)
+    distances = np.empty(k, dtype=dtype)
+    blockSize = specimenBlockSize(landmarks)
+    for start in range(0, k, blockSize):
+        difference = np.asarray(landmarks[:, :, start:start + blockSize], dtype=dtype) - meanShape[:, :, np.newaxis]
+        distances[start:start + blockSize] = np.sqrt(np.einsum('ijk,ijk->k', difference, difference))
+    return distances
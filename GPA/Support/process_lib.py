@@ -0,0 +1,40 @@
+"""
+Process pools that work inside Slicer.
+
+Forking the running Slicer application copies its Qt and VTK state into every worker, and the spawn
+start method starts sys.executable, which in Slicer is the application rather than a python
+interpreter. processContext returns a spawn context that starts the PythonSlicer launcher instead;
+pass it as the mp_context of a ProcessPoolExecutor. Worker functions and their arguments must then
+be picklable and importable from the worker, e.g. module level functions of the Support package.
+"""
+import os
+import sys
+
+
+def pythonExecutable():
+    """
+    Python interpreter to start worker processes with. In Slicer sys.executable is the application,
+    so the PythonSlicer launcher next to it is used.
+    """
+    import shutil
+
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+    for name in ('PythonSlicer', 'PythonSlicer.exe'):
+        candidate = os.path.join(os.path.dirname(sys.executable), name)
+        if os.path.isfile(candidate):
+            return candidate
+    return shutil.which('PythonSlicer')
+
+
+def processContext():
+    """
+    Spawn multiprocessing context whose workers run pythonExecutable.
+    """
+    import multiprocessing
+
+    context = multiprocessing.get_context('spawn')
+    executable = pythonExecutable()
+    if executable is not None:
+        context.set_executable(executable)
+    return context
@@ -0,0 +1,201 @@
+"""
+Bootstrap and permutation resampling of GPA + PCA shape statistics.
+
+Replicates run in a process pool. The landmark array is sent to every worker once, when the pool
+starts, and replicates are submitted in batches, so the per replicate overhead is a few numbers.
+Every replicate draws from its own numpy SeedSequence spawned from the seed, which makes the
+results independent of the number of workers and of the order in which replicates finish.
+
+bootstrap: specimens are resampled with replacement and the batched GPA solver and the PCA are run
+on every replicate. Replicate shapes are rotated onto the reference mean shape before the PCA, so
+the eigenvectors can be compared with the reference ones.
+permutation: group labels are permuted over the specimens of the reference alignment, which does
+not depend on the labels. The statistics are the fraction of shape variance explained by the groups
+(R squared of a Procrustes ANOVA) and the Procrustes distances between group means.
+"""
+import numpy as np
+
+import Support.gpa_lib as gpa_lib
+import Support.process_lib as process_lib
+
+DEFAULT_BATCH_SIZE = 16
+
+# Data shared by the replicates of one pool, set once per worker process
+_workerData = {}
+
+
+def rotationOnto(refShape, shape):
+    """
+    Rotation matrix R minimizing |shape . R - refShape|, as gpa_lib.alignShape computes it.
+    """
+    u, s, v = np.linalg.svd(np.dot(np.transpose(refShape), shape))
+    return np.transpose(np.dot(u, v))
+
+
+def principalComponents(aligned, pcNumber):
+    """
+    Leading pcNumber eigenvalues and eigenvectors of the covariance of the aligned (landmarks x 3 x
+    specimens) array, and the total variance.
+    """
+    i, j, k = aligned.shape
+    twoDim = gpa_lib.makeTwoDim(aligned)
+    totalVariance = np.einsum('ij,ij->', twoDim, twoDim) / float(k)
+    if k > i * j:
+        eigVal, eigVec = np.linalg.eigh(gpa_lib.calcCov(twoDim))
+        eigVal = eigVal[::-1]
+        eigVec = eigVec[:, ::-1]
+    else:
+        eigVal, eigVec = gpa_lib.calcEigenGram(twoDim)
+    return eigVal[:pcNumber], eigVec[:, :pcNumber], totalVariance
+
+
+def referenceAnalysis(landmarks, scale=True, pcNumber=10):
+    """
+    GPA and PCA of the full sample, the reference the replicates are compared with.
+    """
+    aligned, meanShape, trace = gpa_lib.runGPASolver(np.array(landmarks, dtype=float), scale)
+    eigVal, eigVec, totalVariance = principalComponents(aligned, pcNumber)
+    return {
+        'aligned': aligned,
+        'meanShape': meanShape,
+        'eigenvalues': eigVal,
+        'eigenvectors': eigVec,
+        'varianceExplained': eigVal / totalVariance,
+    }
+
+
+def groupStatistics(twoDim, groupIndices, groupNumber):
+    """
+    Fraction of the total sum of squares between groups, and the condensed Procrustes distances
+    between group means, of the centered (coordinates x specimens) twoDim array.
+    """
+    counts = np.bincount(groupIndices, minlength=groupNumber)
+    groupMeans = np.zeros((twoDim.shape[0], groupNumber))
+    np.add.at(groupMeans.T, groupIndices, twoDim.T)
+    groupMeans /= counts
+    totalSumOfSquares = np.einsum('ij,ij->', twoDim, twoDim)
+    betweenSumOfSquares = np.dot(np.einsum('ij,ij->j', groupMeans, groupMeans), counts)
+    rows, columns = np.triu_indices(groupNumber, 1)
+    distances = np.linalg.norm(groupMeans[:, rows] - groupMeans[:, columns], axis=0)
+    return betweenSumOfSquares / totalSumOfSquares, distances
+
+
+def bootstrapReplicate(seedSequence):
+    data = _workerData
+    landmarks = data['landmarks']
+    rng = np.random.default_rng(seedSequence)
+    sample = rng.integers(0, landmarks.shape[2], landmarks.shape[2])
+    aligned, meanShape, trace = gpa_lib.runGPASolver(landmarks[:, :, sample].copy(), data['scale'])
+    rotation = rotationOnto(data['meanShape'], meanShape)
+    aligned = np.einsum('ijk,jl->ilk', aligned, rotation)
+    eigVal, eigVec, totalVariance = principalComponents(aligned, data['pcNumber'])
+    cosines = np.abs(np.einsum('ij,ij->j', eigVec, data['eigenvectors'][:, :eigVec.shape[1]]))
+    return {
+        'varianceExplained': eigVal / totalVariance,
+        'eigenvectorAngles': np.degrees(np.arccos(np.clip(cosines, 0, 1))),
+        'procrustesDistances': np.linalg.norm(np.dot(meanShape, rotation) - data['meanShape']),
+    }
+
+
+def permutationReplicate(seedSequence):
+    data = _workerData
+    rng = np.random.default_rng(seedSequence)
+    varianceExplained, distances = groupStatistics(data['twoDim'], rng.permutation(data['groupIndices']), data['groupNumber'])
+    return {
+        'varianceExplained': varianceExplained,
+        'procrustesDistances': distances,
+    }
+
+
+def _initializeWorker(data):
+    _workerData.clear()
+    _workerData.update(data)
+
+
+def _runReplicateBatch(mode, seedSequences):
+    replicate = bootstrapReplicate if mode == 'bootstrap' else permutationReplicate
+    return [replicate(seedSequence) for seedSequence in seedSequences]
+
+
+def resample(landmarks, mode='bootstrap', replicateNumber=1000, groups=None, scale=True, pcNumber=10, seed=0,
+             workers=None, batchSize=DEFAULT_BATCH_SIZE, progressCallback=None):
+    """
+    Runs replicateNumber bootstrap or permutation replicates of the (landmarks x 3 x specimens) array.
+    groups: one label per specimen, needed for permutations.
+    scale: False for the GPA without scaling (Boas coordinates).
+    workers: process count, None for the number of CPUs; 1 runs the replicates in this process.
+    progressCallback(replicatesDone, replicateNumber) is called after every finished batch.
+    Returns a dictionary with the reference statistics and, under 'replicates', the per replicate
+    'varianceExplained', 'procrustesDistances' and, for bootstrap, 'eigenvectorAngles' (degrees) stacked
+    along the first axis. Permutations also return the p-value of the reference variance explained.
+    """
+    import time
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    if mode not in ('bootstrap', 'permutation'):
+        raise ValueError(f"Unknown resampling mode '{mode}'")
+    startTime = time.perf_counter()
+    landmarks = np.asarray(landmarks, dtype=float)
+    i, j, k = landmarks.shape
+    pcNumber = min(pcNumber, i * j, k - 1)
+    reference = referenceAnalysis(landmarks, scale, pcNumber)
+    results = {
+        'mode': mode,
+        'seed': seed,
+        'replicateNumber': replicateNumber,
+        'reference': {
+            'varianceExplained': reference['varianceExplained'],
+            'meanShape': reference['meanShape'],
+        },
+    }
+    if mode == 'bootstrap':
+        workerData = {
+            'landmarks': landmarks,
+            'scale': scale,
+            'pcNumber': pcNumber,
+            'meanShape': reference['meanShape'],
+            'eigenvectors': reference['eigenvectors'],
+        }
+    else:
+        if groups is None or len(groups) != k:
+            raise ValueError("Permutations need one group label per specimen")
+        groupNames, groupIndices = np.unique(np.asarray(groups), return_inverse=True)
+        workerData = {
+            'twoDim': gpa_lib.makeTwoDim(reference['aligned']),
+            'groupIndices': groupIndices,
+            'groupNumber': len(groupNames),
+        }
+        varianceExplained, distances = groupStatistics(workerData['twoDim'], groupIndices, len(groupNames))
+        results['groups'] = groupNames.tolist()
+        results['reference'] = {'varianceExplained': varianceExplained, 'procrustesDistances': distances}
+
+    seedSequences = np.random.SeedSequence(seed).spawn(replicateNumber)
+    batches = [(start, seedSequences[start:start + batchSize]) for start in range(0, replicateNumber, batchSize)]
+    replicates = [None] * replicateNumber
+    replicatesDone = 0
+    if workers == 1:
+        _initializeWorker(workerData)
+        for start, batch in batches:
+            replicates[start:start + len(batch)] = _runReplicateBatch(mode, batch)
+            replicatesDone += len(batch)
+            if progressCallback is not None:
+                progressCallback(replicatesDone, replicateNumber)
+        _workerData.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=process_lib.processContext(), initializer=_initializeWorker,
+                                 initargs=(workerData,)) as executor:
+            futures = {executor.submit(_runReplicateBatch, mode, batch): start for start, batch in batches}
+            for future in as_completed(futures):
+                batchResults = future.result()
+                start = futures[future]
+                replicates[start:start + len(batchResults)] = batchResults
+                replicatesDone += len(batchResults)
+                if progressCallback is not None:
+                    progressCallback(replicatesDone, replicateNumber)
+
+    results['replicates'] = {key: np.array([replicate[key] for replicate in replicates]) for key in replicates[0]} if replicateNumber else {}
+    if mode == 'permutation' and replicateNumber:
+        exceeding = np.count_nonzero(results['replicates']['varianceExplained'] >= results['reference']['varianceExplained'])
+        results['pValue'] = (exceeding + 1) / float(replicateNumber + 1)
+    results['seconds'] = time.perf_counter() - startTime
+    return results
@@ -0,0 +1,96 @@
+"""
+Thin plate spline warps evaluated with numpy.
+
+The spline is the one of vtkThinPlateSplineTransform with SetBasisToR() (the 3D thin plate basis
+U(r) = r): fitThinPlateSpline solves for the kernel weights and the affine part, and
+evaluateThinPlateSpline applies it to any number of points. Points are processed in chunks, in a
+thread pool (numpy releases the GIL for the kernel arithmetic), and the result can be written into
+an existing array such as a view of a model's points, so no VTK transform has to be hardened.
+"""
+import numpy as np
+
+DEFAULT_CHUNK_SIZE = 2048
+
+
+def fitThinPlateSpline(sourceLandmarks, targetLandmarks, sigma=1.0):
+    """
+    Returns the spline mapping the (landmarks x 3) sourceLandmarks onto targetLandmarks as a dictionary
+    with the centered source landmarks, their center, the (landmarks x 3) kernel weights and the
+    (4 x 3) affine coefficients. sigma scales distances as vtkThinPlateSplineTransform::SetSigma.
+    """
+    sourceLandmarks = np.asarray(sourceLandmarks, dtype=float)
+    targetLandmarks = np.asarray(targetLandmarks, dtype=float)
+    landmarkNumber = len(sourceLandmarks)
+    difference = sourceLandmarks[:, np.newaxis, :] - sourceLandmarks[np.newaxis, :, :]
+    system = np.zeros((landmarkNumber + 4, landmarkNumber + 4))
+    system[:landmarkNumber, :landmarkNumber] = np.sqrt(np.einsum('ijk,ijk->ij', difference, difference)) / sigma
+    system[:landmarkNumber, landmarkNumber] = 1
+    system[:landmarkNumber, landmarkNumber + 1:] = sourceLandmarks
+    system[landmarkNumber:, :landmarkNumber] = system[:landmarkNumber, landmarkNumber:].T
+    rightHandSide = np.zeros((landmarkNumber + 4, 3))
+    rightHandSide[:landmarkNumber] = targetLandmarks
+    # the minimum norm solution of the uncentered system is also what VTK returns for coplanar
+    # landmarks, where the affine part is not unique
+    coefficients = np.linalg.lstsq(system, rightHandSide, rcond=None)[0]
+    affine = coefficients[landmarkNumber:]
+    # evaluate relative to the landmark center, where the distances lose less precision
+    center = sourceLandmarks.mean(axis=0)
+    source = sourceLandmarks - center
+    affine[0] += np.dot(center, affine[1:])
+    return {
+        'source': source,
+        'center': center,
+        'sigma': sigma,
+        'weights': coefficients[:landmarkNumber],
+        'affine': affine,
+    }
+
+
+def evaluateThinPlateSplineChunk(spline, points):
+    points = np.asarray(points, dtype=float) - spline['center']
+    source = spline['source']
+    squaredDistance = np.zeros((len(points), len(source)))
+    for coordinate in range(3):
+        difference = np.subtract.outer(points[:, coordinate], source[:, coordinate])
+        difference *= difference
+        squaredDistance += difference
+    np.sqrt(squaredDistance, out=squaredDistance)
+    squaredDistance /= spline['sigma']
+    warped = np.dot(squaredDistance, spline['weights'])
+    warped += spline['affine'][0]
+    warped += np.dot(points, spline['affine'][1:])
+    return warped
+
+
+def evaluateThinPlateSpline(spline, points, out=None, chunkSize=DEFAULT_CHUNK_SIZE, workers=None):
+    """
+    Applies the spline from fitThinPlateSpline to the (points x 3) array points. The result is written
+    into out, which may be points itself (e.g. slicer.util.arrayFromModelPoints) to warp in place, or
+    a new array if out is None. workers is the thread pool size, None for the default.
+    Returns out.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    if out is None:
+        out = np.empty((len(points), 3))
+    chunks = [slice(start, min(start + chunkSize, len(points))) for start in range(0, len(points), chunkSize)]
+
+    def warpChunk(chunk):
+        out[chunk] = evaluateThinPlateSplineChunk(spline, points[chunk])
+
+    if len(chunks) == 1:
+        warpChunk(chunks[0])
+        return out
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(warpChunk, chunks):
+            pass
+    return out
+
+
+def gridPoints(origin, spacing, extent):
+    """
+    Coordinates of the points of a regular grid as a (points x 3) array, x index varying fastest,
+    in the order of vtkImageData and vtkTransformToGrid.
+    """
+    axes = [origin[axis] + spacing[axis] * np.arange(extent[2 * axis], extent[2 * axis + 1] + 1) for axis in range(3)]
+    z, y, x = np.meshgrid(axes[2], axes[1], axes[0], indexing='ij')
+    return np.column_stack((x.ravel(), y.ravel(), z.ravel()))
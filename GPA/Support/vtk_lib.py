@@ -1,4 +1,5 @@
 from __main__ import vtk
+import numpy as np
 
 def resliceThroughTransform( sourceNode, transform, referenceNode, targetNode):
     """
@@ -55,6 +56,151 @@ def createTPS( sourceLM, targetLM):
     #resliceThroughTransform(moving, thinPlateTransform, fixed, transformed)
 
 
+def createDisplacementGrid(origin, spacing, extent):
+    """
+Creates an empty double precision displacement grid for a vtkGridTransform.
+Returns the vtkImageData and a (points x 3) numpy view of its displacement vectors.
+"""
+    from vtk.util import numpy_support
+    gridData = vtk.vtkImageData()
+    gridData.SetOrigin(origin)
+    gridData.SetSpacing(spacing)
+    gridData.SetExtent(extent)
+    gridData.AllocateScalars(vtk.VTK_DOUBLE, 3)
+    gridArray = numpy_support.vtk_to_numpy(gridData.GetPointData().GetScalars())
+    gridArray[:] = 0
+    return gridData, gridArray
+
+
+def decimatePolyData(polyData, targetReduction):
+    """
+Quadric decimation removing about targetReduction (0-1) of the triangles of polyData.
+Returns a new vtkPolyData with point normals.
+"""
+    triangles = vtk.vtkTriangleFilter()
+    triangles.SetInputData(polyData)
+    decimation = vtk.vtkQuadricDecimation()
+    decimation.SetInputConnection(triangles.GetOutputPort())
+    decimation.SetTargetReduction(targetReduction)
+    decimation.VolumePreservationOn()
+    normals = vtk.vtkPolyDataNormals()
+    normals.SetInputConnection(decimation.GetOutputPort())
+    normals.SplittingOff()
+    normals.Update()
+    output = vtk.vtkPolyData()
+    output.DeepCopy(normals.GetOutput())
+    return output
+
+
+def createGridTransform(gridData, interpolation='cubic'):
+    """
+Creates a vtkGridTransform from a displacement grid, e.g. from createDisplacementGrid.
+Evaluating it per voxel only interpolates the grid, which is much cheaper than a thin plate spline.
+"""
+    transform = vtk.vtkGridTransform()
+    transform.SetDisplacementGridData(gridData)
+    if interpolation == 'cubic':
+        transform.SetInterpolationModeToCubic()
+    else:
+        transform.SetInterpolationModeToLinear()
+    return transform
+
+
+def resliceImageThroughTransform(imageData, sourceRASToIJK, transform, outputIJKToRAS, outputDimensions, numberOfThreads=None):
+    """
+Like resliceThroughTransform, but for vtkImageData and geometry matrices instead of volume nodes, and
+multithreaded: numberOfThreads limits the thread count, None lets VTK use all cores.
+transform maps output RAS positions to source RAS positions. Returns the resliced vtkImageData.
+"""
+    resliceTransform = vtk.vtkGeneralTransform()
+    resliceTransform.Concatenate(sourceRASToIJK)
+    resliceTransform.Concatenate(transform)
+    resliceTransform.Concatenate(outputIJKToRAS)
+    reslice = vtk.vtkImageReslice()
+    reslice.SetInterpolationModeToLinear()
+    reslice.InterpolateOn()
+    reslice.SetResliceTransform(resliceTransform)
+    reslice.SetInputData(imageData)
+    reslice.SetOutputExtent(0, outputDimensions[0]-1, 0, outputDimensions[1]-1, 0, outputDimensions[2]-1)
+    reslice.SetOutputOrigin((0,0,0))
+    reslice.SetOutputSpacing((1,1,1))
+    if hasattr(reslice, 'SetEnableSMP'):
+        reslice.SetEnableSMP(True)
+    if numberOfThreads is not None:
+        reslice.SetNumberOfThreads(numberOfThreads)
+    reslice.Update()
+    output = vtk.vtkImageData()
+    output.ShallowCopy(reslice.GetOutput())
+    return output
+
+
+def downsampleImage(imageData, ijkToRAS, factor):
+    """
+Averages blocks of factor^3 voxels. Returns the downsampled vtkImageData (origin 0, spacing 1, as the
+image data of a volume node) and its IJK to RAS matrix.
+"""
+    shrink = vtk.vtkImageShrink3D()
+    shrink.SetShrinkFactors(factor, factor, factor)
+    shrink.AveragingOn()
+    shrink.SetInputData(imageData)
+    shrink.Update()
+    output = vtk.vtkImageData()
+    output.DeepCopy(shrink.GetOutput())
+    output.SetOrigin(0, 0, 0)
+    output.SetSpacing(1, 1, 1)
+    extent = output.GetExtent()
+    output.SetExtent(0, extent[1]-extent[0], 0, extent[3]-extent[2], 0, extent[5]-extent[4])
+    # downsampled voxel p covers source voxels factor*p ... factor*p + factor - 1
+    downsampleToSource = vtk.vtkMatrix4x4()
+    for axis in range(3):
+        downsampleToSource.SetElement(axis, axis, factor)
+        downsampleToSource.SetElement(axis, 3, factor*extent[2*axis] + (factor-1)/2.0)
+    downsampledIJKToRAS = vtk.vtkMatrix4x4()
+    vtk.vtkMatrix4x4.Multiply4x4(ijkToRAS, downsampleToSource, downsampledIJKToRAS)
+    return output, downsampledIJKToRAS
+
+
+class WarpCache:
+    """
+Keeps the most recently used displacement grids and preview images of volume warps, so returning to a
+PC state or warping the same volume again does not repeat the sampling.
+"""
+    def __init__(self, maximumEntries=16):
+        from collections import OrderedDict
+        self.maximumEntries = maximumEntries
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maximumEntries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+def transformPointArray(transform, points):
+    """
+Applies a VTK transform to a (points x 3) numpy array in one TransformPoints call.
+Returns the transformed points as a new (points x 3) array.
+"""
+    from vtk.util import numpy_support
+    points = np.ascontiguousarray(points, dtype=float)
+    inputPoints = vtk.vtkPoints()
+    inputPoints.SetData(numpy_support.numpy_to_vtk(points))
+    outputPoints = vtk.vtkPoints()
+    outputPoints.SetDataTypeToDouble()
+    transform.TransformPoints(inputPoints, outputPoints)
+    return numpy_support.vtk_to_numpy(outputPoints.GetData()).copy()
+
+
 def convertFudicialToVTKPoint(fnode):
     import numpy as np
     numberOfLM=fnode.GetNumberOfFiducials()
@@ -74,14 +220,56 @@ def convertFudicialToVTKPoint(fnode):
     return points
 
 def convertNumpyToVTK(A):
-    x,y=A.shape
+    """
+Converts a (points x 3) numpy array to vtkPoints with a single bulk copy.
+"""
+    from vtk.util import numpy_support
     points=vtk.vtkPoints()
-    for i in range(x):
-        points.InsertNextPoint(A[i,0], A[i,1], A[i,2])
-#
+    points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(A[:,:3], dtype=float), deep=True))
     return points
 
 
+def numpyToVTKArray(values, name, arrayType=None):
+    """
+Copies a (tuples) or (tuples x components) numpy array to a new named vtkDataArray.
+arrayType is a vtk type constant such as vtk.VTK_FLOAT; by default the numpy dtype decides.
+"""
+    from vtk.util import numpy_support
+    values=np.asarray(values)
+    if arrayType is not None:
+        values=values.astype(numpy_support.get_vtk_to_numpy_typemap()[arrayType])
+    array=numpy_support.numpy_to_vtk(np.ascontiguousarray(values), deep=True, array_type=arrayType)
+    array.SetName(name)
+    return array
+
+
+def stringsToVTKArray(values, name):
+    array=vtk.vtkStringArray()
+    array.SetName(name)
+    array.SetNumberOfValues(len(values))
+    for index, value in enumerate(values):
+        array.SetValue(index, str(value))
+    return array
+
+
+def setTableColumns(tableNode, columns):
+    """
+Replaces the columns of a vtkMRMLTableNode. columns is a list of (name, values) pairs of equal length:
+lists of strings become string columns, numpy arrays become float columns. Each column is
+filled in one pass instead of cell by cell.
+"""
+    table=tableNode.GetTable()
+    wasModifying=tableNode.StartModify()
+    tableNode.RemoveAllColumns()
+    for name, values in columns:
+        if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+            tableNode.AddColumn(numpyToVTKArray(values, name, vtk.VTK_FLOAT))
+        else:
+            tableNode.AddColumn(stringsToVTKArray(values, name))
+    table.Modified()
+    tableNode.EndModify(wasModifying)
+
+
 # def test():
 #     mrml=slicer.mrmlScene
 #     tnode=slicer.vtkMRMLScalarVolumeNode()
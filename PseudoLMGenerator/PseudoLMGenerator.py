@@ -23,7 +23,7 @@ class PseudoLMGenerator(ScriptedLoadableModule):
     ScriptedLoadableModule.__init__(self, parent)
     self.parent.title = "PseudoLMGenerator" # TODO make this more human readable by adding spaces
     self.parent.categories = ["SlicerMorph.Geometric Morphometrics"]
-    self.parent.dependencies = []
+    self.parent.dependencies = ["ALPACA"]
     self.parent.contributors = ["Sara Rolfe (UW), Murat Maga (UW)"] # replace with "Firstname Lastname (Organization)"
     self.parent.helpText = """
       This module densely samples pseudo-landmarks on the surface of a model.
@@ -468,6 +468,10 @@ class PseudoLMGeneratorLogic(ScriptedLoadableModuleLogic):
       normalFilter.SetInputData(sourcePolydata)
       normalFilter.Update()
       normalArray = normalFilter.GetOutput().GetPointData().GetArray("Normals")
+      if(not normalArray and sourcePolydata.GetNumberOfPoints() >= 3):
+        print("no surface cells, estimating normals from the points")
+        import ALPACALib.alpaca_lib as alpaca_lib
+        normalArray = alpaca_lib.estimatePolyDataNormals(sourcePolydata)
       if(not normalArray):
         print("Error: no normal array")
         return projectedPointData